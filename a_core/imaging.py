@@ -0,0 +1,344 @@
+"""
+Image processing shared by photos, avatars and showcase images.
+
+Resizing (``resize_image``) decodes JPEGs in draft mode close to the target
+size instead of at full resolution, applies the EXIF orientation, refuses
+images above MAX_IMAGE_PIXELS before decoding anything, and encodes into a
+spooled temporary file that storage reads from directly. Every call logs its
+timing and the process's peak RSS and attaches them to the result as
+``.metrics``.
+
+Responsive derivatives ("renditions"): every master image gets a few smaller
+copies in WebP and JPEG that are stored next to it, e.g.
+``portfolio/foo_max1920.jpg`` -> ``portfolio/foo_max1920_thumb.webp``. The
+names and pixel sizes are kept in a ``renditions`` JSONField on the owning
+model so templates can build ``srcset`` attributes without touching storage.
+
+Nothing here needs configured Django settings unless ``max_pixels`` is left
+out, so the functions can run in spawned worker processes.
+"""
+from io import BytesIO
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from .storage_backends import media_url
+
+
+logger = logging.getLogger(__name__)
+
+# Encoded output up to this size stays in memory, larger output spills to disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# (format name for Pillow, file extension, save options)
+MASTER_FORMAT = ("JPEG", "jpg", {"quality": 90})
+RENDITION_FORMATS = {
+    "webp": ("WEBP", "webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "jpg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+# EXIF orientations that turn the image by 90 degrees
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def _peak_rss_kb() -> int | None:
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _encode(img, image_format) -> File:
+    pil_format, _ext, options = image_format
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    img.save(spool, format=pil_format, **options)
+    encoded = File(spool)
+    encoded.size = spool.tell()
+    spool.seek(0)
+    return encoded
+
+
+def _target_size(width: int, height: int, size: int, mode: str):
+    """
+    Output size for `mode` before any crop, as (width, height).
+    "longest" never enlarges; "shortest" and "square" scale to fit.
+    """
+    if mode == "longest":
+        scale = min(1.0, size / max(width, height))
+    elif mode in ("shortest", "square"):
+        scale = size / min(width, height)
+    else:
+        raise ValueError(f"Unknown resize mode {mode!r}")
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def _check_pixels(width: int, height: int, max_pixels=None):
+    if max_pixels is None:
+        max_pixels = settings.MAX_IMAGE_PIXELS
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f"{width}x{height} pixels is more than the allowed {max_pixels:,}")
+
+
+def image_size(file_obj, max_pixels=None):
+    """
+    Width and height from the header, without decoding any pixels. Raises
+    ImageTooLarge above the pixel limit. Rewinds `file_obj` afterwards.
+    """
+    with Image.open(file_obj) as img:
+        width, height = img.size
+    file_obj.seek(0)
+    _check_pixels(width, height, max_pixels)
+    return width, height
+
+
+def open_image(file_obj, *, draft=None, max_pixels=None):
+    """
+    Open `file_obj` upright and in RGB.
+
+    The pixel limit is checked from the header alone. For JPEGs, `draft` is
+    called with the stored (un-rotated) width and height and returns the
+    smallest size that is still needed; libjpeg then decodes at 1/2, 1/4 or
+    1/8 scale as long as the result stays at least that large. Returns
+    ``(image, (full_width, full_height))`` with the upright size of the
+    original.
+    """
+    img = Image.open(file_obj)
+    width, height = img.size
+    _check_pixels(width, height, max_pixels)
+
+    if draft and img.format == "JPEG":
+        img.draft("RGB", draft(width, height))
+    if img.getexif().get(0x0112) in _TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return img, (width, height)
+
+
+def resize_image(file_obj, size: int, mode: str = "longest", *, max_pixels=None) -> File:
+    """
+    Resize an image and return it as a JPEG File ready to be saved.
+
+    mode "longest": longest side becomes `size` (smaller images are kept).
+    mode "shortest": shortest side becomes `size`.
+    mode "square": centre crop to a square, then `size` x `size`.
+    """
+    started = time.perf_counter()
+    img, (width, height) = open_image(
+        file_obj,
+        draft=lambda w, h: _target_size(w, h, size, mode),
+        max_pixels=max_pixels,
+    )
+    decoded_size = img.size
+    decoded = time.perf_counter()
+
+    if mode == "square":
+        side = min(img.size)
+        left, top = (img.width - side) // 2, (img.height - side) // 2
+        img = img.crop((left, top, left + side, top + side))
+        target = (size, size)
+    else:
+        target = _target_size(width, height, size, mode)
+    if img.size != target:
+        # reducing_gap lets Pillow box-reduce by an integer factor first,
+        # which is much cheaper than a full-size LANCZOS pass
+        img = img.resize(target, Image.LANCZOS, reducing_gap=3.0)
+
+    output = _encode(img, MASTER_FORMAT)
+    finished = time.perf_counter()
+
+    output.metrics = {
+        "mode": mode,
+        "source": f"{width}x{height}",
+        "decoded": f"{decoded_size[0]}x{decoded_size[1]}",
+        "output": f"{img.width}x{img.height}",
+        "bytes": output.size,
+        "decode_ms": round((decoded - started) * 1000, 1),
+        "total_ms": round((finished - started) * 1000, 1),
+        "peak_rss_kb": _peak_rss_kb(),
+    }
+    logger.info(
+        "Resized %(source)s -> %(output)s (%(mode)s, decoded at %(decoded)s) "
+        "in %(total_ms)s ms, peak RSS %(peak_rss_kb)s KB",
+        output.metrics,
+        extra={"image_metrics": output.metrics},
+    )
+    return output
+
+
+def resize_image_bytes(data: bytes, size: int, mode: str = "longest", *, max_pixels: int):
+    """
+    resize_image() for process pools: bytes in, ``(bytes, metrics)`` out.
+    The pixel limit must be passed in; spawned interpreters have no settings.
+    """
+    output = resize_image(BytesIO(data), size, mode, max_pixels=max_pixels)
+    with output:
+        return output.read(), output.metrics
+
+
+def generate_renditions(field_file, widths: dict, source=None) -> dict:
+    """
+    Write a WebP and a JPEG copy of `field_file` for every label -> width in
+    `widths` and return the metadata to store in the model's `renditions`.
+
+    `source` may be an already available file object with the master's bytes,
+    which saves downloading the master back from storage right after upload.
+    Widths at or above the master's own width are skipped; the master itself
+    serves those. JPEG masters are decoded in draft mode at about the size of
+    the largest rendition.
+    """
+    storage = field_file.storage
+    largest = max(widths.values(), default=0)
+
+    def draft(w, h):
+        # the short side bounds the upright width whichever way it is rotated
+        scale = min(1.0, largest / min(w, h)) if largest else 1.0
+        return math.ceil(w * scale), math.ceil(h * scale)
+
+    def render(fh):
+        # masters already passed the pixel limit when they were made
+        img, (width, height) = open_image(fh, draft=draft, max_pixels=0)
+        img.load()
+        return img, width, height
+
+    if source is None:
+        with storage.open(field_file.name, "rb") as fh:
+            img, width, height = render(fh)
+    else:
+        source.seek(0)
+        img, width, height = render(source)
+
+    stem, _ext = os.path.splitext(field_file.name)
+    sizes = {}
+    # Largest first, so each smaller size is resampled from the previous one
+    for label, target in sorted(widths.items(), key=lambda item: item[1], reverse=True):
+        if target >= width:
+            continue
+        img = img.resize(
+            (target, max(1, round(height * target / width))), Image.LANCZOS, reducing_gap=3.0
+        )
+        entry = {"width": img.width, "height": img.height}
+        for fmt, image_format in RENDITION_FORMATS.items():
+            with _encode(img, image_format) as encoded:
+                entry[fmt] = storage.save(f"{stem}_{label}.{image_format[1]}", encoded)
+        sizes[label] = entry
+
+    return {"width": width, "height": height, "sizes": sizes}
+
+
+def rendition_names(renditions: dict) -> list:
+    """
+    All storage names referenced by a `renditions` dict.
+    """
+    return [
+        entry[fmt]
+        for entry in (renditions or {}).get("sizes", {}).values()
+        for fmt in RENDITION_FORMATS
+        if entry.get(fmt)
+    ]
+
+
+class ResponsiveImageMixin:
+    """
+    Template helpers for models with an `image` field and a `renditions`
+    JSONField. Models without generated renditions fall back to the master.
+    """
+
+    rendition_widths = {}
+
+    # Objects of public media may be served unsigned from MEDIA_PUBLIC_URL
+    media_is_public = False
+
+    def _rendition_storage(self):
+        return self._meta.get_field("image").storage
+
+    def _media_url(self, name):
+        return media_url(self._rendition_storage(), name, self.media_is_public)
+
+    @property
+    def image_url(self):
+        return self._media_url(self.image.name) if self.image else ""
+
+    def _srcset(self, fmt):
+        sizes = sorted(
+            (self.renditions or {}).get("sizes", {}).values(),
+            key=lambda entry: entry["width"],
+        )
+        if not self.image or not sizes:
+            return ""
+        entries = [f"{self._media_url(entry[fmt])} {entry['width']}w" for entry in sizes]
+        if fmt == "jpeg":
+            # the master is a JPEG as well and is the largest candidate
+            entries.append(f"{self.image_url} {self.renditions['width']}w")
+        return ", ".join(entries)
+
+    @property
+    def srcset_webp(self):
+        return self._srcset("webp")
+
+    @property
+    def srcset_jpeg(self):
+        return self._srcset("jpeg")
+
+    def rendition_url(self, label, fmt="jpeg"):
+        if not self.image:
+            return ""
+        entry = (self.renditions or {}).get("sizes", {}).get(label)
+        if entry and entry.get(fmt):
+            return self._media_url(entry[fmt])
+        return self.image_url
+
+    @property
+    def thumb_url(self):
+        return self.rendition_url("thumb")
+
+    @property
+    def medium_url(self):
+        return self.rendition_url("medium")
+
+    @property
+    def image_width(self):
+        return (self.renditions or {}).get("width")
+
+    @property
+    def image_height(self):
+        return (self.renditions or {}).get("height")
+
+    def build_renditions(self, source=None):
+        """
+        (Re)generate the derivatives of the current image and persist them.
+        Files of a previous image are buried with the update that drops
+        them, and removed by a_tasks once it commits.
+        """
+        from a_tasks.tombstones import bury
+
+        previous = rendition_names(self.renditions)
+        renditions = (
+            generate_renditions(self.image, self.rendition_widths, source) if self.image else {}
+        )
+        current = set(rendition_names(renditions))
+        with transaction.atomic():
+            type(self).objects.filter(pk=self.pk).update(renditions=renditions)
+            bury(name for name in previous if name not in current)
+        self.renditions = renditions
+        return renditions
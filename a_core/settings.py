@@ -11,8 +11,10 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
 from pathlib import Path
+import tempfile
 import dj_database_url
 
+from django.core.exceptions import ImproperlyConfigured
 from environ import Env
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -50,7 +52,6 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'django_cleanup.apps.CleanupConfig',
     'django.contrib.sites',
     'allauth',
     'allauth.account',
@@ -60,8 +61,11 @@ INSTALLED_APPS = [
     'a_home',
     'a_users',
     'a_portfolio',
+    'a_search',
     'a_share',
-     
+    'a_tasks',
+    'a_mail',
+    'a_stats',
 ]
 
 SITE_ID = 1
@@ -77,7 +81,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
     'django_htmx.middleware.HtmxMiddleware',
-    
+    'a_users.middleware.LastSeenMiddleware',
 ]
 
 AUTHENTICATION_BACKENDS = [
@@ -100,7 +104,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'a_users.context_processors.unread_messages',
+                'a_users.context_processors.header_badges',
             ],
         },
     },
@@ -158,6 +162,18 @@ else:
             }
         }
 
+# Cache shared by all web processes, e.g. CACHE_URL=redis://host:6379/0.
+# Without it every process keeps its own in-memory cache, and a write only
+# clears the cached badges and filter choices of the process that made it;
+# those are then kept for seconds instead of an hour (see below), and more
+# than one web process (WEB_CONCURRENCY) is refused.
+CACHES = {
+    'default': env.cache_url('CACHE_URL', default='locmemcache://'),
+}
+SHARED_CACHE = CACHES['default']['BACKEND'] != 'django.core.cache.backends.locmem.LocMemCache'
+if not SHARED_CACHE and env.int('WEB_CONCURRENCY', default=1) > 1:
+    raise ImproperlyConfigured('Several web processes need a shared cache: set CACHE_URL.')
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -256,6 +272,33 @@ STORAGES = {
     },
 }
 
+# Presigned media URLs are reused for this many seconds so pages keep
+# rendering identical (browser-cacheable) URLs; each stays valid for up to
+# twice as long. See a_core.storage_backends.CachedSignedUrlMixin.
+MEDIA_URL_EXPIRY_WINDOW = 3 * 60 * 60
+
+# Optional CDN base URL (like MEDIA_URL, ending in "/") for public photos.
+# When set, public photos are made public-read and served unsigned from it.
+MEDIA_PUBLIC_URL = env("MEDIA_PUBLIC_URL", default=None)
+
+# How a_share hands files to recipients: "auto", "redirect" (presigned URL),
+# "accel" (nginx X-Accel-Redirect), "sendfile" (X-Sendfile) or "stream"
+# (Django itself, with Range support). See a_share/downloads.py.
+SHARE_DOWNLOAD_MODE = env("SHARE_DOWNLOAD_MODE", default="auto")
+SHARE_DOWNLOAD_URL_EXPIRE = 5 * 60  # seconds a presigned download link works
+SHARE_ACCEL_REDIRECT_PREFIX = env("SHARE_ACCEL_REDIRECT_PREFIX", default="/protected-media/")
+
+# Chunked, resumable transfer uploads (a_share.uploads). Every chunk is one
+# request, so the proxy in front of Django must accept bodies of this size.
+SHARE_UPLOAD_PART_SIZE = 8 * 1024 * 1024  # S3 multipart part, at least 5 MB
+SHARE_UPLOAD_CHUNK_SIZE = 4 * SHARE_UPLOAD_PART_SIZE
+SHARE_UPLOAD_THREADS = 4  # parts of one chunk sent to S3 at the same time
+SHARE_UPLOAD_MAX_SIZE = 20 * 1024 * 1024 * 1024  # per file
+SHARE_UPLOAD_SPOOL_DIR = env(
+    "SHARE_UPLOAD_SPOOL_DIR", default=str(Path(tempfile.gettempdir()) / "herbiesplace-uploads")
+)
+SHARE_UPLOAD_STALE_AFTER = 24 * 60 * 60  # seconds without progress before an upload is dropped
+
 #MEDIA_URL = 'media/'
 
 #MEDIA_ROOT = BASE_DIR / 'media'
@@ -272,6 +315,78 @@ DATA_UPLOAD_MAX_NUMBER_FIELDS = 1000
 # Maximum file size for photo uploads (in bytes)
 MAX_PHOTO_SIZE = 10 * 1024 * 1024  # 10 MB 
 
+# Images with more pixels are rejected before they are decoded (decompression bombs)
+MAX_IMAGE_PIXELS = 50_000_000
+
+# Number of photo cards rendered per gallery page / "load more" request
+PORTFOLIO_PAGE_SIZE = 24
+# Top-level comments per page on a photo ("show more" loads the next page)
+PORTFOLIO_COMMENTS_PAGE_SIZE = 20
+
+# Concurrent storage writes per multi-image upload (and per processing job)
+PORTFOLIO_UPLOAD_THREADS = 8
+
+# With S3 storage, browsers upload photo originals straight to the bucket
+# under PORTFOLIO_STAGING_PREFIX (see a_portfolio.uploads). The bucket needs a
+# CORS rule allowing POST from the site, and a lifecycle rule expiring the
+# staging prefix after a few days removes uploads that were never submitted.
+PORTFOLIO_DIRECT_UPLOADS = env.bool("PORTFOLIO_DIRECT_UPLOADS", default=True)
+PORTFOLIO_STAGING_PREFIX = "staging/"
+PORTFOLIO_DIRECT_UPLOAD_MAX_SIZE = 50 * 1024 * 1024
+PORTFOLIO_DIRECT_UPLOAD_MAX_FILES = 50
+PORTFOLIO_DIRECT_UPLOAD_EXPIRE = 15 * 60  # seconds a presigned form can be used
+PORTFOLIO_HEADER_BYTES = 256 * 1024  # read to check a staged image's header
+
+# PostgreSQL text search configuration for the photo search index; "simple"
+# matches words as written, whatever the language (see a_portfolio.search)
+PORTFOLIO_SEARCH_CONFIG = env("PORTFOLIO_SEARCH_CONFIG", default="simple")
+
+# User directory search (a_users.search): results per page, and suggestions
+# shown while typing in a search box
+USER_SEARCH_PAGE_SIZE = 20
+USER_SEARCH_TYPEAHEAD_LIMIT = 8
+
+# Conversations listed per inbox page, and messages per page of a thread
+# (a_users.conversations)
+MESSAGES_INBOX_PAGE_SIZE = 30
+MESSAGES_THREAD_PAGE_SIZE = 50
+# Live thread updates (a_users.views.message_stream): how often an open
+# stream checks for news, how long one stream lasts before the browser
+# reconnects, and how long the browser waits before reconnecting
+MESSAGES_STREAM_POLL_INTERVAL = 2  # seconds
+MESSAGES_STREAM_TIMEOUT = 55  # seconds
+MESSAGES_STREAM_RETRY_MS = 2000
+
+# Header badge counters are cached per user (and once for all staff) until a
+# write changes them; this only bounds how long a missed change can show
+BADGE_CACHE_TIMEOUT = 60 * 60 if SHARED_CACHE else 30  # seconds
+
+# Profile.last_seen_at is written at most once per user per this many
+# seconds, in one batched UPDATE per process (a_users.presence)
+LAST_SEEN_INTERVAL = 60
+# "Active users" on the staff dashboard: seen within this many minutes
+ACTIVE_USER_MINUTES = 15
+# Days of daily statistics (a_stats) shown on the staff dashboard
+DASHBOARD_STATS_DAYS = 14
+
+# Staff list pages (a_users.admin_lists): rows per page, how far filtered
+# lists are counted before showing "N+", and how long the cached category
+# filter may miss a change
+ADMIN_LIST_PAGE_SIZE = 50
+ADMIN_LIST_COUNT_LIMIT = 1000
+ADMIN_FACET_CACHE_TIMEOUT = 60 * 60 if SHARED_CACHE else 30  # seconds
+
+# Background jobs (a_tasks); workers run with `python manage.py run_worker`
+TASKS_MAX_ATTEMPTS = 5
+TASKS_RETRY_BASE_DELAY = 30  # seconds before the first retry, doubled each time
+TASKS_RETRY_MAX_DELAY = 60 * 60
+TASKS_LEASE_SECONDS = 10 * 60  # a job held longer than this is handed to another worker
+TASKS_POLL_INTERVAL = 2.0
+
+# Files of deleted or replaced rows are removed after commit by draining
+# storage tombstones (a_tasks.tombstones), this many files per round
+STORAGE_DRAIN_BATCH = 1000
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -293,6 +408,14 @@ ANYMAIL = {
 }
 DEFAULT_FROM_EMAIL = env('EMAIL_FROM')
 
+# Email outbox (a_mail): mail is queued and sent by the worker
+MAIL_MAX_ATTEMPTS = 6
+MAIL_LEASE_SECONDS = 5 * 60
+MAIL_DISPATCH_BATCH = 200  # messages claimed per dispatch run
+MAIL_BATCH_SEND = True  # merge identical bulk mail into Brevo batch sends
+MAIL_BATCH_SIZE = 500  # recipients per batch send
+MAIL_RETENTION_DAYS = 30  # sent messages kept for idempotency and stats
+
 ACCOUNT_AUTHENTICATION_METHOD = 'email'
 ACCOUNT_EMAIL_REQUIRED = True
 ACCOUNT_FORMS = {
@@ -1,5 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import filepath_to_uri
+
 try:
     from storages.backends.s3boto3 import S3Boto3Storage  # pyright: ignore[reportMissingImports]
+    from storages.utils import clean_name  # pyright: ignore[reportMissingImports]
 except ImportError:
     # Fallback if storages is not installed
     S3Boto3Storage = None
@@ -9,13 +18,206 @@ except ImportError:
 #file_overwrite = True
 #default_acl = 'public-read' # Set appropriate ACL for static files
 
+
+class CachedSignedUrlMixin:
+    """
+    Reuse presigned URLs for a fixed window (MEDIA_URL_EXPIRY_WINDOW).
+
+    Signing is deterministic only for the same signing time, so every render
+    used to produce a new URL (and a new HMAC), which browsers cannot cache.
+    Time is cut into windows; the first URL signed for an object in a window
+    is stored in the cache and handed out until the window ends, and it stays
+    valid for one more window after that. A small per-process dict in front
+    of the cache saves the round trip for objects shown on every page.
+
+    Calls that ask for a specific `expire` or HTTP method are not cached.
+    """
+
+    local_url_limit = 20_000
+
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        if expire is not None or http_method is not None:
+            return super().url(name, parameters, expire, http_method)
+
+        window = settings.MEDIA_URL_EXPIRY_WINDOW
+        now = int(time.time())
+        bucket = now // window
+        key = (name, tuple(sorted((parameters or {}).items())))
+
+        local = getattr(self, "_local_urls", None)
+        if local is None or local[0] != bucket or len(local[1]) > self.local_url_limit:
+            local = self._local_urls = (bucket, {})
+        url = local[1].get(key)
+        if url is not None:
+            return url
+
+        cache_key = "media-url:" + hashlib.sha1(repr((bucket, key)).encode()).hexdigest()
+        url = cache.get(cache_key)
+        if url is None:
+            url = super().url(name, parameters, expire=(bucket + 2) * window - now)
+            # another process may have signed the same object meanwhile;
+            # keep whichever URL reached the cache first
+            cache.add(cache_key, url, timeout=(bucket + 1) * window - now)
+            url = cache.get(cache_key, url)
+        local[1][key] = url
+        return url
+
+
 if S3Boto3Storage:
-    class MediaStorage(S3Boto3Storage):
+    class MediaStorage(CachedSignedUrlMixin, S3Boto3Storage):
         location = 'media'
         file_overwrite = False # Ensure media files with the same name are not overwritten
         default_acl = 'private' # Media files are typically private
+
+        def public_url(self, name):
+            """
+            Unsigned CDN URL for an object made public with set_public(), or
+            None when no MEDIA_PUBLIC_URL is configured.
+            """
+            if not settings.MEDIA_PUBLIC_URL:
+                return None
+            return settings.MEDIA_PUBLIC_URL + filepath_to_uri(name)
+
+        def set_public(self, names, public: bool):
+            client = self.connection.meta.client
+            acl = "public-read" if public else "private"
+            for name in names:
+                client.put_object_acl(Bucket=self.bucket_name, Key=object_key(self, name), ACL=acl)
 else:
     # Fallback to FileSystemStorage if S3Boto3Storage is not available
     from django.core.files.storage import FileSystemStorage
     class MediaStorage(FileSystemStorage):
-        location = 'media'
\ No newline at end of file
+        location = 'media'
+
+
+def media_url(storage, name, public=False):
+    """
+    URL for `name` in `storage`: the unsigned CDN URL for public objects when
+    the storage supports it, otherwise the storage's own (cached) URL.
+    """
+    if public and hasattr(storage, "public_url"):
+        url = storage.public_url(name)
+        if url:
+            return url
+    return storage.url(name)
+
+
+def is_s3(storage) -> bool:
+    return bool(S3Boto3Storage) and isinstance(storage, S3Boto3Storage)
+
+
+def object_key(storage, name):
+    """
+    Bucket key of storage name `name`, for calls made on the boto3 client
+    directly.
+    """
+    return storage._normalize_name(clean_name(name))
+
+
+S3_DELETE_BATCH = 1000  # keys per DeleteObjects call, the S3 maximum
+
+
+def delete_many(storage, names, workers: int = 8) -> list:
+    """
+    Delete `names` from `storage` and return the names that could not be
+    deleted. S3 keys go S3_DELETE_BATCH at a time through DeleteObjects,
+    with several calls in flight; other storages delete file by file on the
+    same thread pool. Missing files are not an error.
+    """
+    names = [name for name in names if name]
+    if not names:
+        return []
+
+    if is_s3(storage):
+        client = storage.connection.meta.client
+        batch_size = S3_DELETE_BATCH
+
+        def delete(batch):
+            keys = {object_key(storage, name): name for name in batch}
+            response = client.delete_objects(
+                Bucket=storage.bucket_name,
+                Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+            )
+            return [keys[error["Key"]] for error in response.get("Errors", [])]
+    else:
+        batch_size = 100
+
+        def delete(batch):
+            failed = []
+            for name in batch:
+                try:
+                    storage.delete(name)
+                except OSError:
+                    failed.append(name)
+            return failed
+
+    batches = [names[i : i + batch_size] for i in range(0, len(names), batch_size)]
+    with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+        return [name for failed in pool.map(delete, batches) for name in failed]
+
+
+def presigned_post(storage, name, *, content_type, max_size, expire):
+    """
+    URL and form fields that let a browser POST one object called `name`
+    straight to the bucket. The signed policy pins the key, the content type
+    and the size range, so the form cannot be reused for anything else.
+    """
+    fields = {"Content-Type": content_type}
+    conditions = [{"Content-Type": content_type}, ["content-length-range", 1, max_size]]
+    if storage.default_acl:
+        fields["acl"] = storage.default_acl
+        conditions.append({"acl": storage.default_acl})
+    return storage.connection.meta.client.generate_presigned_post(
+        storage.bucket_name,
+        object_key(storage, name),
+        Fields=fields,
+        Conditions=conditions,
+        ExpiresIn=expire,
+    )
+
+
+def read_head(storage, name, length: int) -> bytes:
+    """
+    The first `length` bytes of `name`, fetched with a ranged GET on S3.
+    """
+    if is_s3(storage):
+        response = storage.connection.meta.client.get_object(
+            Bucket=storage.bucket_name, Key=object_key(storage, name), Range=f"bytes=0-{length - 1}"
+        )
+        return response["Body"].read()
+    with storage.open(name, "rb") as fh:
+        return fh.read(length)
+
+
+def move(storage, name, new_name) -> str:
+    """
+    Move `name` to `new_name` (or the free name storage picks for it) and
+    return the name it got. S3 copies the object inside the bucket instead
+    of downloading and uploading it again.
+    """
+    new_name = storage.get_available_name(new_name)
+    if is_s3(storage):
+        client = storage.connection.meta.client
+        extra = {"ACL": storage.default_acl} if storage.default_acl else {}
+        client.copy_object(
+            Bucket=storage.bucket_name,
+            Key=object_key(storage, new_name),
+            CopySource={"Bucket": storage.bucket_name, "Key": object_key(storage, name)},
+            **extra,
+        )
+    else:
+        with storage.open(name, "rb") as fh:
+            new_name = storage.save(new_name, fh)
+    storage.delete(name)
+    return new_name
+
+
+def open_stream(storage, name):
+    """
+    Readable binary stream of `name` that does not buffer the whole object.
+    S3 bodies are read straight off the HTTP response; storage.open() would
+    first spool the entire object into a temporary file.
+    """
+    if is_s3(storage):
+        return storage.bucket.Object(object_key(storage, name)).get()["Body"]
+    return storage.open(name, "rb")
@@ -1,12 +1,13 @@
-from django.shortcuts import render, redirect
-from django.core.mail import send_mail
 from django.conf import settings
+from django.http import HttpResponseBadRequest
+from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.db import models
-from django.db.models import Q
-from django.contrib.auth.models import User
+from a_mail.outbox import queue_email
 from a_portfolio.models import Photo, Category
+from a_portfolio.pagination import InvalidCursor
+from a_portfolio.search import search_photos
 from a_portfolio.views import _filter_photos_for_user
+from a_users.search import search_users
 from .forms import ContactForm
 
 
@@ -16,18 +17,9 @@ def home_view(request):
     )
     
     # Filter adult-only content based on user
-    if request.user.is_authenticated:
-        profile = getattr(request.user, "profile", None)
-        can_view_adult = profile and profile.can_view_adult_content if profile else False
-        if not can_view_adult:
-            public_photos = public_photos.filter(
-                models.Q(category__isnull=True) | models.Q(category__is_adult_only=False)
-            )
-    else:
-        # Non-authenticated: no adult content
-        public_photos = public_photos.filter(
-            models.Q(category__isnull=True) | models.Q(category__is_adult_only=False)
-        )
+    profile = getattr(request.user, "profile", None) if request.user.is_authenticated else None
+    if not (profile and profile.can_view_adult_content):
+        public_photos = public_photos.filter(is_adult_only=False)
     
     public_photos = public_photos.order_by("-captured_on", "-created_at")[:10]
     return render(request, "home.html", {"public_photos": public_photos})
@@ -57,22 +49,10 @@ Message:
 ---
 This email was sent from the portfolio website contact form.
 """
-            try:
-                send_mail(
-                    subject,
-                    email_message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    ['herbiesplace@outlook.be'],
-                    fail_silently=False,
-                )
-                messages.success(request, 'Thank you! Your message has been sent successfully.')
-                return redirect('contact')
-            except Exception as e:
-                # Log the error for debugging (in production, use proper logging)
-                import traceback
-                print(f"Email error: {e}")
-                traceback.print_exc()
-                messages.error(request, f'Sorry, there was an error sending your message: {str(e)}. Please try again later.')
+            # Sent by the worker; delivery errors are retried there
+            queue_email(subject, email_message, ['herbiesplace@outlook.be'])
+            messages.success(request, 'Thank you! Your message has been sent successfully.')
+            return redirect('contact')
     else:
         form = ContactForm()
     
@@ -82,20 +62,25 @@ This email was sent from the portfolio website contact form.
 def search_view(request):
     q = request.GET.get("q", "").strip()
     photos = []
+    next_page_url = None
     categories = []
     users = []
 
     if q:
-        # Photos respecting visibility
-        photos = (
-            _filter_photos_for_user(request.user)
-            .filter(
-                Q(title__icontains=q)
-                | Q(description__icontains=q)
-                | Q(category__name__icontains=q)
+        # Photos respecting visibility, best matches first
+        try:
+            photos, next_cursor = search_photos(
+                _filter_photos_for_user(request.user),
+                q,
+                request.GET.get("cursor"),
+                page_size=settings.PORTFOLIO_PAGE_SIZE,
             )
-            .order_by("-captured_on", "-created_at")[:30]
-        )
+        except InvalidCursor:
+            return HttpResponseBadRequest("Invalid page cursor.")
+        if next_cursor:
+            query = request.GET.copy()
+            query["cursor"] = next_cursor
+            next_page_url = f"{request.path}?{query.urlencode()}"
 
         # Categories (respect adult visibility)
         categories_qs = Category.objects.filter(name__icontains=q)
@@ -106,20 +91,18 @@ def search_view(request):
         categories = categories_qs.order_by("name")[:20]
 
         # Users
-        users = (
-            User.objects.select_related("profile")
-            .filter(
-                Q(username__icontains=q)
-                | Q(profile__displayname__icontains=q)
-                | Q(email__icontains=q)
-            )
-            .order_by("username")[:20]
-        )
+        users = search_users(q)[: settings.USER_SEARCH_PAGE_SIZE]
 
     return render(
         request,
         "search.html",
-        {"query": q, "photos": photos, "categories": categories, "users": users},
+        {
+            "query": q,
+            "photos": photos,
+            "next_page_url": next_page_url,
+            "categories": categories,
+            "users": users,
+        },
     )
 
 
@@ -0,0 +1,10 @@
+from django.contrib import admin
+
+from .models import OutboxMessage
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ("subject", "status", "attempts", "created_at", "sent_at", "latency")
+    list_filter = ("status", "batch")
+    search_fields = ("subject", "idempotency_key")
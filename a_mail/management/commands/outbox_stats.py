@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from a_mail.models import OutboxMessage
+from a_mail.outbox import latency_percentiles
+
+
+class Command(BaseCommand):
+    help = "Show the email outbox backlog and queue-to-send latency percentiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=float,
+            default=24,
+            help="Window for the latency percentiles (default: 24).",
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        counts = dict(OutboxMessage.objects.values_list("status").annotate(n=Count("id")))
+        for status, label in OutboxMessage.STATUS_CHOICES:
+            self.stdout.write(f"{label}: {counts.get(status, 0)}")
+
+        oldest = OutboxMessage.objects.filter(status=OutboxMessage.STATUS_QUEUED).aggregate(
+            oldest=Min("created_at")
+        )["oldest"]
+        if oldest:
+            self.stdout.write(f"Oldest queued message: {(now - oldest).total_seconds():.1f}s old")
+
+        since = now - timedelta(hours=options["hours"])
+        percentiles = latency_percentiles(since)
+        if not percentiles:
+            self.stdout.write(f"No messages sent in the last {options['hours']:g}h.")
+            return
+        summary = ", ".join(f"p{p} {seconds:.2f}s" for p, seconds in percentiles.items())
+        self.stdout.write(self.style.SUCCESS(f"Latency over the last {options['hours']:g}h: {summary}"))
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+
+def _default_max_attempts():
+    return settings.MAIL_MAX_ATTEMPTS
+
+
+class OutboxMessage(models.Model):
+    """
+    An email waiting to be sent (or sent recently) by the outbox dispatcher.
+
+    Sent messages are kept for MAIL_RETENTION_DAYS, which is how long an
+    idempotency key protects against sending the same mail twice and how
+    far back outbox_stats can look.
+    """
+
+    STATUS_QUEUED = "queued"
+    STATUS_SENDING = "sending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_SENDING, "Sending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    # Queuing a message with a key that already exists returns the existing one
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    # Bulk (cron) mail: identical messages may go out in one provider batch call
+    batch = models.BooleanField(default=False)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=_default_max_attempts)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    provider_id = models.CharField(max_length=200, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+            models.Index(fields=["sent_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.subject} → {', '.join(self.to)} ({self.status})"
+
+    @property
+    def latency(self):
+        """Time from queuing to handing the message to the provider."""
+        return self.sent_at - self.created_at if self.sent_at else None
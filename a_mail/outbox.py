@@ -0,0 +1,220 @@
+"""
+Transactional email outbox.
+
+Code that wants to send mail calls queue_email(), which only inserts an
+OutboxMessage (inside the caller's transaction) and makes sure a
+dispatch_outbox job is queued. The dispatcher, running on a worker:
+
+- claims due messages with a lease, like a_tasks claims jobs, so two
+  workers never send the same message;
+- sends them over one backend connection for the whole run, so anymail
+  reuses its HTTPS session to Brevo instead of connecting per message;
+- with an anymail backend, merges identical bulk messages (batch=True,
+  e.g. cron reminders) into a single Brevo batch call, one copy per
+  recipient;
+- retries failures with the job queue's backoff until max_attempts.
+
+An idempotency key makes queuing safe to repeat: the same key never
+produces a second message while the first one is kept.
+"""
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection as db_connection, transaction
+from django.db.models import F, Min, Q
+from django.utils import timezone
+
+from a_tasks.models import Job
+from a_tasks.queue import retry_delay
+
+from .models import OutboxMessage
+
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_TASK = "a_mail.tasks.dispatch_outbox"
+
+
+def queue_email(subject, body, to, *, from_email=None, idempotency_key=None, batch=False):
+    """
+    Queue a plain-text email to the addresses in `to` and return its
+    OutboxMessage. Nothing is sent before the surrounding transaction
+    commits.
+    """
+    fields = {
+        "from_email": from_email or settings.DEFAULT_FROM_EMAIL,
+        "to": list(to),
+        "subject": subject[:255],
+        "body": body,
+        "batch": batch,
+    }
+    if idempotency_key:
+        message, created = OutboxMessage.objects.get_or_create(
+            idempotency_key=idempotency_key, defaults=fields
+        )
+        if not created:
+            return message
+    else:
+        message = OutboxMessage.objects.create(**fields)
+    schedule_dispatch()
+    return message
+
+
+def schedule_dispatch(run_at=None) -> None:
+    """
+    Queue a dispatch_outbox job for `run_at` (default: now) unless one that
+    runs no later is already waiting.
+    """
+    from .tasks import dispatch_outbox
+
+    run_at = run_at or timezone.now()
+    waiting = Job.objects.filter(task=DISPATCH_TASK, status=Job.STATUS_QUEUED, run_at__lte=run_at)
+    if not waiting.exists():
+        dispatch_outbox.enqueue(run_at=run_at)
+
+
+def claim_messages(limit: int) -> list:
+    """
+    Lease up to `limit` due messages to the caller, oldest first.
+    """
+    now = timezone.now()
+    due = OutboxMessage.objects.filter(
+        Q(status=OutboxMessage.STATUS_QUEUED, next_attempt_at__lte=now)
+        | Q(status=OutboxMessage.STATUS_SENDING, locked_until__lt=now)
+    ).order_by("next_attempt_at", "id")
+
+    claimed = []
+    with transaction.atomic():
+        if db_connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        for pk, status, locked_until in due.values_list("pk", "status", "locked_until")[:limit]:
+            won = OutboxMessage.objects.filter(pk=pk, status=status, locked_until=locked_until).update(
+                status=OutboxMessage.STATUS_SENDING,
+                locked_until=now + timedelta(seconds=settings.MAIL_LEASE_SECONDS),
+                attempts=F("attempts") + 1,
+            )
+            if won:
+                claimed.append(pk)
+
+    return list(OutboxMessage.objects.filter(pk__in=claimed).order_by("id"))
+
+
+def _supports_batches(backend) -> bool:
+    # Only anymail turns merge_data into one separate copy per recipient;
+    # any other backend would put every address on a single message
+    return settings.MAIL_BATCH_SEND and type(backend).__module__.startswith("anymail.")
+
+
+def _groups(messages, batches: bool):
+    """
+    Split claimed messages into sends: identical bulk messages together (up
+    to MAIL_BATCH_SIZE recipients), everything else on its own.
+    """
+    pending = {}
+    for message in messages:
+        if not (batches and message.batch):
+            yield [message]
+            continue
+        key = (message.from_email, message.subject, message.body)
+        group = pending.setdefault(key, [])
+        group.append(message)
+        if sum(len(m.to) for m in group) >= settings.MAIL_BATCH_SIZE:
+            yield pending.pop(key)
+    yield from pending.values()
+
+
+def _send(backend, group, batches: bool) -> str:
+    first = group[0]
+    recipients = list(dict.fromkeys(address for message in group for address in message.to))
+    email = EmailMessage(first.subject, first.body, first.from_email, recipients, connection=backend)
+    if batches and first.batch:
+        # Brevo batch send: a separate copy for every recipient in one API call
+        email.merge_data = {address: {} for address in recipients}
+    email.send()
+
+    # anymail: one id, or a set of ids for a batch
+    message_id = getattr(getattr(email, "anymail_status", None), "message_id", None) or ""
+    if isinstance(message_id, (set, frozenset)):
+        message_id = ",".join(sorted(message_id))
+    return str(message_id)[:200]
+
+
+def _record_failure(group, error: str) -> None:
+    now = timezone.now()
+    for message in group:
+        if message.attempts >= message.max_attempts:
+            logger.error("Email %s failed permanently: %s", message.pk, error)
+            fields = {"status": OutboxMessage.STATUS_FAILED}
+        else:
+            logger.warning("Email %s failed, will retry: %s", message.pk, error)
+            fields = {
+                "status": OutboxMessage.STATUS_QUEUED,
+                "next_attempt_at": now + retry_delay(message.attempts),
+            }
+        OutboxMessage.objects.filter(pk=message.pk).update(locked_until=None, last_error=error, **fields)
+
+
+def dispatch(limit: int = None) -> dict:
+    """
+    Send up to `limit` due messages (default MAIL_DISPATCH_BATCH) and queue
+    the next dispatch run if more are waiting. Returns counts of sent and
+    failed messages.
+    """
+    messages = claim_messages(limit or settings.MAIL_DISPATCH_BATCH)
+    sent = failed = 0
+    if messages:
+        backend = get_connection()
+        batches = _supports_batches(backend)
+        with backend:
+            for group in _groups(messages, batches):
+                try:
+                    provider_id = _send(backend, group, batches)
+                except Exception as exc:
+                    _record_failure(group, f"{exc.__class__.__name__}: {exc}")
+                    failed += len(group)
+                    continue
+                OutboxMessage.objects.filter(pk__in=[message.pk for message in group]).update(
+                    status=OutboxMessage.STATUS_SENT,
+                    sent_at=timezone.now(),
+                    locked_until=None,
+                    last_error="",
+                    provider_id=provider_id,
+                )
+                sent += len(group)
+
+    # Retries, and messages of a worker that died mid-send, need a later run
+    upcoming = OutboxMessage.objects.aggregate(
+        retry=Min("next_attempt_at", filter=Q(status=OutboxMessage.STATUS_QUEUED)),
+        lease=Min("locked_until", filter=Q(status=OutboxMessage.STATUS_SENDING)),
+    )
+    next_run = min(filter(None, upcoming.values()), default=None)
+    if next_run is not None:
+        schedule_dispatch(max(next_run, timezone.now()))
+
+    OutboxMessage.objects.filter(
+        status=OutboxMessage.STATUS_SENT,
+        sent_at__lt=timezone.now() - timedelta(days=settings.MAIL_RETENTION_DAYS),
+    ).delete()
+    return {"sent": sent, "failed": failed}
+
+
+def latency_percentiles(since, percentiles=(50, 90, 99)) -> dict:
+    """
+    Queue-to-provider latency of the messages sent since `since`, in
+    seconds, as ``{percentile: seconds}`` (nearest rank). Empty when
+    nothing was sent.
+    """
+    latencies = sorted(
+        (sent_at - created_at).total_seconds()
+        for created_at, sent_at in OutboxMessage.objects.filter(
+            status=OutboxMessage.STATUS_SENT, sent_at__gte=since
+        ).values_list("created_at", "sent_at")
+    )
+    if not latencies:
+        return {}
+    return {
+        p: latencies[min(len(latencies) - 1, max(0, -(-p * len(latencies) // 100) - 1))]
+        for p in percentiles
+    }
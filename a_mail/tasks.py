@@ -0,0 +1,24 @@
+from django.utils import timezone
+
+from a_tasks.queue import retry_delay, task
+
+from .models import OutboxMessage
+from .outbox import dispatch, schedule_dispatch
+
+
+@task(max_attempts=1)
+def dispatch_outbox():
+    """
+    Send the due outbox messages. Failed messages are retried by the outbox
+    itself, so the job is never retried; if the run itself breaks (database
+    or backend setup), a later run is booked while messages are waiting.
+    """
+    try:
+        dispatch()
+    except Exception:
+        waiting = OutboxMessage.objects.filter(
+            status__in=[OutboxMessage.STATUS_QUEUED, OutboxMessage.STATUS_SENDING]
+        )
+        if waiting.exists():
+            schedule_dispatch(timezone.now() + retry_delay(1))
+        raise
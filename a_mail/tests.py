@@ -0,0 +1,99 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from a_tasks.models import Job
+
+from .models import OutboxMessage
+from .outbox import dispatch, latency_percentiles, queue_email
+
+
+class BatchingBackend(EmailBackend):
+    """locmem backend that claims to be anymail, to exercise batch sends."""
+
+    __module__ = "anymail.backends.test"
+
+
+class OutboxTests(TestCase):
+    def test_queue_is_idempotent_and_schedules_one_dispatch(self):
+        first = queue_email("Hi", "Body", ["a@example.com"], idempotency_key="k1")
+        again = queue_email("Hi", "Other body", ["a@example.com"], idempotency_key="k1")
+        queue_email("Hi", "Body", ["b@example.com"])
+
+        self.assertEqual(first.pk, again.pk)
+        self.assertEqual(OutboxMessage.objects.count(), 2)
+        self.assertEqual(Job.objects.filter(task="a_mail.tasks.dispatch_outbox").count(), 1)
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command("run_worker", "--burst", stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(
+            set(OutboxMessage.objects.values_list("status", flat=True)), {OutboxMessage.STATUS_SENT}
+        )
+
+    def test_failures_are_retried_with_backoff(self):
+        message = queue_email("Hi", "Body", ["a@example.com"])
+        Job.objects.all().delete()  # as if a worker had picked up the dispatch job
+        with mock.patch.object(EmailBackend, "send_messages", side_effect=OSError("down")), self.assertLogs(
+            "a_mail.outbox", "WARNING"
+        ):
+            self.assertEqual(dispatch(), {"sent": 0, "failed": 1})
+
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.STATUS_QUEUED)
+        self.assertEqual(message.attempts, 1)
+        self.assertGreater(message.next_attempt_at, timezone.now())
+        self.assertIn("down", message.last_error)
+        # a run is booked for the retry
+        self.assertTrue(
+            Job.objects.filter(task="a_mail.tasks.dispatch_outbox", run_at__gt=timezone.now()).exists()
+        )
+
+    def test_broken_dispatch_run_books_another(self):
+        queue_email("Hi", "Body", ["a@example.com"])
+        with mock.patch("a_mail.outbox.get_connection", side_effect=ImportError("no backend")), self.assertLogs(
+            "a_tasks.queue", "ERROR"
+        ):
+            call_command("run_worker", "--burst", stdout=StringIO(), stderr=StringIO())
+
+        dispatches = Job.objects.filter(task="a_mail.tasks.dispatch_outbox")
+        self.assertEqual(dispatches.filter(status=Job.STATUS_FAILED).count(), 1)
+        self.assertTrue(dispatches.filter(status=Job.STATUS_QUEUED, run_at__gt=timezone.now()).exists())
+
+    @override_settings(EMAIL_BACKEND="a_mail.tests.BatchingBackend")
+    def test_identical_bulk_mail_goes_out_as_one_batch(self):
+        for address in ["a@example.com", "b@example.com", "a@example.com"]:
+            queue_email("Reminder", "Same text", [address], batch=True)
+        queue_email("Personal", "Hello", ["c@example.com"], batch=True)
+
+        self.assertEqual(dispatch(), {"sent": 4, "failed": 0})
+        personal, batch = sorted(mail.outbox, key=lambda m: m.subject)
+        self.assertEqual(personal.to, ["c@example.com"])
+        self.assertEqual(batch.subject, "Reminder")
+        self.assertEqual(batch.to, ["a@example.com", "b@example.com"])
+        self.assertEqual(batch.merge_data, {"a@example.com": {}, "b@example.com": {}})
+
+    def test_latency_percentiles(self):
+        now = timezone.now()
+        for seconds in range(1, 11):
+            message = queue_email("Hi", "Body", ["a@example.com"])
+            OutboxMessage.objects.filter(pk=message.pk).update(
+                status=OutboxMessage.STATUS_SENT,
+                created_at=now - timedelta(seconds=seconds),
+                sent_at=now,
+            )
+        percentiles = latency_percentiles(now - timedelta(hours=1))
+        self.assertEqual(round(percentiles[50]), 5)
+        self.assertEqual(round(percentiles[90]), 9)
+        self.assertEqual(round(percentiles[99]), 10)
+
+        out = StringIO()
+        call_command("outbox_stats", stdout=out)
+        self.assertIn("Sent: 10", out.getvalue())
+        self.assertIn("p50 5.00s", out.getvalue())
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class APortfolioConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'a_portfolio'
+
+    def ready(self):
+        import a_portfolio.signals
@@ -0,0 +1,97 @@
+"""
+Maintenance of the PhotoAudience index and the denormalized
+Photo.is_adult_only flag.
+
+Adult eligibility itself is not materialized: it depends on the viewer's age,
+which changes with the calendar, so it is evaluated per request against the
+indexed photo flag instead.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Photo, PhotoAudience
+
+
+def _desired_grants(photo_ids=None):
+    through = Photo.allowed_friends.through.objects.filter(
+        photo__visibility=Photo.VISIBILITY_FRIENDS
+    )
+    if photo_ids is not None:
+        through = through.filter(photo_id__in=photo_ids)
+    return set(through.values_list("photo_id", "profile__user_id").iterator())
+
+
+def _existing_grants(photo_ids=None):
+    rows = PhotoAudience.objects.all()
+    if photo_ids is not None:
+        rows = rows.filter(photo_id__in=photo_ids)
+    return set(rows.values_list("photo_id", "user_id").iterator())
+
+
+def _apply(missing, stale):
+    by_photo = defaultdict(list)
+    for photo_id, user_id in stale:
+        by_photo[photo_id].append(user_id)
+    with transaction.atomic():
+        for photo_id, user_ids in by_photo.items():
+            PhotoAudience.objects.filter(photo_id=photo_id, user_id__in=user_ids).delete()
+        PhotoAudience.objects.bulk_create(
+            [PhotoAudience(photo_id=p, user_id=u) for p, u in missing],
+            ignore_conflicts=True,
+            batch_size=1000,
+        )
+
+
+def sync_photo_audience(photo_ids):
+    """
+    Bring the audience rows of the given photos in line with their
+    visibility and allowed_friends.
+    """
+    photo_ids = list(photo_ids)
+    if not photo_ids:
+        return
+    desired = _desired_grants(photo_ids)
+    existing = _existing_grants(photo_ids)
+    _apply(desired - existing, existing - desired)
+
+
+def _adult_flag_drift():
+    adult = Q(category__is_adult_only=True)
+    return (
+        Photo.objects.filter(adult, is_adult_only=False),
+        Photo.objects.filter(~adult | Q(category__isnull=True), is_adult_only=True),
+    )
+
+
+def check_photo_audience():
+    """
+    Return counts of drift without changing anything:
+    (missing grants, stale grants, wrong adult flags).
+    """
+    desired = _desired_grants()
+    existing = _existing_grants()
+    should_be_adult, should_not_be_adult = _adult_flag_drift()
+    return (
+        len(desired - existing),
+        len(existing - desired),
+        should_be_adult.count() + should_not_be_adult.count(),
+    )
+
+
+def rebuild_photo_audience():
+    """
+    Recompute the whole index from allowed_friends and categories.
+    Returns the same counts as check_photo_audience() for what was fixed.
+    """
+    desired = _desired_grants()
+    existing = _existing_grants()
+    missing, stale = desired - existing, existing - desired
+    _apply(missing, stale)
+
+    should_be_adult, should_not_be_adult = _adult_flag_drift()
+    flags = should_be_adult.update(is_adult_only=True)
+    flags += should_not_be_adult.update(is_adult_only=False)
+    return len(missing), len(stale), flags
+
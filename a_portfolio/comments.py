@@ -0,0 +1,52 @@
+"""
+Loading the comments of a photo.
+
+Top-level comments are keyset-paginated oldest first, like the message
+threads, and the replies of a whole page come with one prefetch query
+(with their authors' profiles), so a page of the comment section costs two
+queries however many comments and replies it shows. Reply counts are
+stored on the comment (Comment.reply_count) rather than counted; comments
+from before the column existed get theirs from the recount_photo_stats
+command.
+"""
+from django.db.models import F, Prefetch
+from django.db.models.functions import Greatest
+
+from .models import Comment, Photo
+from .pagination import keyset_page
+
+
+def with_replies(comments):
+    """`comments` with their authors and their replies (and authors) loaded."""
+    replies = Comment.objects.select_related("user__profile").order_by("created_at", "id")
+    return comments.select_related("user__profile").prefetch_related(Prefetch("replies", queryset=replies))
+
+
+def comment_page(photo, cursor=None, page_size: int = 20):
+    """
+    Return (comments, next_cursor) for one page of the top-level comments
+    of `photo`, oldest first, replies included. next_cursor is None on the
+    last page.
+    """
+    comments = with_replies(photo.comments.filter(parent=None))
+    return keyset_page(comments, "created_at", cursor, page_size, descending=False)
+
+
+def delete_comment(comment) -> int:
+    """
+    Delete `comment` with its replies and take them off the photo's
+    comment count (and the parent's reply count). Call inside a
+    transaction. Returns the number of comments deleted.
+    """
+    # replies are removed by the cascade and count towards the total
+    _, deleted = comment.delete()
+    deleted = deleted.get(Comment._meta.label, 0)
+    Photo.objects.filter(pk=comment.photo_id).update(
+        comment_count=Greatest(F("comment_count") - deleted, 0)
+    )
+    if comment.parent_id:
+        Comment.objects.filter(pk=comment.parent_id).update(
+            reply_count=Greatest(F("reply_count") - 1, 0)
+        )
+    return deleted
+
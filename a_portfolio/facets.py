@@ -0,0 +1,34 @@
+"""
+Filter choices for the staff photo list.
+
+Which categories have photos is asked on every visit to the list but only
+changes when a photo is created, moved or deleted, or a category changes,
+so it is cached until one of those happens (see a_portfolio.signals and
+create_photos).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .models import Category, Photo
+
+
+PHOTO_CATEGORIES_KEY = "facets:photo-categories"
+
+
+def photo_categories() -> list:
+    """(slug, name) of the categories that have photos, by name."""
+    choices = cache.get(PHOTO_CATEGORIES_KEY)
+    if choices is None:
+        choices = list(
+            Category.objects.filter(Exists(Photo.objects.filter(category=OuterRef("pk"))))
+            .order_by("name")
+            .values_list("slug", "name")
+        )
+        cache.set(PHOTO_CATEGORIES_KEY, choices, settings.ADMIN_FACET_CACHE_TIMEOUT)
+    return choices
+
+
+def invalidate_photo_categories() -> None:
+    transaction.on_commit(lambda: cache.delete(PHOTO_CATEGORIES_KEY))
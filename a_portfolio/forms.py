@@ -93,6 +93,8 @@ class MultiPhotoUploadForm(forms.Form):
         ),
         required=False,
     )
+    # Storage keys of originals the browser already uploaded to the bucket
+    staged = forms.Field(required=False, widget=forms.MultipleHiddenInput)
     captured_on = forms.DateField(
         required=False,
         widget=forms.DateInput(attrs={"type": "date"}),
@@ -121,9 +123,12 @@ class MultiPhotoUploadForm(forms.Form):
 
     def clean_images(self):
         files = self.files.getlist("images")
-        if not files:
+        if not files and not self.data.getlist("staged"):
             raise ValidationError("Please select at least one image.")
         for f in files:
             validate_image_size(f)
         return files
 
+    def clean_staged(self):
+        return self.data.getlist("staged")
+
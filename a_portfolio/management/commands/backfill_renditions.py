@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from pathlib import Path
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from a_core.imaging import generate_renditions
+
+
+TARGETS = {
+    "photo": "a_portfolio.Photo",
+    "profile": "a_users.Profile",
+    "showcase": "a_showcase.ShowcaseImage",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate responsive WebP/JPEG renditions for existing photos, avatars and "
+        "showcase images. Progress is checkpointed so an interrupted run resumes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--only",
+            nargs="+",
+            choices=sorted(TARGETS),
+            default=sorted(TARGETS),
+            help="Which kinds of images to process.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 2,
+            help="Images processed in parallel (Pillow releases the GIL while resizing).",
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--checkpoint",
+            default=".renditions_checkpoint.json",
+            help="File that records the last processed primary key per model.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Regenerate renditions that already exist and ignore the checkpoint.",
+        )
+
+    def handle(self, *args, **options):
+        checkpoint_path = Path(options["checkpoint"])
+        checkpoint = {}
+        if checkpoint_path.exists() and not options["force"]:
+            try:
+                checkpoint = json.loads(checkpoint_path.read_text())
+            except ValueError as exc:
+                raise CommandError(f"Unreadable checkpoint file {checkpoint_path}: {exc}")
+
+        with ThreadPoolExecutor(max_workers=max(1, options["workers"])) as pool:
+            for key in options["only"]:
+                label = TARGETS[key]
+                app_label = label.split(".")[0]
+                if not apps.is_installed(app_label):
+                    self.stdout.write(f"Skipping {label}: app not installed.")
+                    continue
+                model = apps.get_model(label)
+                done, failed = self._backfill(model, label, pool, checkpoint, checkpoint_path, options)
+                self.stdout.write(
+                    self.style.SUCCESS(f"{label}: {done} processed, {failed} failed.")
+                )
+
+    def _backfill(self, model, label, pool, checkpoint, checkpoint_path, options):
+        qs = model.objects.exclude(image="").exclude(image__isnull=True).order_by("pk")
+        if not options["force"]:
+            qs = qs.filter(renditions={})
+        last_pk = checkpoint.get(label)
+        if last_pk is not None:
+            qs = qs.filter(pk__gt=last_pk)
+
+        def work(obj):
+            try:
+                return obj.pk, generate_renditions(obj.image, model.rendition_widths), None
+            except Exception as exc:  # keep going; the failure is reported below
+                return obj.pk, None, exc
+
+        done = failed = 0
+        while True:
+            batch = list(qs.only("pk", "image", "renditions")[: options["batch_size"]])
+            if not batch:
+                break
+            for pk, renditions, error in pool.map(work, batch):
+                if error is not None:
+                    failed += 1
+                    self.stderr.write(f"{label} {pk}: {error}")
+                    continue
+                model.objects.filter(pk=pk).update(renditions=renditions)
+                done += 1
+
+            checkpoint[label] = batch[-1].pk
+            checkpoint_path.write_text(json.dumps(checkpoint))
+            qs = qs.filter(pk__gt=batch[-1].pk)
+            self.stdout.write(f"{label}: up to pk {batch[-1].pk} ({done} done)")
+        return done, failed
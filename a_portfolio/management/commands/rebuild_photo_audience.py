@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from a_portfolio.audience import check_photo_audience, rebuild_photo_audience
+
+
+class Command(BaseCommand):
+    help = "Check or rebuild the photo audience index and adult-only flags."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report drift; exit with an error if any is found.",
+        )
+
+    def handle(self, *args, **options):
+        if options["check"]:
+            missing, stale, flags = check_photo_audience()
+            summary = f"{missing} missing grants, {stale} stale grants, {flags} wrong adult flags."
+            if missing or stale or flags:
+                raise CommandError(f"Photo audience index is out of sync: {summary}")
+            self.stdout.write(self.style.SUCCESS("Photo audience index is consistent."))
+            return
+
+        missing, stale, flags = rebuild_photo_audience()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Added {missing} grants, removed {stale} stale grants and fixed {flags} adult flags."
+            )
+        )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from a_portfolio.search import index_missing_photos, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the full-text search index of all photos, or with --missing index only the "
+        "photos that are not in it yet (e.g. after the index was first created)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Photos read per batch (default: 1000).",
+        )
+        parser.add_argument("--missing", action="store_true", help="Only index photos missing from the index.")
+
+    def handle(self, *args, **options):
+        if options["missing"]:
+            indexed = index_missing_photos()
+        else:
+            indexed = rebuild_search_index(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} photos."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from a_portfolio.counters import drifted_counters, recount_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Photo.like_count, Photo.comment_count and Comment.reply_count from the "
+        "Like and Comment tables, e.g. after users were deleted along with their likes and "
+        "comments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report drifted photos.")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options["dry_run"]:
+            photos, comments = drifted_counters()
+            self.stdout.write(f"{len(photos)} photos have drifted counters.")
+            self.stdout.write(f"{len(comments)} comments have drifted reply counts.")
+            return
+
+        photos, comments = recount_counters(options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Recounted stats for {photos} photos and {comments} comments.")
+        )
@@ -1,6 +1,7 @@
 from django.db import models
 from django.conf import settings
 from django.utils.text import slugify
+from a_core.imaging import ResponsiveImageMixin
 from a_users.models import Profile
 
 
@@ -25,7 +26,55 @@ class Category(models.Model):
         super().save(*args, **kwargs)
 
 
-class Photo(models.Model):
+class PhotoQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """
+        Photos `user` may see: public and authenticated photos, friends-only
+        photos they were granted through PhotoAudience, and their own photos.
+        Adult-only photos are dropped unless the viewer may see adult content.
+
+        Grants are checked with a single EXISTS against the audience index, so
+        no joins fan out and the query needs no DISTINCT.
+        """
+        if not user.is_authenticated:
+            return self.filter(visibility=Photo.VISIBILITY_PUBLIC, is_adult_only=False)
+
+        profile = getattr(user, "profile", None)
+        can_view_adult = profile.can_view_adult_content if profile else False
+
+        audience = models.Q(
+            visibility__in=[Photo.VISIBILITY_PUBLIC, Photo.VISIBILITY_AUTH]
+        ) | models.Q(
+            models.Exists(
+                PhotoAudience.objects.filter(photo=models.OuterRef("pk"), user=user)
+            )
+        )
+        if not can_view_adult:
+            audience &= models.Q(is_adult_only=False)
+        return self.filter(audience | models.Q(owner=user))
+
+    def with_viewer_state(self, user):
+        """
+        Annotate per-viewer flags in the same query as the photos:
+        - is_liked: `user` liked the photo
+        - can_edit: `user` owns the photo
+        - is_friend_visible: `user` was granted the photo as a friend
+        """
+        if not user.is_authenticated:
+            no = models.Value(False, output_field=models.BooleanField())
+            return self.annotate(is_liked=no, can_edit=no, is_friend_visible=no)
+        return self.annotate(
+            is_liked=models.Exists(Like.objects.filter(photo=models.OuterRef("pk"), user=user)),
+            can_edit=models.ExpressionWrapper(
+                models.Q(owner=user), output_field=models.BooleanField()
+            ),
+            is_friend_visible=models.Exists(
+                PhotoAudience.objects.filter(photo=models.OuterRef("pk"), user=user)
+            ),
+        )
+
+
+class Photo(ResponsiveImageMixin, models.Model):
     VISIBILITY_PUBLIC = "public"
     VISIBILITY_AUTH = "authenticated"
     VISIBILITY_FRIENDS = "friends"
@@ -35,6 +84,9 @@ class Photo(models.Model):
         (VISIBILITY_FRIENDS, "Friends only"),
     ]
 
+    # Grid cards are ~400 CSS px wide, admin lists far smaller
+    rendition_widths = {"thumb": 320, "medium": 640, "large": 1280}
+
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -43,6 +95,7 @@ class Photo(models.Model):
     title = models.CharField(max_length=140)
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to="portfolio/")
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
     captured_on = models.DateField(blank=True, null=True)
     category = models.ForeignKey(
         Category,
@@ -62,24 +115,37 @@ class Photo(models.Model):
         related_name="shared_with_me",
         help_text="Visible to these friends when visibility is friends-only.",
     )
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    is_adult_only = models.BooleanField(
+        default=False,
+        editable=False,
+        help_text="Copy of category.is_adult_only so visibility checks need no join.",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PhotoQuerySet.as_manager()
+
     class Meta:
         ordering = ["-captured_on", "-created_at"]
+        indexes = [
+            models.Index(fields=["visibility", "is_adult_only"]),
+        ]
 
     def __str__(self) -> str:
         return self.title
 
     @property
-    def image_url(self):
-        return self.image.url if self.image else ""
+    def media_is_public(self):
+        # anyone may see these, so their files can be served unsigned (CDN mode)
+        return self.visibility == self.VISIBILITY_PUBLIC and not self.is_adult_only
     
     def get_like_count(self):
-        return self.likes.count()
+        return self.like_count
     
     def get_comment_count(self):
-        return self.comments.count()
+        return self.comment_count
     
     def is_liked_by(self, user):
         if not user.is_authenticated:
@@ -87,6 +153,31 @@ class Photo(models.Model):
         return self.likes.filter(user=user).exists()
 
 
+class PhotoAudience(models.Model):
+    """
+    Materialized viewer grants for friends-only photos: one row per
+    (photo, user) pair derived from Photo.allowed_friends. Kept in sync by
+    a_portfolio.signals; `manage.py rebuild_photo_audience` repairs drift.
+    """
+
+    photo = models.ForeignKey(
+        Photo,
+        on_delete=models.CASCADE,
+        related_name="audience",
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+
+    class Meta:
+        unique_together = [["user", "photo"]]
+
+    def __str__(self):
+        return f"{self.user_id} may view photo {self.photo_id}"
+
+
 class Like(models.Model):
     photo = models.ForeignKey(
         Photo,
@@ -128,14 +219,20 @@ class Comment(models.Model):
         related_name="replies",
         help_text="If this is a reply to another comment",
     )
+    # Maintained by comment_create/comment_delete; recount_photo_stats fixes drift
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["created_at"]
+        indexes = [
+            # top-level comments of a photo, paged oldest first
+            models.Index(fields=["photo", "parent", "created_at", "id"]),
+        ]
 
     def __str__(self):
         return f"{self.user.username} on {self.photo.title}"
     
     def get_reply_count(self):
-        return self.replies.count()
+        return self.reply_count
@@ -0,0 +1,112 @@
+import base64
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+
+
+# Newest first; photos without a capture date sort after dated ones on every
+# database backend, and the primary key breaks ties between identical dates.
+PHOTO_ORDERING = (
+    F("captured_on").desc(nulls_last=True),
+    F("created_at").desc(),
+    F("id").desc(),
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(photo) -> str:
+    """
+    Encode the sort key of `photo` into an opaque, URL-safe cursor.
+    """
+    captured_on = photo.captured_on.isoformat() if photo.captured_on else ""
+    raw = f"{captured_on}|{photo.created_at.isoformat()}|{photo.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """
+    Return the (captured_on, created_at, pk) tuple stored in `cursor`.
+    Raises InvalidCursor for anything we did not produce ourselves.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        captured_on, created_at, pk = raw.split("|")
+        return (
+            date.fromisoformat(captured_on) if captured_on else None,
+            datetime.fromisoformat(created_at),
+            int(pk),
+        )
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+def _after(captured_on, created_at, pk) -> Q:
+    """
+    Rows that come strictly after the given sort key in PHOTO_ORDERING.
+    """
+    same_day_older = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+    if captured_on is None:
+        return Q(captured_on__isnull=True) & same_day_older
+    return (
+        Q(captured_on__lt=captured_on)
+        | (Q(captured_on=captured_on) & same_day_older)
+        | Q(captured_on__isnull=True)
+    )
+
+
+def paginate_photos(queryset, cursor=None, page_size: int = 24):
+    """
+    Return (photos, next_cursor) for one page of `queryset`.
+
+    Instead of OFFSET we seek past the last row of the previous page, so the
+    cost of a page does not depend on how deep into the gallery it is.
+    `next_cursor` is None on the last page.
+    """
+    queryset = queryset.order_by(*PHOTO_ORDERING)
+    if cursor:
+        queryset = queryset.filter(_after(*decode_cursor(cursor)))
+
+    photos = list(queryset[: page_size + 1])
+    if len(photos) <= page_size:
+        return photos, None
+    photos = photos[:page_size]
+    return photos, encode_cursor(photos[-1])
+
+
+def _encode_key(value, pk) -> str:
+    value = value.isoformat() if hasattr(value, "isoformat") else str(value)
+    return base64.urlsafe_b64encode(f"{value}|{pk}".encode()).decode().rstrip("=")
+
+
+def _decode_key(model, field: str, cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode((cursor + "=" * (-len(cursor) % 4)).encode()).decode()
+        value, pk = raw.rsplit("|", 1)
+        return model._meta.get_field(field).to_python(value), int(pk)
+    except (ValueError, UnicodeDecodeError, ValidationError) as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+def keyset_page(queryset, field: str, cursor=None, page_size: int = 50, descending: bool = True):
+    """
+    Return (rows, next_cursor) for one page of `queryset` ordered by
+    `field` and then the primary key, for lists with a single sort column
+    (comments, conversations, the staff lists). next_cursor is None on the
+    last page; a cursor we did not produce raises InvalidCursor.
+    """
+    sign, past = ("-", "lt") if descending else ("", "gt")
+    queryset = queryset.order_by(f"{sign}{field}", f"{sign}pk")
+    if cursor:
+        value, pk = _decode_key(queryset.model, field, cursor)
+        queryset = queryset.filter(Q(**{f"{field}__{past}": value}) | Q(**{field: value, f"pk__{past}": pk}))
+
+    rows = list(queryset[: page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, _encode_key(getattr(rows[-1], field), rows[-1].pk)
@@ -0,0 +1,253 @@
+"""
+Full-text photo search.
+
+Photos are indexed by title, category name and description, weighted in
+that order. The index lives next to the model rather than on it, because
+each database keeps it differently:
+
+- PostgreSQL: a `search_vector` tsvector column on the photo table with a
+  GIN index, ranked with ts_rank_cd.
+- SQLite: an FTS5 table whose rowid is the photo id, ranked with bm25.
+
+Both are created by the a_search migrations. Photo and Category signals
+(and create_photos, whose bulk_create skips them) keep the index current
+one statement at a time; the rebuild_search_index command recomputes all
+of it, or with --missing indexes only the photos that are not in it yet
+(after the index was first created on an existing database).
+
+Other databases fall back to icontains matching, unranked.
+"""
+import base64
+import re
+import struct
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import BooleanField, F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Category, Photo
+from .pagination import InvalidCursor
+
+
+PHOTO_TABLE = Photo._meta.db_table
+CATEGORY_TABLE = Category._meta.db_table
+FTS_TABLE = f"{PHOTO_TABLE}_fts"
+
+# Terms beyond this are ignored; every term has to match
+MAX_TERMS = 8
+# Photo ids per statement, well below SQLite's bound parameter limit
+CHUNK_SIZE = 500
+
+_WORD = re.compile(r"\w+")
+
+
+def _backend(conn=connection):
+    if conn.vendor == "postgresql":
+        return "postgresql"
+    if conn.vendor == "sqlite":
+        return "sqlite"
+    return None
+
+
+def index_missing_photos(using="default") -> int:
+    """
+    Index every photo that is not in the index yet. Returns the number of
+    photos indexed.
+    """
+    conn = connections[using]
+    backend = _backend(conn)
+    if backend is None:
+        return 0
+
+    with conn.cursor() as cursor:
+        if backend == "postgresql":
+            cursor.execute(f"SELECT id FROM {PHOTO_TABLE} WHERE search_vector IS NULL")
+        else:
+            cursor.execute(f"SELECT id FROM {PHOTO_TABLE} WHERE id NOT IN (SELECT rowid FROM {FTS_TABLE})")
+        missing = [row[0] for row in cursor.fetchall()]
+
+    index_photos(missing, using=using)
+    return len(missing)
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def _reindex(condition: str, params, using="default") -> None:
+    """
+    Recompute the index entries of the photos matching `condition`, an SQL
+    condition on the photo table aliased as `p`.
+    """
+    conn = connections[using]
+    backend = _backend(conn)
+    category_name = f"COALESCE((SELECT name FROM {CATEGORY_TABLE} WHERE id = p.category_id), '')"
+
+    with conn.cursor() as cursor:
+        if backend == "postgresql":
+            config = settings.PORTFOLIO_SEARCH_CONFIG
+            cursor.execute(
+                f"UPDATE {PHOTO_TABLE} AS p SET search_vector = "
+                "setweight(to_tsvector(%s::regconfig, p.title), 'A') || "
+                f"setweight(to_tsvector(%s::regconfig, {category_name}), 'B') || "
+                "setweight(to_tsvector(%s::regconfig, p.description), 'C') "
+                f"WHERE {condition}",
+                [config, config, config, *params],
+            )
+        elif backend == "sqlite":
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT id FROM {PHOTO_TABLE} AS p WHERE {condition})",
+                params,
+            )
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, category, description) "
+                f"SELECT p.id, p.title, {category_name}, p.description FROM {PHOTO_TABLE} AS p "
+                f"WHERE {condition}",
+                params,
+            )
+
+
+def index_photos(photo_ids, using="default") -> None:
+    """
+    Bring the index entries of the given photos up to date.
+    """
+    for chunk in _chunks(photo_ids):
+        _reindex(f"p.id IN ({', '.join(['%s'] * len(chunk))})", chunk, using=using)
+
+
+def index_category(category_id, using="default") -> None:
+    """
+    Re-index every photo of a category, e.g. after it was renamed.
+    """
+    _reindex("p.category_id = %s", [category_id], using=using)
+
+
+def unindex_photos(photo_ids, using="default") -> None:
+    """
+    Drop deleted photos from the index. On PostgreSQL the entry went away
+    with the row.
+    """
+    if _backend(connections[using]) != "sqlite":
+        return
+    with connections[using].cursor() as cursor:
+        for chunk in _chunks(photo_ids):
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(chunk))})", chunk
+            )
+
+
+def rebuild_search_index(batch_size: int = 1000) -> int:
+    """
+    Recompute the whole index in batches of photos. Returns the number of
+    photos indexed.
+    """
+    if _backend() == "sqlite":
+        # Entries of photos that no longer exist
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid NOT IN (SELECT id FROM {PHOTO_TABLE})")
+
+    indexed = last_pk = 0
+    while True:
+        pks = list(
+            Photo.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size]
+        )
+        if not pks:
+            return indexed
+        index_photos(pks)
+        indexed += len(pks)
+        last_pk = pks[-1]
+
+
+def search_terms(q: str) -> list:
+    """The words of a search query, lower-cased, at most MAX_TERMS."""
+    return _WORD.findall(q.lower())[:MAX_TERMS]
+
+
+def _match(queryset, terms):
+    """
+    Filter `queryset` to photos matching every term (as a prefix, so results
+    show up while a word is still being typed) and annotate `rank`, higher
+    is better.
+    """
+    backend = _backend(connections[queryset.db])
+    if backend == "postgresql":
+        tsquery = " & ".join(f"'{term}':*" for term in terms)
+        query_sql = "to_tsquery(%s::regconfig, %s)"
+        params = [settings.PORTFOLIO_SEARCH_CONFIG, tsquery]
+        vector = f'"{PHOTO_TABLE}"."search_vector"'
+        return queryset.filter(
+            RawSQL(f"{vector} @@ {query_sql}", params, output_field=BooleanField())
+        ).annotate(rank=RawSQL(f"ts_rank_cd({vector}, {query_sql})::float8", params, output_field=FloatField()))
+
+    if backend == "sqlite":
+        match = " ".join(f'"{term}"*' for term in terms)
+        # bm25 is lower for better matches; weights follow the column order
+        return queryset.filter(
+            RawSQL(
+                f'"{PHOTO_TABLE}"."id" IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)',
+                [match],
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            rank=RawSQL(
+                f"(SELECT -bm25({FTS_TABLE}, 10.0, 5.0, 1.0) FROM {FTS_TABLE} "
+                f'WHERE {FTS_TABLE} MATCH %s AND rowid = "{PHOTO_TABLE}"."id")',
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+    condition = Q()
+    for term in terms:
+        condition &= (
+            Q(title__icontains=term) | Q(description__icontains=term) | Q(category__name__icontains=term)
+        )
+    return queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+def encode_search_cursor(photo) -> str:
+    """
+    Encode the rank and id of `photo` into an opaque cursor. The rank is
+    packed as a double so it comes back bit for bit.
+    """
+    raw = struct.pack(">dQ", photo.rank, photo.pk)
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str):
+    """
+    Return the (rank, pk) stored in `cursor`; InvalidCursor otherwise.
+    """
+    try:
+        raw = base64.urlsafe_b64decode((cursor + "=" * (-len(cursor) % 4)).encode())
+        return struct.unpack(">dQ", raw)
+    except (ValueError, struct.error) as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+def search_photos(queryset, q: str, cursor=None, page_size: int = 24):
+    """
+    Return (photos, next_cursor) for one page of the photos in `queryset`
+    matching `q`, best matches first. `queryset` carries the visibility
+    rules, so nobody finds photos they could not open.
+
+    Pages are keyset-paginated on (rank, id) like paginate_photos; the
+    index narrows the candidates before any row of the photo table is read.
+    """
+    terms = search_terms(q)
+    if not terms:
+        return [], None
+
+    queryset = _match(queryset, terms).order_by(F("rank").desc(), F("id").desc())
+    if cursor:
+        rank, pk = decode_search_cursor(cursor)
+        queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=pk))
+
+    photos = list(queryset[: page_size + 1])
+    if len(photos) <= page_size:
+        return photos, None
+    photos = photos[:page_size]
+    return photos, encode_search_cursor(photos[-1])
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from a_core.imaging import rendition_names
+from a_tasks.tombstones import bury
+
+from .audience import sync_photo_audience
+from .counters import recount, touched_by
+from .facets import invalidate_photo_categories
+from .models import Category, Photo
+from .search import index_category, index_photos, unindex_photos
+from .tasks import queue_acl_sync
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def user_predelete(sender, instance, **kwargs):
+    # their likes and comments elsewhere go in the cascade; note where
+    instance._touched_counters = touched_by(instance)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_postdelete(sender, instance, **kwargs):
+    touched = getattr(instance, "_touched_counters", None)
+    if touched:
+        recount(*touched)
+
+
+@receiver(pre_save, sender=Photo)
+def photo_presave(sender, instance, **kwargs):
+    # keep the denormalized adult flag in step with the category
+    instance.is_adult_only = bool(instance.category and instance.category.is_adult_only)
+
+
+@receiver(post_save, sender=Photo)
+def photo_postsave(sender, instance, created, update_fields=None, **kwargs):
+    index_photos([instance.pk])
+    # only new or moved photos change which categories have photos
+    if created or update_fields is None or "category" in update_fields:
+        invalidate_photo_categories()
+    # a fresh photo has no allowed_friends yet; m2m_changed covers that
+    if not created:
+        sync_photo_audience([instance.pk])
+        # visibility may have changed; new photos are handled after processing
+        queue_acl_sync([instance.pk])
+
+
+@receiver(post_delete, sender=Photo)
+def photo_postdelete(sender, instance, **kwargs):
+    unindex_photos([instance.pk])
+    invalidate_photo_categories()
+    # a_tasks buries the master; derivatives are not FileFields
+    bury(rendition_names(instance.renditions))
+
+
+@receiver(m2m_changed, sender=Photo.allowed_friends.through)
+def photo_allowed_friends_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear", "pre_clear"):
+        return
+    if not reverse:
+        sync_photo_audience([instance.pk])
+    elif action == "pre_clear":
+        # profile.shared_with_me.clear(): remember which photos are affected
+        instance._cleared_photo_ids = list(instance.shared_with_me.values_list("pk", flat=True))
+    elif action == "post_clear":
+        sync_photo_audience(getattr(instance, "_cleared_photo_ids", []))
+    else:
+        sync_photo_audience(pk_set or [])
+
+
+@receiver(post_save, sender=Category)
+def category_postsave(sender, instance, created, **kwargs):
+    if not created:
+        # the name is part of every photo's index entry and of the filter choices
+        index_category(instance.pk)
+        invalidate_photo_categories()
+    changed = Photo.objects.filter(category=instance).exclude(is_adult_only=instance.is_adult_only)
+    changed_ids = list(changed.values_list("pk", flat=True))
+    if changed_ids:
+        Photo.objects.filter(pk__in=changed_ids).update(is_adult_only=instance.is_adult_only)
+        queue_acl_sync(changed_ids)
+
+
+@receiver(pre_delete, sender=Category)
+def category_predelete(sender, instance, **kwargs):
+    # photos fall back to "no category" (SET_NULL), which is never adult-only
+    adult = Photo.objects.filter(category=instance, is_adult_only=True)
+    queue_acl_sync(adult.values_list("pk", flat=True))
+    adult.update(is_adult_only=False)
+    instance._search_photo_ids = list(instance.photos.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def category_postdelete(sender, instance, **kwargs):
+    # the photos lost their category name
+    index_photos(getattr(instance, "_search_photo_ids", []))
+    invalidate_photo_categories()
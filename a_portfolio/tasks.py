@@ -0,0 +1,158 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+import multiprocessing
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.fields.files import FieldFile
+
+from a_core.imaging import generate_renditions, rendition_names, resize_image, resize_image_bytes
+from a_tasks.queue import task
+from a_tasks.tombstones import bury
+
+from .models import Photo
+
+
+logger = logging.getLogger(__name__)
+
+
+def _write_master(photo, master):
+    """
+    Store the resized master file and its renditions. Touches storage only,
+    not the database, so it can run on a thread pool.
+    """
+    field = photo.image.field
+    base_name, _ext = os.path.splitext(os.path.basename(photo.image.name))
+    name = field.storage.save(
+        field.generate_filename(photo, f"{base_name}_max1920.jpg"),
+        master,
+        max_length=field.max_length,
+    )
+    renditions = generate_renditions(FieldFile(photo, field, name), Photo.rendition_widths, master)
+    return name, renditions
+
+
+def _swap_master(photo, name: str, renditions: dict) -> list:
+    """
+    Point the row at the new master unless the photo was deleted or given
+    another image in the meantime. Returns the storage names that are now
+    unused: the original and its renditions, or else the files just written.
+    Call inside a transaction and bury() them there.
+    """
+    swapped = Photo.objects.filter(pk=photo.pk, image=photo.image.name).update(
+        image=name, renditions=renditions
+    )
+    if swapped:
+        return [photo.image.name] + rendition_names(photo.renditions)
+    return [name] + rendition_names(renditions)
+
+
+@task
+def sync_photo_acl(photo_ids: list):
+    """
+    Make the files of the given photos public-read or private to match
+    Photo.media_is_public. Only used when MEDIA_PUBLIC_URL (CDN mode) is set.
+    """
+    storage = Photo._meta.get_field("image").storage
+    if not settings.MEDIA_PUBLIC_URL or not hasattr(storage, "set_public"):
+        return
+    for photo in Photo.objects.filter(pk__in=photo_ids).exclude(image=""):
+        storage.set_public(
+            [photo.image.name] + rendition_names(photo.renditions), photo.media_is_public
+        )
+
+
+def queue_acl_sync(photo_ids):
+    if settings.MEDIA_PUBLIC_URL and photo_ids:
+        sync_photo_acl.enqueue(list(photo_ids))
+
+
+@task
+def process_photo(photo_id: int, name: str):
+    """
+    Replace an uploaded original with the 1920px JPEG master and build its
+    renditions.
+    """
+    photo = Photo.objects.filter(pk=photo_id).first()
+    if photo is None or photo.image.name != name:
+        # deleted, or replaced again; a newer job handles the new file
+        return
+
+    with photo.image.open("rb") as fh, resize_image(fh, 1920, "longest") as master:
+        written = _write_master(photo, master)
+    with transaction.atomic():
+        bury(_swap_master(photo, *written))
+    queue_acl_sync([photo.pk])
+
+
+def _read_original(photo) -> bytes:
+    with photo.image.open("rb") as fh:
+        return fh.read()
+
+
+@task
+def process_photos(items: list):
+    """
+    process_photo for a whole upload batch of ``[photo_id, name]`` pairs.
+
+    Originals are fetched and results stored on a thread pool; decoding and
+    resizing run on a process pool bounded by the core count. A photo that
+    fails gets its own process_photo job, so it is retried on its own.
+    """
+    wanted = {photo_id: name for photo_id, name in items}
+    photos = [
+        photo
+        for photo in Photo.objects.filter(pk__in=wanted)
+        if photo.image.name == wanted[photo.pk]
+    ]
+    if not photos:
+        return
+
+    failed = []
+    stored = []
+    io_workers = min(len(photos), settings.PORTFOLIO_UPLOAD_THREADS)
+    cpu_workers = min(len(photos), os.cpu_count() or 1)
+    # spawn: the children only run Pillow, and must not inherit the
+    # parent's threads or database connections
+    cpu_context = multiprocessing.get_context("spawn")
+
+    with ThreadPoolExecutor(max_workers=io_workers) as io, ProcessPoolExecutor(
+        max_workers=cpu_workers, mp_context=cpu_context
+    ) as cpu:
+        originals = [(photo, io.submit(_read_original, photo)) for photo in photos]
+        resized = []
+        for photo, future in originals:
+            try:
+                data = future.result()
+            except Exception:
+                logger.exception("Could not read photo %s", photo.pk)
+                failed.append(photo)
+                continue
+            limit = settings.MAX_IMAGE_PIXELS
+            resized.append((photo, cpu.submit(resize_image_bytes, data, 1920, max_pixels=limit)))
+
+        written = []
+        for photo, future in resized:
+            try:
+                data, metrics = future.result()
+                logger.info("Photo %s resized: %s", photo.pk, metrics)
+                written.append((photo, io.submit(_write_master, photo, ContentFile(data))))
+            except Exception:
+                logger.exception("Could not resize photo %s", photo.pk)
+                failed.append(photo)
+
+        for photo, future in written:
+            try:
+                stored.append((photo, *future.result()))
+            except Exception:
+                logger.exception("Could not store photo %s", photo.pk)
+                failed.append(photo)
+
+    with transaction.atomic():
+        bury(unused for result in stored for unused in _swap_master(*result))
+
+    for photo in failed:
+        process_photo.enqueue(photo.pk, photo.image.name)
+    queue_acl_sync([photo.pk for photo in photos if photo not in failed])
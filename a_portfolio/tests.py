@@ -1,9 +1,38 @@
-from django.contrib.auth.models import User
-from django.test import Client, TestCase
+import base64
+from datetime import date
+from unittest import mock, skipUnless
+from io import BytesIO, StringIO
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image as PILImage
+import requests
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto is only needed for the S3 tests
+    mock_aws = None
+
+from a_core.imaging import ImageTooLarge, resize_image
+from a_core.storage_backends import CachedSignedUrlMixin, MediaStorage
 
+from a_tasks.models import StorageTombstone
+from a_users import presence
 from a_users.models import Profile
-from .models import Category, Photo
+from .counters import recount_counters
+from .models import Category, Comment, Like, Photo, PhotoAudience
+from .tasks import process_photo
 
 
 class PhotoVisibilityTests(TestCase):
@@ -44,4 +73,615 @@ class PhotoVisibilityTests(TestCase):
         resp = self.client.get(reverse("portfolio-detail", args=[self.friend_photo.pk]))
         self.assertEqual(resp.status_code, 403)
 
+    def test_audience_follows_allowed_friends(self):
+        self.assertIn(self.friend_photo, Photo.objects.visible_to(self.friend))
+        self.friend_photo.allowed_friends.remove(self.friend_profile)
+        self.assertNotIn(self.friend_photo, Photo.objects.visible_to(self.friend))
+        self.friend_profile.shared_with_me.add(self.friend_photo)
+        self.assertIn(self.friend_photo, Photo.objects.visible_to(self.friend))
+
+    def test_adult_category_hides_photo_from_anonymous(self):
+        self.category.is_adult_only = True
+        self.category.save()
+        self.public_photo.refresh_from_db()
+        self.assertTrue(self.public_photo.is_adult_only)
+        self.assertNotIn(self.public_photo, Photo.objects.visible_to(AnonymousUser()))
+
+    def test_rebuild_command_repairs_drift(self):
+        PhotoAudience.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command("rebuild_photo_audience", "--check", stdout=StringIO())
+        call_command("rebuild_photo_audience", stdout=StringIO())
+        call_command("rebuild_photo_audience", "--check", stdout=StringIO())
+        self.assertIn(self.friend_photo, Photo.objects.visible_to(self.friend))
+
+
 # Create your tests here.
+
+
+@override_settings(PORTFOLIO_PAGE_SIZE=2)
+class GalleryPaginationTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.photos = [
+            Photo.objects.create(
+                owner=self.owner,
+                title=f"Photo {i}",
+                image=f"portfolio/{i}.jpg",
+                captured_on=captured_on,
+            )
+            for i, captured_on in enumerate(
+                [date(2024, 5, 1), date(2024, 5, 1), None, date(2023, 1, 1), None]
+            )
+        ]
+        self.client = Client()
+
+    def test_cursor_walks_every_photo_once_in_order(self):
+        seen = []
+        resp = self.client.get(reverse("portfolio"))
+        while True:
+            seen.extend(p.pk for p in resp.context["photos"])
+            next_url = resp.context["next_page_url"]
+            if not next_url:
+                break
+            resp = self.client.get(next_url)
+
+        expected = [p.pk for p in [
+            self.photos[1], self.photos[0], self.photos[3], self.photos[4], self.photos[2],
+        ]]
+        self.assertEqual(seen, expected)
+
+    def test_htmx_request_returns_only_next_cards(self):
+        first = self.client.get(reverse("portfolio"))
+        resp = self.client.get(first.context["next_page_url"], HTTP_HX_REQUEST="true")
+        self.assertTemplateUsed(resp, "a_portfolio/partials/photo_page.html")
+        self.assertTemplateNotUsed(resp, "a_portfolio/gallery.html")
+        self.assertContains(resp, "hx-trigger=\"revealed\"")
+
+    def test_invalid_cursor_is_rejected(self):
+        resp = self.client.get(reverse("portfolio"), {"cursor": "garbage"})
+        self.assertEqual(resp.status_code, 400)
+
+
+@override_settings(PORTFOLIO_PAGE_SIZE=2)
+class PhotoSearchTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.category = Category.objects.create(name="Landscapes")
+        self.title_match = Photo.objects.create(
+            owner=self.owner, title="Harbour at dawn", image="portfolio/1.jpg"
+        )
+        self.description_match = Photo.objects.create(
+            owner=self.owner,
+            title="Boats",
+            description="Fishing boats leaving the harbour",
+            image="portfolio/2.jpg",
+        )
+        self.category_match = Photo.objects.create(
+            owner=self.owner, title="Hills", image="portfolio/3.jpg", category=self.category
+        )
+        self.hidden = Photo.objects.create(
+            owner=self.owner,
+            title="Harbour, friends only",
+            image="portfolio/4.jpg",
+            visibility=Photo.VISIBILITY_FRIENDS,
+        )
+        self.client = Client()
+
+    def _search(self, q):
+        seen = []
+        resp = self.client.get(reverse("search"), {"q": q})
+        while True:
+            seen.extend(p.pk for p in resp.context["photos"])
+            if not resp.context["next_page_url"]:
+                return seen
+            resp = self.client.get(resp.context["next_page_url"])
+
+    def test_title_matches_rank_first_and_hidden_photos_stay_hidden(self):
+        extra = Photo.objects.create(owner=self.owner, title="Harbour lights", image="portfolio/5.jpg")
+        seen = self._search("harb")
+        self.assertEqual(len(seen), 3)
+        self.assertEqual(set(seen[:2]), {self.title_match.pk, extra.pk})
+        self.assertEqual(seen[2], self.description_match.pk)
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self._search("fishing harbour"), [self.description_match.pk])
+        self.assertEqual(self._search("fishing hills"), [])
+
+    def test_edits_and_deletes_update_the_index(self):
+        self.category.name = "Mountains"
+        self.category.save()
+        self.assertEqual(self._search("mountains"), [self.category_match.pk])
+        self.assertEqual(self._search("landscapes"), [])
+
+        self.title_match.title = "Lighthouse"
+        self.title_match.save()
+        self.assertEqual(self._search("lighthouse"), [self.title_match.pk])
+
+        self.category.delete()
+        self.assertEqual(self._search("mountains"), [])
+        self.title_match.delete()
+        self.assertEqual(self._search("lighthouse"), [])
+
+    def test_rebuild_command_restores_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM a_portfolio_photo_fts")
+        self.assertEqual(self._search("hills"), [])
+        call_command("rebuild_search_index", "--missing", stdout=StringIO())
+        self.assertEqual(self._search("hills"), [self.category_match.pk])
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(self._search("hills"), [self.category_match.pk])
+
+    def test_invalid_cursor_is_rejected(self):
+        resp = self.client.get(reverse("search"), {"q": "harbour", "cursor": "garbage"})
+        self.assertEqual(resp.status_code, 400)
+
+
+class PhotoStatsTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.photo = Photo.objects.create(owner=self.owner, title="Counted", image="portfolio/c.jpg")
+        self.client = Client()
+        self.client.login(username="owner", password="pass")
+
+    def test_like_toggle_keeps_counter_exact(self):
+        url = reverse("portfolio-like", args=[self.photo.pk])
+        self.client.post(url)
+        self.photo.refresh_from_db()
+        self.assertEqual(self.photo.like_count, 1)
+        self.client.post(url)
+        self.photo.refresh_from_db()
+        self.assertEqual(self.photo.like_count, 0)
+        self.assertFalse(Like.objects.exists())
+
+    def test_deleting_comment_subtracts_its_replies(self):
+        url = reverse("portfolio-comment", args=[self.photo.pk])
+        self.client.post(url, {"content": "Nice"})
+        parent = Comment.objects.get()
+        self.client.post(url, {"content": "Thanks", "parent_id": parent.pk})
+        self.photo.refresh_from_db()
+        self.assertEqual(self.photo.comment_count, 2)
+
+        self.client.post(reverse("portfolio-comment-delete", args=[self.photo.pk, parent.pk]))
+        self.photo.refresh_from_db()
+        self.assertEqual(self.photo.comment_count, 0)
+
+    def test_replies_are_counted_on_their_parent(self):
+        url = reverse("portfolio-comment", args=[self.photo.pk])
+        self.client.post(url, {"content": "Nice"})
+        parent = Comment.objects.get()
+        for text in ("Thanks", "Cheers"):
+            self.client.post(url, {"content": text, "parent_id": parent.pk})
+        parent.refresh_from_db()
+        self.assertEqual(parent.reply_count, 2)
+
+        reply = parent.replies.first()
+        self.client.post(reverse("portfolio-comment-delete", args=[self.photo.pk, reply.pk]))
+        parent.refresh_from_db()
+        self.assertEqual(parent.reply_count, 1)
+
+        Comment.objects.filter(pk=parent.pk).update(reply_count=0)
+        call_command("recount_photo_stats", stdout=StringIO())
+        parent.refresh_from_db()
+        self.assertEqual(parent.reply_count, 1)
+
+    def test_viewer_state_is_annotated(self):
+        other = User.objects.create_user(username="other", password="pass")
+        Like.objects.create(photo=self.photo, user=self.owner)
+
+        mine = Photo.objects.with_viewer_state(self.owner).get(pk=self.photo.pk)
+        self.assertTrue(mine.is_liked)
+        self.assertTrue(mine.can_edit)
+        theirs = Photo.objects.with_viewer_state(other).get(pk=self.photo.pk)
+        self.assertFalse(theirs.is_liked)
+        self.assertFalse(theirs.can_edit)
+
+        resp = self.client.get(reverse("portfolio-detail", args=[self.photo.pk]))
+        self.assertTrue(resp.context["is_liked"])
+
+    def test_recount_repairs_drift(self):
+        Like.objects.create(photo=self.photo, user=self.owner)
+        call_command("recount_photo_stats", stdout=StringIO())
+        self.photo.refresh_from_db()
+        self.assertEqual(self.photo.like_count, 1)
+
+    def test_deleting_a_user_recounts_what_they_touched(self):
+        url = reverse("portfolio-comment", args=[self.photo.pk])
+        self.client.post(url, {"content": "Mine"})
+        parent = Comment.objects.get()
+        fan = User.objects.create_user(username="fan", password="pass")
+        self.client.force_login(fan)
+        self.client.post(reverse("portfolio-like", args=[self.photo.pk]))
+        self.client.post(url, {"content": "Love it"})
+        self.client.post(url, {"content": "Agreed", "parent_id": parent.pk})
+
+        fan.delete()
+        self.photo.refresh_from_db()
+        parent.refresh_from_db()
+        self.assertEqual((self.photo.like_count, self.photo.comment_count), (0, 1))
+        self.assertEqual(parent.reply_count, 0)
+
+    def test_decrements_never_go_below_zero(self):
+        Like.objects.create(photo=self.photo, user=self.owner)
+        comment = Comment.objects.create(photo=self.photo, user=self.owner, content="Hi")
+        # drifted counters, e.g. rows from before the counters were stored
+        self.client.post(reverse("portfolio-like", args=[self.photo.pk]))
+        self.client.post(reverse("portfolio-comment-delete", args=[self.photo.pk, comment.pk]))
+        self.photo.refresh_from_db()
+        self.assertEqual((self.photo.like_count, self.photo.comment_count), (0, 0))
+
+    def test_gallery_query_count_does_not_grow_with_photos(self):
+        def gallery_queries():
+            presence.flush()  # so no last-seen flush falls into the count
+            cache.clear()  # and both requests count the header badges
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(reverse("portfolio"))
+            return len(ctx.captured_queries)
+
+        baseline = gallery_queries()
+        for i in range(5):
+            photo = Photo.objects.create(owner=self.owner, title=f"P{i}", image=f"portfolio/{i}.jpg")
+            Like.objects.create(photo=photo, user=self.owner)
+            Comment.objects.create(photo=photo, user=self.owner, content="hi")
+        self.assertEqual(gallery_queries(), baseline)
+
+
+def _jpeg_upload(name="upload.jpg", size=(2000, 1000)):
+    buffer = BytesIO()
+    PILImage.new("RGB", size, "teal").save(buffer, format="JPEG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/jpeg")
+
+
+class PhotoRenditionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.owner.profile.role = Profile.ROLE_PHOTOGRAPHER
+        self.owner.profile.save()
+        self.client = Client()
+        self.client.login(username="owner", password="pass")
+
+    def test_upload_generates_webp_and_jpeg_renditions(self):
+        self.client.post(
+            reverse("portfolio-upload"),
+            {"title": "Wide", "visibility": Photo.VISIBILITY_PUBLIC, "images": _jpeg_upload()},
+        )
+        call_command("run_worker", "--burst", stdout=StringIO())
+        photo = Photo.objects.get()
+        self.assertEqual((photo.image_width, photo.image_height), (1920, 960))
+        self.assertEqual(
+            {label: entry["width"] for label, entry in photo.renditions["sizes"].items()},
+            {"thumb": 320, "medium": 640, "large": 1280},
+        )
+        self.assertTrue(photo.image.storage.exists(photo.renditions["sizes"]["thumb"]["webp"]))
+
+        resp = self.client.get(reverse("portfolio"))
+        self.assertContains(resp, 'type="image/webp"')
+        self.assertContains(resp, "320w")
+
+    def test_batch_upload_reports_bad_files_and_processes_the_rest(self):
+        friend = User.objects.create_user(username="friend", password="pass")
+        self.owner.profile.friends.add(friend.profile)
+        category = Category.objects.create(name="Nude", is_adult_only=True)
+        bad = SimpleUploadedFile("notes.jpg", b"not an image", content_type="image/jpeg")
+
+        resp = self.client.post(
+            reverse("portfolio-upload"),
+            {
+                "title": "Batch",
+                "visibility": Photo.VISIBILITY_FRIENDS,
+                "category": category.pk,
+                "allowed_friends": [friend.profile.pk],
+                "images": [_jpeg_upload("a.jpg"), bad, _jpeg_upload("b.jpg", (800, 600))],
+            },
+            follow=True,
+        )
+        self.assertContains(resp, "notes.jpg could not be uploaded")
+
+        photos = Photo.objects.order_by("pk")
+        self.assertEqual(photos.count(), 2)
+        self.assertTrue(all(photo.is_adult_only for photo in photos))
+        self.assertEqual(
+            PhotoAudience.objects.filter(user=friend).count(), 2
+        )
+
+        originals = [photo.image.name for photo in photos]
+        call_command("run_worker", "--burst", stdout=StringIO())
+        storage = Photo._meta.get_field("image").storage
+        for photo, original in zip(photos.all(), originals):
+            self.assertTrue(photo.image.name.endswith("_max1920.jpg"))
+            self.assertFalse(storage.exists(original))
+        self.assertEqual(
+            [len(photo.renditions["sizes"]) for photo in photos.all()], [3, 2]
+        )
+
+    def test_replaced_master_and_renditions_are_buried(self):
+        photo = Photo.objects.create(
+            owner=self.owner, title="Wide", image=SimpleUploadedFile("wide.jpg", _jpeg_upload().read())
+        )
+        original = photo.image.name
+        photo.build_renditions()
+        thumb = photo.renditions["sizes"]["thumb"]["webp"]
+
+        storage = Photo._meta.get_field("image").storage
+        with mock.patch.object(storage, "delete") as delete:
+            process_photo(photo.pk, original)
+        delete.assert_not_called()
+        buried = set(StorageTombstone.objects.values_list("name", flat=True))
+        self.assertIn(original, buried)
+        self.assertIn(thumb, buried)
+        self.assertNotIn(Photo.objects.get().image.name, buried)
+
+    def test_backfill_command_fills_missing_renditions(self):
+        self.client.post(
+            reverse("portfolio-upload"),
+            {"title": "Wide", "visibility": Photo.VISIBILITY_PUBLIC, "images": _jpeg_upload()},
+        )
+        call_command("run_worker", "--burst", stdout=StringIO())
+        Photo.objects.update(renditions={})
+        checkpoint = os.path.join(self.media_root, "checkpoint.json")
+        call_command(
+            "backfill_renditions", "--only", "photo", "--checkpoint", checkpoint, stdout=StringIO()
+        )
+        self.assertEqual(len(Photo.objects.get().renditions["sizes"]), 3)
+
+
+class ImagePipelineTests(TestCase):
+    def _jpeg(self, size, orientation=None):
+        buffer = BytesIO()
+        img = PILImage.new("RGB", size, "teal")
+        exif = img.getexif()
+        if orientation:
+            exif[0x0112] = orientation
+        img.save(buffer, format="JPEG", exif=exif.tobytes())
+        buffer.seek(0)
+        return buffer
+
+    def test_exif_orientation_is_applied(self):
+        # stored landscape, displayed portrait (rotate 90 clockwise)
+        with resize_image(self._jpeg((400, 200), orientation=6), 100) as out:
+            self.assertEqual(out.metrics["output"], "50x100")
+            self.assertEqual(PILImage.open(out).size, (50, 100))
+
+    def test_jpeg_is_decoded_near_target_size(self):
+        # 1/4 scale is the smallest draft that is still at least 600x300
+        with resize_image(self._jpeg((4000, 2000)), 600) as out:
+            self.assertEqual(out.metrics["decoded"], "1000x500")
+            self.assertEqual(out.metrics["output"], "600x300")
+
+    def test_square_crop(self):
+        with resize_image(self._jpeg((300, 200)), 64, "square") as out:
+            self.assertEqual(PILImage.open(out).size, (64, 64))
+
+    def test_pixel_limit(self):
+        with self.assertRaises(ImageTooLarge):
+            resize_image(self._jpeg((400, 300)), 100, max_pixels=100_000)
+
+    @override_settings(MAX_IMAGE_PIXELS=100_000)
+    def test_upload_rejects_images_above_the_pixel_limit(self):
+        owner = User.objects.create_user(username="owner", password="pass")
+        owner.profile.role = Profile.ROLE_PHOTOGRAPHER
+        owner.profile.save()
+        self.client.login(username="owner", password="pass")
+
+        resp = self.client.post(
+            reverse("portfolio-upload"),
+            {"title": "Huge", "visibility": Photo.VISIBILITY_PUBLIC, "images": _jpeg_upload()},
+            follow=True,
+        )
+        self.assertContains(resp, "is more than the allowed")
+        self.assertFalse(Photo.objects.exists())
+
+
+class _SigningStorage:
+    def __init__(self):
+        self.signed = []
+
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        self.signed.append((name, expire))
+        return f"https://bucket/{name}?sig={len(self.signed)}"
+
+
+class _CachedSigningStorage(CachedSignedUrlMixin, _SigningStorage):
+    pass
+
+
+@override_settings(MEDIA_URL_EXPIRY_WINDOW=3600)
+class CachedMediaUrlTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_urls_are_stable_within_a_window(self):
+        storage = _CachedSigningStorage()
+        with mock.patch("a_core.storage_backends.time.time", return_value=7200 + 600):
+            first = storage.url("portfolio/a.jpg")
+            self.assertEqual(storage.url("portfolio/a.jpg"), first)
+            # valid until the end of the following window
+            self.assertEqual(storage.signed, [("portfolio/a.jpg", 2 * 3600 - 600)])
+
+        # another process (empty local memo) gets the URL from the shared cache
+        other = _CachedSigningStorage()
+        with mock.patch("a_core.storage_backends.time.time", return_value=7200 + 3000):
+            self.assertEqual(other.url("portfolio/a.jpg"), first)
+            self.assertEqual(other.signed, [])
+
+        with mock.patch("a_core.storage_backends.time.time", return_value=3 * 3600 + 1):
+            self.assertNotEqual(storage.url("portfolio/a.jpg"), first)
+
+    def test_explicit_expiry_is_not_cached(self):
+        storage = _CachedSigningStorage()
+        storage.url("a.jpg", expire=60)
+        storage.url("a.jpg", expire=60)
+        self.assertEqual(len(storage.signed), 2)
+
+    @override_settings(MEDIA_PUBLIC_URL="https://cdn.example.com/media/")
+    def test_public_photos_use_the_cdn_url(self):
+        storage = _CachedSigningStorage()
+        storage.public_url = lambda name: "https://cdn.example.com/media/" + name
+        owner = User.objects.create_user(username="owner", password="pass")
+        photo = Photo(owner=owner, title="P", image="portfolio/p.jpg")
+
+        with mock.patch.object(Photo, "_rendition_storage", return_value=storage):
+            photo.visibility = Photo.VISIBILITY_PUBLIC
+            self.assertEqual(photo.image_url, "https://cdn.example.com/media/portfolio/p.jpg")
+            photo.visibility = Photo.VISIBILITY_AUTH
+            self.assertTrue(photo.image_url.startswith("https://bucket/portfolio/p.jpg?sig="))
+
+
+@skipUnless(mock_aws, "moto is not installed")
+class DirectUploadTests(TestCase):
+    """Presigned POST uploads against moto's in-process S3."""
+
+    def setUp(self):
+        mocked = mock_aws()
+        mocked.start()
+        self.addCleanup(mocked.stop)
+
+        self.storage = MediaStorage(
+            bucket_name="media-test", access_key="test", secret_key="test", region_name="us-east-1"
+        )
+        self.storage.connection.meta.client.create_bucket(Bucket="media-test")
+        patch = mock.patch.object(Photo._meta.get_field("image"), "storage", self.storage)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.owner.profile.role = Profile.ROLE_PHOTOGRAPHER
+        self.owner.profile.save()
+        self.client = Client()
+        self.client.login(username="owner", password="pass")
+
+    def _presign(self, *files):
+        resp = self.client.post(
+            reverse("portfolio-upload-presign"),
+            json.dumps({"files": [{"name": f.name, "size": f.size, "type": "image/jpeg"} for f in files]}),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()["uploads"]
+
+    def _browser_post(self, upload, data):
+        # what the page's JavaScript does, straight to the bucket
+        return requests.post(upload["url"], data=upload["fields"], files={"file": ("f.jpg", data)})
+
+    def test_staged_originals_are_processed(self):
+        photo_file = _jpeg_upload("beach.jpg")
+        bad_file = SimpleUploadedFile("notes.jpg", b"not an image")
+        photo_upload, bad_upload = self._presign(photo_file, bad_file)
+        self.assertTrue(photo_upload["key"].startswith(f"staging/{self.owner.pk}/"))
+        self.assertTrue(photo_upload["key"].endswith("/beach.jpg"))
+        self.assertTrue(self._browser_post(photo_upload, photo_file.read()).ok)
+        self.assertTrue(self._browser_post(bad_upload, bad_file.read()).ok)
+
+        resp = self.client.post(
+            reverse("portfolio-upload"),
+            {
+                "title": "Direct",
+                "visibility": Photo.VISIBILITY_PUBLIC,
+                "staged": [photo_upload["key"], bad_upload["key"], "staging/999/x/other.jpg"],
+            },
+            follow=True,
+        )
+        self.assertContains(resp, "notes.jpg could not be uploaded: not a supported image")
+        self.assertContains(resp, "other.jpg could not be uploaded: not an upload of yours")
+        photo = Photo.objects.get()
+        self.assertTrue(photo.image.name.startswith("portfolio/beach"))
+        self.assertFalse(self.storage.exists(photo_upload["key"]))
+        self.assertFalse(self.storage.exists(bad_upload["key"]))
+
+        call_command("run_worker", "--burst", stdout=StringIO())
+        photo.refresh_from_db()
+        self.assertTrue(photo.image.name.startswith("portfolio/beach"))
+        self.assertEqual((photo.image_width, photo.image_height), (1920, 960))
+
+    def test_staged_key_is_claimed_once(self):
+        photo_file = _jpeg_upload("beach.jpg")
+        (upload,) = self._presign(photo_file)
+        self.assertTrue(self._browser_post(upload, photo_file.read()).ok)
+
+        data = {"title": "Twice", "visibility": Photo.VISIBILITY_PUBLIC, "staged": [upload["key"]] * 2}
+        self.client.post(reverse("portfolio-upload"), data)
+        resp = self.client.post(reverse("portfolio-upload"), data, follow=True)
+        self.assertContains(resp, "beach.jpg could not be uploaded: the upload did not reach storage")
+        photo = Photo.objects.get()
+        self.assertTrue(self.storage.exists(photo.image.name))
+
+    @override_settings(PORTFOLIO_DIRECT_UPLOAD_MAX_FILES=1)
+    def test_claims_are_capped(self):
+        resp = self.client.post(
+            reverse("portfolio-upload"),
+            {
+                "title": "Many",
+                "visibility": Photo.VISIBILITY_PUBLIC,
+                "staged": [f"staging/{self.owner.pk}/{n}/p.jpg" for n in "ab"],
+            },
+            follow=True,
+        )
+        self.assertContains(resp, "p.jpg could not be uploaded: at most 1 images can be uploaded at a time")
+
+    def test_policy_limits_size_and_type(self):
+        with self.settings(PORTFOLIO_DIRECT_UPLOAD_MAX_SIZE=1000):
+            resp = self.client.post(
+                reverse("portfolio-upload-presign"),
+                json.dumps({"files": [{"name": "big.jpg", "size": 5000, "type": "image/jpeg"}]}),
+                content_type="application/json",
+            )
+            self.assertEqual(resp.status_code, 400)
+            (upload,) = self._presign(SimpleUploadedFile("small.jpg", b"x" * 10))
+        # moto does not enforce POST policies, so check what S3 would
+        policy = json.loads(base64.b64decode(upload["fields"]["policy"]))
+        self.assertIn(["content-length-range", 1, 1000], policy["conditions"])
+        self.assertIn({"Content-Type": "image/jpeg"}, policy["conditions"])
+        self.assertIn({"key": "media/" + upload["key"]}, policy["conditions"])
+
+
+@override_settings(PORTFOLIO_COMMENTS_PAGE_SIZE=3)
+class PhotoCommentTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.photo = Photo.objects.create(
+            owner=self.owner, title="Talked about", image="portfolio/t.jpg", visibility=Photo.VISIBILITY_PUBLIC
+        )
+        self.comments = []
+        for n in range(5):
+            author = User.objects.create_user(username=f"fan{n}", password="pass")
+            comment = Comment.objects.create(photo=self.photo, user=author, content=f"comment {n}")
+            for m in range(2):
+                Comment.objects.create(photo=self.photo, user=author, content=f"reply {m}", parent=comment)
+            Comment.objects.filter(pk=comment.pk).update(reply_count=2)
+            self.comments.append(comment)
+
+    def test_comment_section_runs_a_fixed_number_of_queries(self):
+        url = reverse("portfolio-detail", args=[self.photo.pk])
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(url)
+        comment_queries = [q for q in queries if "a_portfolio_comment" in q["sql"]]
+        self.assertEqual(len(comment_queries), 2)  # one page of comments, all their replies
+        self.assertContains(resp, "reply 1", count=3)
+
+    def test_show_more_pages_through_top_level_comments(self):
+        resp = self.client.get(reverse("portfolio-detail", args=[self.photo.pk]))
+        seen = list(resp.context["comments"])
+        resp = self.client.get(resp.context["more_comments_url"], HTTP_HX_REQUEST="true")
+        self.assertTemplateUsed(resp, "a_portfolio/partials/comment_page.html")
+        seen.extend(resp.context["comments"])
+        self.assertIsNone(resp.context["more_comments_url"])
+        self.assertEqual(seen, self.comments)
+
+        bad = self.client.get(reverse("portfolio-comments", args=[self.photo.pk]), {"cursor": "junk"})
+        self.assertEqual(bad.status_code, 400)
+
+    def test_more_comments_follow_photo_visibility(self):
+        Photo.objects.filter(pk=self.photo.pk).update(visibility=Photo.VISIBILITY_AUTH)
+        resp = self.client.get(reverse("portfolio-comments", args=[self.photo.pk]))
+        self.assertEqual(resp.status_code, 403)
+
+    def test_reply_counts_are_backfilled(self):
+        Comment.objects.update(reply_count=0)
+        self.assertEqual(recount_counters()[1], 5)
+        self.assertEqual(set(Comment.objects.filter(parent=None).values_list("reply_count", flat=True)), {2})
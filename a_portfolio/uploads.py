@@ -0,0 +1,213 @@
+"""
+Batch upload of portfolio photos.
+
+The request only does the I/O: every file is sniffed and written to storage
+on a thread pool, then all Photo rows and their allowed_friends rows are
+inserted with bulk_create in one transaction. Decoding and resizing happen
+later in a single process_photos job (see tasks.py).
+
+A file that cannot be stored is reported back instead of failing the batch.
+
+With S3 storage the browser can skip the web server altogether ("direct
+uploads"): presign_uploads hands out presigned POST forms for keys under
+the user's staging prefix, the browser sends the originals to the bucket
+and then submits only the keys. claim_staged checks each object's image
+header with a ranged GET and moves it out of the staging prefix under a
+fresh name, so a key submitted twice (a double click, a retried POST) is
+claimed only once and no two photos ever share an original.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import mimetypes
+import os
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from PIL import UnidentifiedImageError
+
+from a_core.imaging import image_size
+from a_core.storage_backends import is_s3, move, presigned_post, read_head
+from a_stats.stats import track as track_stats
+
+from .audience import sync_photo_audience
+from .facets import invalidate_photo_categories
+from .models import Photo
+from .search import index_photos
+from .tasks import process_photos
+
+
+def _store_original(upload) -> str:
+    # Header-only check, also enforces MAX_IMAGE_PIXELS
+    try:
+        image_size(upload)
+    except (UnidentifiedImageError, OSError) as exc:
+        raise ValueError("not a supported image") from exc
+
+    field = Photo._meta.get_field("image")
+    name = field.generate_filename(None, upload.name)
+    return field.storage.save(name, upload, max_length=field.max_length)
+
+
+def store_originals(uploads):
+    """
+    Write the uploaded files to storage concurrently.
+
+    Returns ``(stored, failed)``: a list of ``(upload, storage_name)`` and a
+    list of ``(filename, error message)``, both in upload order.
+    """
+    if not uploads:
+        return [], []
+
+    workers = min(len(uploads), settings.PORTFOLIO_UPLOAD_THREADS)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_store_original, upload) for upload in uploads]
+
+    stored, failed = [], []
+    for upload, future in zip(uploads, futures):
+        try:
+            stored.append((upload, future.result()))
+        except Exception as exc:
+            failed.append((upload.name, str(exc) or exc.__class__.__name__))
+    return stored, failed
+
+
+def direct_uploads_enabled() -> bool:
+    return settings.PORTFOLIO_DIRECT_UPLOADS and is_s3(Photo._meta.get_field("image").storage)
+
+
+def staging_prefix(user) -> str:
+    return f"{settings.PORTFOLIO_STAGING_PREFIX}{user.pk}/"
+
+
+def presign_uploads(user, files):
+    """
+    Presigned POST forms for `files`, a list of ``{"name", "size", "type"}``
+    dicts sent by the browser. Returns one ``{"key", "url", "fields"}`` per
+    file, in the same order. Raises ValueError for files that would be
+    refused anyway.
+    """
+    if not files or len(files) > settings.PORTFOLIO_DIRECT_UPLOAD_MAX_FILES:
+        raise ValueError(f"Upload between 1 and {settings.PORTFOLIO_DIRECT_UPLOAD_MAX_FILES} images at a time.")
+
+    storage = Photo._meta.get_field("image").storage
+    uploads = []
+    for entry in files:
+        name = os.path.basename(entry["name"]) or "image"
+        if entry["size"] > settings.PORTFOLIO_DIRECT_UPLOAD_MAX_SIZE:
+            raise ValueError(f"{name} is too large.")
+        content_type = entry.get("type") or mimetypes.guess_type(name)[0] or ""
+        if not content_type.startswith("image/"):
+            raise ValueError(f"{name} is not an image.")
+
+        # the random directory keeps the original filename readable
+        key = f"{staging_prefix(user)}{uuid.uuid4().hex}/{storage.get_valid_name(name)}"
+        form = presigned_post(
+            storage,
+            key,
+            content_type=content_type,
+            max_size=settings.PORTFOLIO_DIRECT_UPLOAD_MAX_SIZE,
+            expire=settings.PORTFOLIO_DIRECT_UPLOAD_EXPIRE,
+        )
+        uploads.append({"key": key, "url": form["url"], "fields": form["fields"]})
+    return uploads
+
+
+def _check_staged(storage, name: str) -> str:
+    try:
+        head = read_head(storage, name, settings.PORTFOLIO_HEADER_BYTES)
+    except Exception as exc:
+        raise ValueError("the upload did not reach storage") from exc
+    try:
+        # Header-only check, also enforces MAX_IMAGE_PIXELS
+        image_size(BytesIO(head))
+    except (UnidentifiedImageError, OSError) as exc:
+        raise ValueError("not a supported image") from exc
+    field = Photo._meta.get_field("image")
+    try:
+        return move(storage, name, field.generate_filename(None, os.path.basename(name)))
+    except Exception as exc:
+        # most likely claimed by a concurrent submit of the same key
+        raise ValueError("the upload did not reach storage") from exc
+
+
+def claim_staged(user, names):
+    """
+    store_originals for direct uploads: check the staged objects `names`
+    on a thread pool and move them to where the photos are kept. Objects
+    that are not images are deleted right away; keys past
+    PORTFOLIO_DIRECT_UPLOAD_MAX_FILES are refused.
+
+    Returns ``(stored, failed)`` like store_originals, with the filename in
+    place of the upload.
+    """
+    storage = Photo._meta.get_field("image").storage
+    prefix = staging_prefix(user)
+    limit = settings.PORTFOLIO_DIRECT_UPLOAD_MAX_FILES
+    stored, failed = [], []
+    mine = []
+    for name in dict.fromkeys(names):
+        if not (name.startswith(prefix) and ".." not in name):
+            failed.append((os.path.basename(name), "not an upload of yours"))
+        elif len(mine) >= limit:
+            failed.append((os.path.basename(name), f"at most {limit} images can be uploaded at a time"))
+        else:
+            mine.append(name)
+    if not mine:
+        return stored, failed
+
+    workers = min(len(mine), settings.PORTFOLIO_UPLOAD_THREADS)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_check_staged, storage, name) for name in mine]
+
+        for name, future in zip(mine, futures):
+            try:
+                stored.append((os.path.basename(name), future.result()))
+            except Exception as exc:
+                failed.append((os.path.basename(name), str(exc) or exc.__class__.__name__))
+                pool.submit(storage.delete, name)
+    return stored, failed
+
+
+def create_photos(owner, names, *, allowed_friends=(), **fields):
+    """
+    Insert one Photo per storage name, plus the allowed_friends links, in a
+    single transaction and queue their processing. Returns the new photos.
+
+    bulk_create skips signals, so the denormalized adult flag, the
+    audience index, the search index, the site statistics and the cached
+    filter choices are taken care of here.
+    """
+    if not names:
+        return []
+
+    category = fields.get("category")
+    photos = [
+        Photo(
+            owner=owner,
+            image=name,
+            is_adult_only=bool(category and category.is_adult_only),
+            **fields,
+        )
+        for name in names
+    ]
+    through = Photo.allowed_friends.through
+
+    with transaction.atomic():
+        photos = Photo.objects.bulk_create(photos)
+        if allowed_friends:
+            through.objects.bulk_create(
+                [
+                    through(photo_id=photo.pk, profile_id=friend.pk)
+                    for photo in photos
+                    for friend in allowed_friends
+                ]
+            )
+            sync_photo_audience([photo.pk for photo in photos])
+        index_photos([photo.pk for photo in photos])
+        track_stats(photos)
+        if category:
+            invalidate_photo_categories()
+        process_photos.enqueue([[photo.pk, photo.image.name] for photo in photos])
+
+    return photos
@@ -1,49 +1,35 @@
-from io import BytesIO
-import os
+import json
 
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import HttpResponseForbidden
+from django.conf import settings
+from django.http import Http404, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.db import models
-from django.core.files.base import ContentFile
-from PIL import Image
+from django.urls import reverse
+from django.views.decorators.http import require_POST
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
 
+from .comments import comment_page, delete_comment, with_replies
 from .forms import CategoryForm, PhotoForm, CommentForm, MultiPhotoUploadForm
 from .models import Category, Photo, Like, Comment
+from .pagination import InvalidCursor, paginate_photos
+from .tasks import process_photo
+from .uploads import (
+    claim_staged,
+    create_photos,
+    direct_uploads_enabled,
+    presign_uploads,
+    store_originals,
+)
+from a_stats import stats
+from a_tasks import tombstones
 from a_users.models import Profile
 from a_users.models import Profile
 
 
-def _resize_longest_side(file_obj, target: int = 1920) -> ContentFile:
-    """
-    Resize an image so that its longest side is `target` pixels,
-    keeping aspect ratio. Returns a ContentFile ready to be saved.
-    """
-    img = Image.open(file_obj)
-    img = img.convert("RGB")
-
-    width, height = img.size
-    longest = max(width, height)
-
-    if longest <= target:
-        # Image is already smaller than target, just save it
-        buffer = BytesIO()
-        img.save(buffer, format="JPEG", quality=90)
-        buffer.seek(0)
-        return ContentFile(buffer.read())
-
-    scale = target / longest
-    new_size = (int(width * scale), int(height * scale))
-    img = img.resize(new_size, Image.LANCZOS)
-
-    buffer = BytesIO()
-    img.save(buffer, format="JPEG", quality=90)
-    buffer.seek(0)
-    return ContentFile(buffer.read())
-
-
 def _user_can_upload(user):
     if not user.is_authenticated:
         return False
@@ -60,48 +46,39 @@ def _filter_photos_for_user(user):
     - Authenticated: visible to logged-in users
     - Friends: visible to owner or if user is in allowed_friends
     - Adult-only: filtered based on user age and preferences
+    See PhotoQuerySet.visible_to for how this is resolved.
     """
-    public_qs = Photo.objects.filter(visibility=Photo.VISIBILITY_PUBLIC)
-    if not user.is_authenticated:
-        # Non-authenticated users: only public, non-adult photos
-        return public_qs.filter(
-            models.Q(category__isnull=True) | models.Q(category__is_adult_only=False)
-        ).select_related("category", "owner", "owner__profile")
+    return Photo.objects.visible_to(user).select_related("category", "owner", "owner__profile")
 
-    profile = getattr(user, "profile", None)
-    can_view_adult = profile and profile.can_view_adult_content if profile else False
-    
-    auth_qs = Photo.objects.filter(visibility=Photo.VISIBILITY_AUTH)
-    friends_qs = Photo.objects.filter(visibility=Photo.VISIBILITY_FRIENDS).filter(
-        allowed_friends__in=[profile] if profile else []
-    )
-    own_qs = Photo.objects.filter(owner=user)
-    
-    # Filter adult-only content
-    if not can_view_adult:
-        # Exclude photos in adult-only categories
-        public_qs = public_qs.filter(
-            models.Q(category__isnull=True) | models.Q(category__is_adult_only=False)
-        )
-        auth_qs = auth_qs.filter(
-            models.Q(category__isnull=True) | models.Q(category__is_adult_only=False)
-        )
-        friends_qs = friends_qs.filter(
-            models.Q(category__isnull=True) | models.Q(category__is_adult_only=False)
+
+def _render_photo_page(request, template, photos, context):
+    """
+    Render one keyset page of `photos`. HTMX "load more" requests only get the
+    next slice of cards; full page loads render `template` with `context`.
+    """
+    cursor = request.GET.get("cursor")
+    try:
+        page, next_cursor = paginate_photos(
+            photos, cursor, page_size=settings.PORTFOLIO_PAGE_SIZE
         )
-        # Owners can always see their own photos, but we filter for consistency
-    
-    return (
-        public_qs
-        | auth_qs
-        | friends_qs
-        | own_qs
-    ).distinct().select_related("category", "owner", "owner__profile")
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid page cursor.")
+
+    next_page_url = None
+    if next_cursor:
+        query = request.GET.copy()
+        query["cursor"] = next_cursor
+        next_page_url = f"{request.path}?{query.urlencode()}"
+
+    context = {**context, "photos": page, "next_page_url": next_page_url}
+    if request.htmx and cursor:
+        return render(request, "a_portfolio/partials/photo_page.html", context)
+    return render(request, template, context)
 
 
 def portfolio_list(request):
     category_slug = request.GET.get("category")
-    photos = _filter_photos_for_user(request.user)
+    photos = _filter_photos_for_user(request.user).with_viewer_state(request.user)
     selected_category = None
     requires_login = False
     
@@ -119,9 +96,8 @@ def portfolio_list(request):
             # Check if there are any public photos in this category
             has_public_photos = Photo.objects.filter(
                 category=selected_category,
-                visibility=Photo.VISIBILITY_PUBLIC
-            ).filter(
-                models.Q(category__isnull=True) | models.Q(category__is_adult_only=False)
+                visibility=Photo.VISIBILITY_PUBLIC,
+                is_adult_only=False,
             ).exists()
             
             # If category has non-public photos but no public photos (or filtered out), require login
@@ -129,11 +105,11 @@ def portfolio_list(request):
                 requires_login = True
 
     categories = Category.objects.all()
-    return render(
+    return _render_photo_page(
         request,
         "a_portfolio/gallery.html",
+        photos,
         {
-            "photos": photos,
             "categories": categories,
             "selected_category": selected_category,
             "requires_login": requires_login,
@@ -154,6 +130,7 @@ def my_portfolio(request):
 
     photos = (
         Photo.objects.filter(owner=request.user)
+        .with_viewer_state(request.user)
         .select_related("category", "owner", "owner__profile")
         .order_by("-captured_on", "-created_at")
     )
@@ -176,12 +153,14 @@ def user_portfolio(request, username):
     if request.user.is_authenticated and request.user == target_user:
         photos = (
             Photo.objects.filter(owner=target_user)
+            .with_viewer_state(request.user)
             .select_related("category", "owner", "owner__profile")
             .order_by("-captured_on", "-created_at")
         )
     else:
         photos = (
             _filter_photos_for_user(request.user)
+            .with_viewer_state(request.user)
             .filter(owner=target_user)
             .order_by("-captured_on", "-created_at")
         )
@@ -196,80 +175,93 @@ def user_portfolio(request, username):
 @login_required
 def portfolio_private(request):
     categories = Category.objects.all()
-    profile = getattr(request.user, "profile", None)
-    can_view_adult = profile and profile.can_view_adult_content if profile else False
-
-    auth_qs = Photo.objects.filter(visibility=Photo.VISIBILITY_AUTH)
-    friends_qs = Photo.objects.filter(
-        visibility=Photo.VISIBILITY_FRIENDS,
-        allowed_friends__in=[profile] if profile else []
+    # Authenticated and friends-only photos, plus only your non-public photos
+    photos = (
+        _filter_photos_for_user(request.user)
+        .exclude(visibility=Photo.VISIBILITY_PUBLIC)
+        .with_viewer_state(request.user)
     )
-    # Only your non-public photos in this private view
-    own_qs = Photo.objects.filter(owner=request.user).exclude(visibility=Photo.VISIBILITY_PUBLIC)
-
-    # Filter adult-only content
-    if not can_view_adult:
-        auth_qs = auth_qs.filter(
-            models.Q(category__isnull=True) | models.Q(category__is_adult_only=False)
-        )
-        friends_qs = friends_qs.filter(
-            models.Q(category__isnull=True) | models.Q(category__is_adult_only=False)
-        )
-        # Owners can always see their own photos
-
-    photos = (auth_qs | friends_qs | own_qs).distinct().select_related("category", "owner", "owner__profile")
-    return render(
+    return _render_photo_page(
         request,
         "a_portfolio/gallery_private.html",
-        {"photos": photos, "categories": categories},
+        photos,
+        {"categories": categories},
     )
 
 
-def photo_detail(request, pk):
+def _viewable_photo(request, pk):
+    """
+    Return (photo, None) if the requester may see photo `pk`, or
+    (None, response) with the 403 to send back.
+    """
     photo = get_object_or_404(
-        Photo.objects.select_related("category", "owner", "owner__profile"), pk=pk
+        Photo.objects.select_related("category", "owner", "owner__profile").with_viewer_state(
+            request.user
+        ),
+        pk=pk,
     )
     
     # Check adult-only content restriction
-    if photo.category and photo.category.is_adult_only:
+    if photo.is_adult_only:
         if not request.user.is_authenticated:
-            return HttpResponseForbidden("You must be logged in and 18+ to view this content.")
+            return None, HttpResponseForbidden("You must be logged in and 18+ to view this content.")
         profile = getattr(request.user, "profile", None)
         if not (profile and profile.can_view_adult_content):
-            return HttpResponseForbidden("This content is restricted to users 18+ who have adult content enabled in their profile settings.")
+            return None, HttpResponseForbidden("This content is restricted to users 18+ who have adult content enabled in their profile settings.")
     
     allowed = photo.visibility == Photo.VISIBILITY_PUBLIC
     if request.user.is_authenticated:
-        if photo.owner == request.user:
+        if photo.can_edit:
             allowed = True
         elif photo.visibility == Photo.VISIBILITY_AUTH:
             allowed = True
-        elif (
-            photo.visibility == Photo.VISIBILITY_FRIENDS
-            and getattr(request.user, "profile", None)
-            in photo.allowed_friends.all()
-        ):
+        elif photo.visibility == Photo.VISIBILITY_FRIENDS and photo.is_friend_visible:
             allowed = True
     if not allowed:
-        return HttpResponseForbidden("You do not have access to this photo.")
+        return None, HttpResponseForbidden("You do not have access to this photo.")
+    return photo, None
+
+
+def _comments_context(photo, cursor=None):
+    """
+    Context for the comment partials: one page of top-level comments with
+    their replies, and the URL of the next page.
+    """
+    comments, next_cursor = comment_page(photo, cursor, page_size=settings.PORTFOLIO_COMMENTS_PAGE_SIZE)
+    more_comments_url = None
+    if next_cursor:
+        more_comments_url = f"{reverse('portfolio-comments', args=[photo.pk])}?cursor={next_cursor}"
+    return {"comments": comments, "photo": photo, "more_comments_url": more_comments_url}
 
-    comments = photo.comments.filter(parent=None).select_related("user", "user__profile")
-    is_liked = False
-    if request.user.is_authenticated:
-        is_liked = photo.is_liked_by(request.user)
+
+def photo_detail(request, pk):
+    photo, forbidden = _viewable_photo(request, pk)
+    if forbidden:
+        return forbidden
 
     return render(
         request,
         "a_portfolio/photo_detail.html",
         {
-            "photo": photo,
-            "comments": comments,
-            "is_liked": is_liked,
+            **_comments_context(photo),
+            "is_liked": photo.is_liked,
             "comment_form": CommentForm(),
         },
     )
 
 
+def photo_comments(request, pk):
+    """The next page of a photo's top-level comments, for "Show more comments" (HTMX)."""
+    photo, forbidden = _viewable_photo(request, pk)
+    if forbidden:
+        return forbidden
+    try:
+        context = _comments_context(photo, request.GET.get("cursor"))
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid page cursor.")
+    return render(request, "a_portfolio/partials/comment_page.html", context)
+
+
 @login_required
 def photo_create(request):
     if not _user_can_upload(request.user):
@@ -277,35 +269,37 @@ def photo_create(request):
     if request.method == "POST":
         form = MultiPhotoUploadForm(request.POST, request.FILES, user=request.user)
         if form.is_valid():
-            images = form.cleaned_data["images"]
-            uploaded_count = 0
-            for image_file in images:
-                photo = Photo(
-                    owner=request.user,
-                    title=form.cleaned_data["title"],
-                    description=form.cleaned_data.get("description", ""),
-                    captured_on=form.cleaned_data.get("captured_on"),
-                    category=form.cleaned_data.get("category"),
-                    visibility=form.cleaned_data.get("visibility", Photo.VISIBILITY_PUBLIC),
-                )
-                photo.save()
-
-                processed = _resize_longest_side(image_file, target=1920)
-                base_name, _ext = os.path.splitext(image_file.name)
-                filename = f"{base_name}_max1920.jpg"
-                photo.image.save(filename, processed, save=True)
-
-                allowed_friends = form.cleaned_data.get("allowed_friends")
-                if allowed_friends:
-                    photo.allowed_friends.set(allowed_friends)
-                
-                uploaded_count += 1
-
-            messages.success(
-                request,
-                f"Successfully uploaded {uploaded_count} image{'' if uploaded_count == 1 else 's'}!"
+            if form.cleaned_data["staged"]:
+                # Direct upload: the originals are already in the bucket
+                stored, failed = claim_staged(request.user, form.cleaned_data["staged"])
+                failed += [
+                    (filename, "the upload did not finish")
+                    for filename in request.POST.getlist("failed")
+                ]
+            else:
+                stored, failed = store_originals(form.cleaned_data["images"])
+            # A worker shrinks the originals to the 1920px master and builds
+            # the renditions (tasks.process_photos)
+            create_photos(
+                request.user,
+                [name for _upload, name in stored],
+                allowed_friends=form.cleaned_data.get("allowed_friends") or (),
+                title=form.cleaned_data["title"],
+                description=form.cleaned_data.get("description", ""),
+                captured_on=form.cleaned_data.get("captured_on"),
+                category=form.cleaned_data.get("category"),
+                visibility=form.cleaned_data.get("visibility", Photo.VISIBILITY_PUBLIC),
             )
 
+            uploaded_count = len(stored)
+            if uploaded_count:
+                messages.success(
+                    request,
+                    f"Successfully uploaded {uploaded_count} image{'' if uploaded_count == 1 else 's'}!"
+                )
+            for filename, error in failed:
+                messages.error(request, f"{filename} could not be uploaded: {error}.")
+
             if request.htmx:
                 # Return a redirect response for HTMX
                 from django.http import HttpResponse
@@ -320,7 +314,35 @@ def photo_create(request):
         if request.htmx
         else "a_portfolio/photo_form_page.html"
     )
-    return render(request, template, {"form": form})
+    context = {"form": form}
+    if direct_uploads_enabled():
+        context["direct_upload_url"] = reverse("portfolio-upload-presign")
+    return render(request, template, context)
+
+
+@login_required
+@require_POST
+def photo_presign(request):
+    """
+    Presigned POST forms for a direct upload of the files described in the
+    JSON body (``{"files": [{"name", "size", "type"}, ...]}``).
+    """
+    if not _user_can_upload(request.user):
+        return HttpResponseForbidden("Your role cannot upload photos.")
+    if not direct_uploads_enabled():
+        raise Http404("Direct uploads are not available.")
+    try:
+        files = [
+            {"name": str(entry["name"]), "size": int(entry["size"]), "type": str(entry.get("type", ""))}
+            for entry in json.loads(request.body)["files"]
+        ]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({"error": "Invalid request."}, status=400)
+    try:
+        uploads = presign_uploads(request.user, files)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return JsonResponse({"uploads": uploads})
 
 
 @login_required
@@ -336,6 +358,8 @@ def photo_update(request, pk):
         if form.is_valid():
             old_visibility = photo.visibility
             form.save()
+            if "image" in form.changed_data:
+                process_photo.enqueue(photo.pk, photo.image.name)
             new_visibility = form.instance.visibility
             if old_visibility != new_visibility:
                 AuditLog.objects.create(
@@ -371,7 +395,8 @@ def photo_bulk_delete(request):
     if not request.user.is_staff:
         qs = qs.filter(owner=request.user)
 
-    qs.delete()
+    with transaction.atomic(), stats.batched(), tombstones.batched():
+        qs.delete()
     return redirect(request.META.get("HTTP_REFERER", "portfolio-mine"))
 
 
@@ -426,13 +451,25 @@ def category_create(request):
 @login_required
 def photo_like(request, pk):
     photo = get_object_or_404(Photo, pk=pk)
-    like, created = Like.objects.get_or_create(photo=photo, user=request.user)
-    
-    if not created:
-        like.delete()
-        is_liked = False
-    else:
-        is_liked = True
+    photos = Photo.objects.filter(pk=photo.pk)
+
+    # Toggle without a read-then-write window: whichever statement actually
+    # changes a row also moves the counter, so concurrent clicks stay exact.
+    with transaction.atomic():
+        removed, _ = Like.objects.filter(photo=photo, user=request.user).delete()
+        if removed:
+            photos.update(like_count=Greatest(F("like_count") - removed, 0))
+            is_liked = False
+        else:
+            try:
+                with transaction.atomic():
+                    Like.objects.create(photo=photo, user=request.user)
+            except IntegrityError:
+                pass  # a concurrent request liked it first
+            else:
+                photos.update(like_count=F("like_count") + 1)
+            is_liked = True
+    photo.refresh_from_db(fields=["like_count"])
     
     if request.htmx:
         return render(
@@ -455,12 +492,17 @@ def comment_create(request, pk):
             if parent_id:
                 parent = get_object_or_404(Comment, pk=parent_id, photo=photo)
             
-            comment = Comment.objects.create(
-                photo=photo,
-                user=request.user,
-                content=form.cleaned_data["content"],
-                parent=parent,
-            )
+            with transaction.atomic():
+                comment = Comment.objects.create(
+                    photo=photo,
+                    user=request.user,
+                    content=form.cleaned_data["content"],
+                    parent=parent,
+                )
+                Photo.objects.filter(pk=photo.pk).update(comment_count=F("comment_count") + 1)
+                if parent:
+                    Comment.objects.filter(pk=parent.pk).update(reply_count=F("reply_count") + 1)
+            photo.refresh_from_db(fields=["comment_count"])
             
             if request.htmx:
                 if parent:
@@ -468,15 +510,14 @@ def comment_create(request, pk):
                     return render(
                         request,
                         "a_portfolio/partials/comment_replies.html",
-                        {"comment": parent, "photo": photo},
+                        {"comment": with_replies(Comment.objects.filter(pk=parent.pk)).get(), "photo": photo},
                     )
                 else:
                     # Return updated comment list
-                    comments = photo.comments.filter(parent=None).select_related("user", "user__profile")
                     return render(
                         request,
                         "a_portfolio/partials/comment_list.html",
-                        {"comments": comments, "photo": photo},
+                        _comments_context(photo),
                     )
             return redirect("portfolio-detail", pk=pk)
     
@@ -498,13 +539,14 @@ def comment_delete(request, pk, comment_id):
     if not can_delete:
         return HttpResponseForbidden("You cannot delete this comment.")
     
-    comment.delete()
+    with transaction.atomic():
+        delete_comment(comment)
+    photo.refresh_from_db(fields=["comment_count"])
     
     if request.htmx:
-        comments = photo.comments.filter(parent=None).select_related("user", "user__profile")
         return render(
             request,
             "a_portfolio/partials/comment_list.html",
-            {"comments": comments, "photo": photo},
+            _comments_context(photo),
         )
     return redirect("portfolio-detail", pk=pk)
\ No newline at end of file
@@ -0,0 +1,7 @@
+"""
+Database structures for full-text photo search that Django models cannot
+describe: the tsvector column and its GIN index on PostgreSQL, the FTS5
+table on SQLite. They live in migrations here, so they are created once and
+tracked in the migration history instead of being re-checked on every
+migrate; the search itself is in a_portfolio.search.
+"""
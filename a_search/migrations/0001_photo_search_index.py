@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+PHOTO_TABLE = "a_portfolio_photo"
+FTS_TABLE = "a_portfolio_photo_fts"
+GIN_INDEX = "a_portfolio_photo_search_gin"
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        # IF NOT EXISTS: databases where the old post_migrate hook made them
+        schema_editor.execute(f"ALTER TABLE {PHOTO_TABLE} ADD COLUMN IF NOT EXISTS search_vector tsvector")
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {GIN_INDEX} ON {PHOTO_TABLE} USING gin (search_vector)"
+        )
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            "USING fts5(title, category, description, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {GIN_INDEX}")
+        schema_editor.execute(f"ALTER TABLE {PHOTO_TABLE} DROP COLUMN IF EXISTS search_vector")
+    elif vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("a_portfolio", "__first__"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -5,4 +5,5 @@ class AShareConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "a_share"
 
-
+    def ready(self):
+        import a_share.signals
@@ -0,0 +1,231 @@
+"""
+Serving TransferFile downloads without tying up a web worker.
+
+SHARE_DOWNLOAD_MODE picks how the bytes reach the recipient:
+
+- "redirect": 302 to a short-lived presigned GET URL (S3/Spaces), with the
+  original filename forced through Content-Disposition.
+- "accel" / "sendfile": hand the file to the front web server with
+  X-Accel-Redirect (nginx) or X-Sendfile (Apache, lighttpd).
+- "stream": Django streams the file itself, honouring Range and If-Range so
+  interrupted downloads can resume.
+- "auto": "redirect" when the storage can presign URLs, "stream" otherwise.
+
+"Download all" is always streamed by Django as a ZIP64 archive built on the
+fly (see zip_stream).
+"""
+from contextlib import closing
+import os
+import re
+import zipfile
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.encoding import filepath_to_uri
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+from a_core.storage_backends import open_stream
+
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def download_mode(storage) -> str:
+    mode = settings.SHARE_DOWNLOAD_MODE
+    if mode == "auto":
+        # S3Boto3Storage and friends sign URLs; local storage has no bucket
+        return "redirect" if hasattr(storage, "bucket_name") else "stream"
+    return mode
+
+
+def parse_range(header: str, size: int):
+    """
+    Return (start, end) inclusive for a single "bytes=" range, None when the
+    header should be ignored (missing, malformed or multiple ranges), or
+    raise ValueError when the range cannot be satisfied.
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _read_range(fh, start: int, length: int):
+    try:
+        if start:
+            fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        fh.close()
+
+
+def _stream(request, field_file, filename):
+    storage = field_file.storage
+    size = field_file.size
+    try:
+        modified = storage.get_modified_time(field_file.name)
+        last_modified = http_date(modified.timestamp())
+    except (NotImplementedError, OSError):
+        modified = last_modified = None
+    etag = quote_etag(f"{os.path.basename(field_file.name)}-{size}")
+
+    start, end = 0, size - 1
+    partial = False
+    if_range = request.headers.get("If-Range", "").strip()
+    range_valid_for_copy = (
+        not if_range
+        or if_range == etag
+        or (modified is not None and parse_http_date_safe(if_range) == int(modified.timestamp()))
+    )
+    if range_valid_for_copy and size:
+        try:
+            requested = parse_range(request.headers.get("Range", ""), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+        if requested:
+            start, end = requested
+            partial = True
+
+    response = StreamingHttpResponse(
+        _read_range(storage.open(field_file.name, "rb"), start, end - start + 1),
+        status=206 if partial else 200,
+        content_type="application/octet-stream",
+    )
+    response["Content-Length"] = str(end - start + 1)
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = last_modified
+    if partial:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    return response
+
+
+def download_response(request, field_file, filename: str):
+    """
+    Response that delivers `field_file` as an attachment called `filename`.
+    """
+    mode = download_mode(field_file.storage)
+    disposition = content_disposition_header(True, filename)
+
+    if mode == "redirect":
+        url = field_file.storage.url(
+            field_file.name,
+            parameters={"ResponseContentDisposition": disposition},
+            expire=settings.SHARE_DOWNLOAD_URL_EXPIRE,
+        )
+        return HttpResponseRedirect(url)
+
+    if mode in ("accel", "sendfile"):
+        response = HttpResponse(content_type="application/octet-stream")
+        response["Content-Disposition"] = disposition
+        if mode == "accel":
+            # nginx: `location <prefix> { internal; alias <MEDIA_ROOT>/; }`
+            response["X-Accel-Redirect"] = settings.SHARE_ACCEL_REDIRECT_PREFIX + filepath_to_uri(
+                field_file.name
+            )
+        else:
+            response["X-Sendfile"] = field_file.path
+        return response
+
+    return _stream(request, field_file, filename)
+
+
+# Formats that are already compressed; deflating them costs CPU for nothing
+STORED_EXTENSIONS = {
+    # images
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".heif", ".avif",
+    # camera raw
+    ".cr2", ".cr3", ".nef", ".arw", ".raf", ".orf", ".rw2", ".dng", ".pef", ".srw",
+    # video, audio and archives
+    ".mp4", ".mov", ".m4v", ".mkv", ".avi", ".mp3", ".m4a", ".aac",
+    ".zip", ".gz", ".bz2", ".xz", ".7z", ".rar",
+}
+
+
+class _ZipSink:
+    """
+    Write-only, non-seekable target for ZipFile. zipfile then writes data
+    descriptors after each entry instead of seeking back, so the archive
+    can be sent while it is being built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _unique_names(names):
+    seen = set()
+    for name in names:
+        candidate, number = name, 1
+        stem, ext = os.path.splitext(name)
+        while candidate.lower() in seen:
+            number += 1
+            candidate = f"{stem} ({number}){ext}"
+        seen.add(candidate.lower())
+        yield candidate
+
+
+def zip_stream(entries):
+    """
+    Yield a ZIP64 archive of `entries`, a list of
+    (archive name, FieldFile, modification datetime).
+
+    Each file is copied from storage in CHUNK_SIZE pieces and every piece is
+    yielded as soon as zipfile has written it, so memory use does not grow
+    with the archive and nothing touches the local disk.
+    """
+    sink = _ZipSink()
+    arcnames = _unique_names([entry[0] for entry in entries])
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as archive:
+        for arcname, (_name, field_file, modified) in zip(arcnames, entries):
+            info = zipfile.ZipInfo(arcname, date_time=modified.timetuple()[:6])
+            if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with closing(open_stream(field_file.storage, field_file.name)) as source, archive.open(
+                info, "w", force_zip64=True
+            ) as target:
+                while chunk := source.read(CHUNK_SIZE):
+                    target.write(chunk)
+                    if data := sink.drain():
+                        yield data
+            yield sink.drain()
+    yield sink.drain()
+
@@ -7,7 +7,12 @@ class MultipleFileInput(forms.ClearableFileInput):
     allow_multiple_selected = True
 
 
-class TransferCreateForm(forms.Form):
+class TransferDetailsForm(forms.Form):
+    """
+    Recipient and message of a transfer. Used on its own when the files are
+    sent afterwards as chunked uploads.
+    """
+
     recipient_email = forms.EmailField(
         label="Recipient email",
         widget=forms.EmailInput(attrs={"class": "textarea", "placeholder": "email@example.com"}),
@@ -27,6 +32,9 @@ class TransferCreateForm(forms.Form):
             }
         ),
     )
+
+
+class TransferCreateForm(TransferDetailsForm):
     files = forms.Field(
         widget=MultipleFileInput(
             attrs={
@@ -1,70 +1,186 @@
 from datetime import timedelta
+import time
 
 from django.conf import settings
-from django.core.mail import send_mail
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
 
-from a_share.models import Transfer
+from a_core.storage_backends import delete_many
+from a_share.models import Transfer, TransferFile, Upload
+from a_share.uploads import discard_upload
+from a_mail.outbox import queue_email
+from a_stats import stats
+from a_tasks.tasks import delete_files
+from a_tasks.tombstones import storage_handled_by_caller
 
 
 class Command(BaseCommand):
-    help = "Send expiry warnings and delete expired private file transfers."
+    help = (
+        "Send expiry warnings, delete expired private file transfers and drop "
+        "chunked uploads that stopped making progress."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be done without sending or deleting anything.",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Delete at most this many transfers in this run.",
+        )
+        parser.add_argument(
+            "--max-seconds",
+            type=float,
+            default=None,
+            help="Do not start another batch after this many seconds.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Transfers handled per query and transaction (default: 500).",
+        )
 
     def handle(self, *args, **options):
-        now = timezone.now()
-        warning_cutoff = now + timedelta(days=1)
-
-        # 1) Send one-day-before warnings for undownloaded transfers
-        warn_qs = Transfer.objects.filter(
-            downloaded_at__isnull=True,
-            warning_sent_at__isnull=True,
-            expires_at__gt=now,
-            expires_at__lte=warning_cutoff,
+        self.dry_run = options["dry_run"]
+        self.batch_size = options["batch_size"]
+        self.remaining = options["limit"]
+        self.deadline = (
+            time.monotonic() + options["max_seconds"] if options["max_seconds"] is not None else None
         )
-        for transfer in warn_qs:
-            subject = "Your shared files will expire soon"
-            body_owner = (
-                "This is a reminder that your shared files will be deleted in about 1 day if they are not downloaded.\n\n"
-                f"Recipient: {transfer.recipient_email}\n"
-                f"Title: {transfer.title or 'No title'}\n"
-                f"Expires at: {transfer.expires_at:%Y-%m-%d %H:%M} (UTC)\n"
-            )
-            send_mail(
-                subject,
-                body_owner,
-                settings.DEFAULT_FROM_EMAIL,
-                [transfer.owner.email or settings.DEFAULT_FROM_EMAIL],
-                fail_silently=True,
-            )
+        self.stopped_early = False
 
-            body_recipient = (
-                "Files that were shared with you on HerbiesPlace will expire in about 1 day.\n"
-                "If you still need them, please download them before the link expires.\n"
-            )
-            send_mail(
-                subject,
-                body_recipient,
-                settings.DEFAULT_FROM_EMAIL,
-                [transfer.recipient_email],
-                fail_silently=True,
-            )
+        now = timezone.now()
+        stale_before = now - timedelta(seconds=settings.SHARE_UPLOAD_STALE_AFTER)
 
-            transfer.warning_sent_at = now
-            transfer.save(update_fields=["warning_sent_at"])
+        # 1) One-day-before warnings for undownloaded transfers
+        self._run(
+            "Expiry warnings",
+            self._send_warnings,
+            Transfer.objects.ready().filter(
+                downloaded_at__isnull=True,
+                warning_sent_at__isnull=True,
+                expires_at__gt=now,
+                expires_at__lte=now + timedelta(days=1),
+            ),
+            now,
+        )
+        # 2) Expired transfers, with their files
+        self._run("Expired transfers", self._delete_transfers, Transfer.objects.filter(expires_at__lte=now))
+        # 3) Drafts whose chunked uploads have stalled
+        self._run(
+            "Stalled uploads",
+            self._delete_transfers,
+            Transfer.objects.filter(is_draft=True, created_at__lt=stale_before).exclude(
+                uploads__updated_at__gte=stale_before
+            ),
+        )
 
-        # 2) Delete expired transfers (files and records)
-        expired_qs = Transfer.objects.filter(expires_at__lte=now)
-        for transfer in expired_qs:
-            # Delete associated files from storage
-            for tf in transfer.files.all():
-                tf.file.delete(save=False)
-            transfer.delete()
+        if self.stopped_early:
+            self.stdout.write(self.style.WARNING("Stopped early; run again to process the rest."))
 
+    def _run(self, label, step, queryset, *args):
+        started = time.monotonic()
+        counts = step(queryset, *args)
+        summary = ", ".join(f"{value} {name}" for name, value in counts.items())
+        prefix = "[dry run] " if self.dry_run else ""
         self.stdout.write(
-            self.style.SUCCESS(
-                f"Processed {warn_qs.count()} warnings and deleted {expired_qs.count()} expired transfers."
+            self.style.SUCCESS(f"{prefix}{label}: {summary} in {time.monotonic() - started:.2f}s")
+        )
+
+    def _batches(self, queryset):
+        """
+        Primary keys of `queryset` in batches of --batch-size. Rows are
+        walked by key rather than with an open cursor because each batch is
+        updated or deleted before the next one is read.
+        """
+        last_pk = 0
+        while True:
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                self.stopped_early = True
+                return
+            pks = list(
+                queryset.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[: self.batch_size]
             )
+            if not pks:
+                return
+            last_pk = pks[-1]
+            yield pks
+
+    def _send_warnings(self, queryset, now):
+        warned = 0
+        for pks in self._batches(queryset):
+            if not self.dry_run:
+                with transaction.atomic():
+                    for transfer in Transfer.objects.filter(pk__in=pks).select_related("owner"):
+                        self._queue_warning(transfer)
+                    Transfer.objects.filter(pk__in=pks).update(warning_sent_at=now)
+            warned += len(pks)
+        return {"transfers": warned}
+
+    def _queue_warning(self, transfer):
+        subject = "Your shared files will expire soon"
+        body_owner = (
+            "This is a reminder that your shared files will be deleted in about 1 day if they are not downloaded.\n\n"
+            f"Recipient: {transfer.recipient_email}\n"
+            f"Title: {transfer.title or 'No title'}\n"
+            f"Expires at: {transfer.expires_at:%Y-%m-%d %H:%M} (UTC)\n"
+        )
+        queue_email(
+            subject,
+            body_owner,
+            [transfer.owner.email or settings.DEFAULT_FROM_EMAIL],
+            idempotency_key=f"share-expiry:{transfer.pk}:owner",
+            batch=True,
+        )
+
+        body_recipient = (
+            "Files that were shared with you on HerbiesPlace will expire in about 1 day.\n"
+            "If you still need them, please download them before the link expires.\n"
+        )
+        # The same text for every recipient, so these go out as one batch
+        queue_email(
+            subject,
+            body_recipient,
+            [transfer.recipient_email],
+            idempotency_key=f"share-expiry:{transfer.pk}:recipient",
+            batch=True,
         )
 
+    def _delete_transfers(self, queryset):
+        """
+        Delete the files of each batch from storage in bulk, then the rows.
+        Storage goes first, so if it is unreachable the rows stay for the
+        next run instead of leaving files nobody knows about. Single keys
+        that fail are handed to the job queue.
+        """
+        storage = TransferFile._meta.get_field("file").storage
+        deleted = files = retried = 0
+        for pks in self._batches(queryset):
+            if self.remaining is not None:
+                if self.remaining <= 0:
+                    self.stopped_early = True
+                    break
+                pks = pks[: self.remaining]
+                self.remaining -= len(pks)
 
+            names = list(TransferFile.objects.filter(transfer_id__in=pks).values_list("file", flat=True))
+            if not self.dry_run:
+                failed = delete_many(storage, names)
+                unfinished = Upload.objects.filter(transfer_id__in=pks, completed_at__isnull=True)
+                for upload_id, name, multipart_id in unfinished.values_list("pk", "name", "multipart_id"):
+                    discard_upload(upload_id, name, multipart_id)
+                with transaction.atomic(), storage_handled_by_caller(), stats.batched():
+                    Transfer.objects.filter(pk__in=pks).delete()
+                    if failed:
+                        # The rows are gone; let the job queue keep trying
+                        delete_files.enqueue(failed)
+                retried += len(failed)
+            deleted += len(pks)
+            files += len(names)
+        return {"transfers": deleted, "files": files, "files left to the job queue": retried}
@@ -12,6 +12,15 @@ def share_upload_path(instance, filename: str) -> str:
     return f"share/{today:%Y/%m/%d}/{uuid.uuid4().hex}_{filename}"
 
 
+class TransferQuerySet(models.QuerySet):
+    def ready(self):
+        """
+        Transfers whose files are all uploaded. Drafts are still receiving
+        chunked uploads and must not be reachable by the recipient.
+        """
+        return self.filter(is_draft=False)
+
+
 class Transfer(models.Model):
     """
     A private file transfer from a logged-in user to an external recipient.
@@ -37,6 +46,11 @@ class Transfer(models.Model):
 
     warning_sent_at = models.DateTimeField(null=True, blank=True)
 
+    # Set while files are still being uploaded in chunks (see a_share.uploads)
+    is_draft = models.BooleanField(default=False)
+
+    objects = TransferQuerySet.as_manager()
+
     class Meta:
         ordering = ["-created_at"]
 
@@ -60,9 +74,44 @@ class TransferFile(models.Model):
     )
     file = models.FileField(upload_to=share_upload_path)
     original_name = models.CharField(max_length=255)
+    # Bytes stored, for the dashboard statistics (a_stats)
+    size = models.BigIntegerField(default=0, editable=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self) -> str:
         return self.original_name
 
 
+
+
+class Upload(models.Model):
+    """
+    A file being sent to a draft Transfer in chunks. `offset` is the number
+    of bytes received so far; a client that lost its connection asks for it
+    and continues from there. Becomes a TransferFile once complete.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    transfer = models.ForeignKey(
+        Transfer,
+        on_delete=models.CASCADE,
+        related_name="uploads",
+    )
+    original_name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)  # storage name of the finished file
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    # S3 multipart upload id and the parts stored so far
+    multipart_id = models.CharField(max_length=255, blank=True)
+    parts = models.JSONField(default=list, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.original_name} ({self.offset}/{self.size})"
+
+    @property
+    def is_complete(self) -> bool:
+        return self.completed_at is not None
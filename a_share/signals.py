@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+# Transfer files are buried like any other FileField (a_tasks.tombstones)
+from a_tasks.tombstones import caller_handles_storage
+
+from .models import Upload
+from .tasks import abort_upload
+
+
+@receiver(post_delete, sender=Upload)
+def upload_postdelete(sender, instance, **kwargs):
+    # Completed uploads already live on as TransferFiles
+    if not instance.is_complete and not caller_handles_storage():
+        abort_upload.enqueue(str(instance.pk), instance.name, instance.multipart_id)
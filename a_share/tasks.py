@@ -0,0 +1,11 @@
+from a_tasks.queue import task
+
+from .uploads import discard_upload
+
+
+@task
+def abort_upload(upload_id: str, name: str, multipart_id: str):
+    """
+    Drop the multipart upload or spool file of an unfinished upload.
+    """
+    discard_upload(upload_id, name, multipart_id)
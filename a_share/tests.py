@@ -0,0 +1,262 @@
+import base64
+from datetime import timedelta
+from io import BytesIO, StringIO
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from a_mail.models import OutboxMessage
+from a_tasks.models import Job
+
+from .models import Transfer, TransferFile, Upload
+from .uploads import IncompleteChunk, write_chunk
+
+
+class TransferDownloadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root, SHARE_DOWNLOAD_MODE="auto")
+        override.enable()
+        self.addCleanup(override.disable)
+
+        owner = User.objects.create_user(username="owner", email="owner@example.com")
+        now = timezone.now()
+        self.transfer = Transfer.objects.create(
+            owner=owner,
+            recipient_email="friend@example.com",
+            code="123456",
+            code_expires_at=now + timedelta(minutes=15),
+            expires_at=now + timedelta(days=5),
+        )
+        self.file = TransferFile(transfer=self.transfer, original_name="report.txt")
+        self.file.file.save("report.txt", ContentFile(b"0123456789"), save=True)
+        self.url = reverse("share:download-file", args=[self.transfer.token, self.file.pk])
+        self.client = Client()
+
+    def _body(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_full_download(self):
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self._body(resp), b"0123456789")
+        self.assertEqual(resp["Accept-Ranges"], "bytes")
+        self.assertIn('filename="report.txt"', resp["Content-Disposition"])
+
+    def test_range_requests(self):
+        resp = self.client.get(self.url, HTTP_RANGE="bytes=2-5")
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp["Content-Range"], "bytes 2-5/10")
+        self.assertEqual(self._body(resp), b"2345")
+
+        resp = self.client.get(self.url, HTTP_RANGE="bytes=-3")
+        self.assertEqual(self._body(resp), b"789")
+
+        resp = self.client.get(self.url, HTTP_RANGE="bytes=20-")
+        self.assertEqual(resp.status_code, 416)
+        self.assertEqual(resp["Content-Range"], "bytes */10")
+
+    def test_if_range_mismatch_sends_whole_file(self):
+        etag = self.client.get(self.url)["ETag"]
+        resp = self.client.get(self.url, HTTP_RANGE="bytes=2-5", HTTP_IF_RANGE=etag)
+        self.assertEqual(resp.status_code, 206)
+        resp = self.client.get(self.url, HTTP_RANGE="bytes=2-5", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self._body(resp), b"0123456789")
+
+    @override_settings(SHARE_DOWNLOAD_MODE="accel")
+    def test_accel_redirect(self):
+        resp = self.client.get(self.url)
+        self.assertEqual(resp["X-Accel-Redirect"], "/protected-media/" + self.file.file.name)
+        self.assertEqual(resp.content, b"")
+
+    def test_first_download_notifies_once(self):
+        self.client.get(self.url, HTTP_RANGE="bytes=0-4")
+        self.client.get(self.url, HTTP_RANGE="bytes=5-")
+
+        self.transfer.refresh_from_db()
+        self.assertIsNotNone(self.transfer.downloaded_at)
+        self.assertEqual(OutboxMessage.objects.count(), 2)
+
+    def test_download_all_streams_a_zip(self):
+        photo = TransferFile(transfer=self.transfer, original_name="shot.jpg")
+        photo.file.save("shot.jpg", ContentFile(b"\xff\xd8jpeg"), save=True)
+        again = TransferFile(transfer=self.transfer, original_name="report.txt")
+        again.file.save("report.txt", ContentFile(b"second"), save=True)
+
+        resp = self.client.get(reverse("share:download-all", args=[self.transfer.token]))
+        self.assertEqual(resp["Content-Type"], "application/zip")
+        archive = zipfile.ZipFile(BytesIO(self._body(resp)))
+
+        self.assertEqual(archive.namelist(), ["report.txt", "shot.jpg", "report (2).txt"])
+        self.assertEqual(archive.read("report.txt"), b"0123456789")
+        self.assertEqual(archive.read("report (2).txt"), b"second")
+        self.assertEqual(archive.getinfo("shot.jpg").compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(archive.getinfo("report.txt").compress_type, zipfile.ZIP_DEFLATED)
+        self.assertIsNone(archive.testzip())
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, spool_dir, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root, SHARE_UPLOAD_SPOOL_DIR=spool_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.spool_dir = spool_dir
+
+        self.owner = User.objects.create_user(username="owner", email="owner@example.com")
+        self.client = Client()
+        self.client.force_login(self.owner)
+
+    def _draft(self):
+        resp = self.client.post(
+            reverse("share:create"), {"upload": "chunked", "recipient_email": "friend@example.com"}
+        )
+        self.assertEqual(resp.status_code, 201)
+        return resp.json()
+
+    def _start(self, session, name, size):
+        filename = base64.b64encode(name.encode()).decode()
+        resp = self.client.post(
+            session["uploads"],
+            headers={"Upload-Length": str(size), "Upload-Metadata": f"filename {filename}"},
+        )
+        self.assertEqual(resp.status_code, 201)
+        return resp["Location"]
+
+    def _patch(self, url, offset, data):
+        return self.client.patch(
+            url,
+            data,
+            content_type="application/offset+octet-stream",
+            headers={"Upload-Offset": str(offset)},
+        )
+
+    def test_resumable_upload_finalizes_transfer(self):
+        session = self._draft()
+        transfer = Transfer.objects.get()
+        self.assertTrue(transfer.is_draft)
+        # Drafts are invisible to the recipient
+        resp = self.client.get(reverse("share:enter-code", args=[transfer.token]))
+        self.assertEqual(resp.status_code, 404)
+
+        url = self._start(session, "big file.bin", 10)
+        self.assertEqual(self._patch(url, 0, b"01234")["Upload-Offset"], "5")
+
+        # a retried chunk for an offset the server has moved past is refused
+        resp = self._patch(url, 0, b"01234")
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp["Upload-Offset"], "5")
+        self.assertEqual(self.client.head(url)["Upload-Offset"], "5")
+
+        resp = self.client.post(session["finalize"])
+        self.assertEqual(resp.status_code, 409)
+
+        self.assertEqual(self._patch(url, 5, b"56789").status_code, 204)
+        resp = self.client.post(session["finalize"])
+        self.assertEqual(resp.json()["redirect"], reverse("portfolio-mine"))
+
+        transfer.refresh_from_db()
+        self.assertFalse(transfer.is_draft)
+        self.assertFalse(transfer.uploads.exists())
+        sent = transfer.files.get()
+        self.assertEqual(sent.original_name, "big file.bin")
+        with sent.file.open("rb") as fh:
+            self.assertEqual(fh.read(), b"0123456789")
+        self.assertEqual(os.listdir(self.spool_dir), [])
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_cut_off_chunk_is_dropped(self):
+        session = self._draft()
+        url = self._start(session, "a.bin", 10)
+        self._patch(url, 0, b"01")
+        upload = Upload.objects.get()
+        # the connection drops before the promised 6 bytes arrived
+        with self.assertRaises(IncompleteChunk):
+            write_chunk(upload, BytesIO(b"2345"), 6)
+        upload.refresh_from_db()
+        self.assertEqual(upload.offset, 2)
+        self.assertEqual(os.path.getsize(os.path.join(self.spool_dir, f"{upload.pk}.part")), 2)
+
+    def test_stalled_uploads_are_cleaned_up(self):
+        session = self._draft()
+        self._start(session, "a.bin", 10)
+        upload = Upload.objects.get()
+        stale = timezone.now() - timedelta(days=2)
+        Transfer.objects.update(created_at=stale)
+        Upload.objects.update(updated_at=stale)
+
+        call_command("cleanup_transfers", stdout=StringIO())
+        call_command("run_worker", "--burst", stdout=StringIO())
+
+        self.assertFalse(Transfer.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.spool_dir, f"{upload.pk}.part")))
+
+
+class CleanupTransfersTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.owner = User.objects.create_user(username="owner", email="owner@example.com")
+        now = timezone.now()
+        self.expired = [self._transfer(now - timedelta(minutes=i + 1)) for i in range(3)]
+        self.expiring = self._transfer(now + timedelta(hours=12))
+        self.names = []
+        for transfer in self.expired:
+            transfer_file = TransferFile(transfer=transfer, original_name="a.txt")
+            transfer_file.file.save("a.txt", ContentFile(b"data"), save=True)
+            self.names.append(transfer_file.file.name)
+
+    def _transfer(self, expires_at):
+        return Transfer.objects.create(
+            owner=self.owner,
+            recipient_email="friend@example.com",
+            code="123456",
+            code_expires_at=expires_at,
+            expires_at=expires_at,
+        )
+
+    def _cleanup(self, *args):
+        out = StringIO()
+        call_command("cleanup_transfers", "--batch-size", "2", *args, stdout=out)
+        return out.getvalue()
+
+    def test_deletes_files_in_bulk_and_warns_once(self):
+        out = self._cleanup()
+        self.assertIn("Expired transfers: 3 transfers, 3 files", out)
+        self.assertIn("Expiry warnings: 1 transfers", out)
+        self.assertEqual(list(Transfer.objects.all()), [self.expiring])
+        storage = TransferFile._meta.get_field("file").storage
+        self.assertFalse(any(storage.exists(name) for name in self.names))
+        # files went straight away, no per-file deletion jobs
+        self.assertFalse(Job.objects.filter(task="a_tasks.tasks.delete_files").exists())
+        self.assertEqual(OutboxMessage.objects.filter(batch=True).count(), 2)
+
+        self.assertIn("Expiry warnings: 0 transfers", self._cleanup())
+
+    def test_dry_run_and_limit(self):
+        out = self._cleanup("--dry-run")
+        self.assertIn("[dry run] Expired transfers: 3 transfers", out)
+        self.assertEqual(Transfer.objects.count(), 4)
+        self.assertFalse(Job.objects.exists())
+
+        out = self._cleanup("--limit", "1")
+        self.assertIn("Expired transfers: 1 transfers", out)
+        self.assertIn("Stopped early", out)
+        self.assertEqual(Transfer.objects.count(), 3)
@@ -0,0 +1,234 @@
+"""
+Chunked, resumable uploads for transfers.
+
+Files larger than a single request body are sent the way tus does it: the
+client declares an upload with its total length, then PATCHes the bytes in
+chunks of SHARE_UPLOAD_CHUNK_SIZE, each one tagged with the offset it
+starts at. The server answers HEAD with the offset it has, so a client that
+lost its connection (or the whole page) carries on from there.
+
+Where the bytes go depends on the storage:
+
+- S3/Spaces: the upload is an S3 multipart upload. Every chunk is cut into
+  SHARE_UPLOAD_PART_SIZE parts that are sent to the bucket in parallel;
+  completing the multipart upload makes the object appear in one piece.
+- Local storage: chunks are appended to a spool file in
+  SHARE_UPLOAD_SPOOL_DIR, which is moved into place when it is complete.
+
+A chunk is accepted as a whole or not at all. A finished upload becomes a
+TransferFile of its (draft) transfer; the transfer is sent out once every
+upload is complete. Uploads that stop moving are cleaned up by
+cleanup_transfers.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import mimetypes
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from a_core.storage_backends import is_s3, object_key
+
+from .models import TransferFile, Upload
+
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(ValueError):
+    pass
+
+
+class UploadGone(UploadError):
+    """The data received so far was lost; the file has to be sent again."""
+
+
+class IncompleteChunk(UploadError):
+    pass
+
+
+class _SpoolFile(File):
+    # FileSystemStorage moves files that have a path instead of copying them
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def _storage():
+    return TransferFile._meta.get_field("file").storage
+
+
+def spool_path(upload_id) -> str:
+    return os.path.join(settings.SHARE_UPLOAD_SPOOL_DIR, f"{upload_id}.part")
+
+
+def _read(stream, length: int) -> bytes:
+    data = bytearray()
+    while len(data) < length:
+        piece = stream.read(length - len(data))
+        if not piece:
+            raise IncompleteChunk("The chunk was cut off.")
+        data += piece
+    return bytes(data)
+
+
+def start_upload(transfer, filename: str, size: int) -> Upload:
+    """
+    Declare a file of `size` bytes for draft `transfer`.
+    """
+    if size < 0:
+        raise UploadError("Upload-Length must not be negative.")
+    if size > settings.SHARE_UPLOAD_MAX_SIZE:
+        raise UploadError("The file is too large.")
+
+    field = TransferFile._meta.get_field("file")
+    storage = field.storage
+    upload = Upload(
+        transfer=transfer,
+        original_name=filename[:255] or "file",
+        name=field.generate_filename(None, filename or "file"),
+        size=size,
+    )
+    if is_s3(storage) and size:
+        params = storage.get_object_parameters(upload.name)
+        if storage.default_acl:
+            params.setdefault("ACL", storage.default_acl)
+        params.setdefault("ContentType", mimetypes.guess_type(upload.name)[0] or "application/octet-stream")
+        upload.multipart_id = storage.connection.meta.client.create_multipart_upload(
+            Bucket=storage.bucket_name, Key=object_key(storage, upload.name), **params
+        )["UploadId"]
+    elif not is_s3(storage):
+        os.makedirs(settings.SHARE_UPLOAD_SPOOL_DIR, exist_ok=True)
+        open(spool_path(upload.pk), "wb").close()
+    upload.save()
+
+    if not size:
+        complete_upload(upload)
+    return upload
+
+
+def _write_parts(storage, upload, stream, length: int) -> list:
+    """
+    Send the next `length` bytes of `stream` as multipart parts, several at
+    a time. Part numbers follow from the offset, so a retried chunk simply
+    replaces the parts it sent before.
+    """
+    client = storage.connection.meta.client
+    key = object_key(storage, upload.name)
+    part_size = settings.SHARE_UPLOAD_PART_SIZE
+
+    def send(number, data):
+        response = client.upload_part(
+            Bucket=storage.bucket_name,
+            Key=key,
+            UploadId=upload.multipart_id,
+            PartNumber=number,
+            Body=data,
+        )
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
+    number = upload.offset // part_size + 1
+    futures = []
+    with ThreadPoolExecutor(max_workers=settings.SHARE_UPLOAD_THREADS) as pool:
+        while length:
+            data = _read(stream, min(part_size, length))
+            futures.append(pool.submit(send, number, data))
+            number += 1
+            length -= len(data)
+    return [future.result() for future in futures]
+
+
+def _write_spool(upload, stream, length: int) -> None:
+    path = spool_path(upload.pk)
+    if not os.path.exists(path) or os.path.getsize(path) < upload.offset:
+        raise UploadGone("The upload data is no longer available.")
+    with open(path, "ab") as fh:
+        # Bytes of an earlier chunk that was cut off are not part of the file
+        fh.truncate(upload.offset)
+        try:
+            while length:
+                data = _read(stream, min(READ_SIZE, length))
+                fh.write(data)
+                length -= len(data)
+        except Exception:
+            fh.truncate(upload.offset)
+            raise
+
+
+def write_chunk(upload: Upload, stream, length: int) -> None:
+    """
+    Append `length` bytes read from `stream` at upload.offset and complete
+    the upload when that was the last of it. The caller checks the offset
+    and holds a lock on the row.
+    """
+    end = upload.offset + length
+    if end > upload.size:
+        raise UploadError("The chunk runs past the end of the file.")
+
+    storage = _storage()
+    if upload.multipart_id:
+        # S3 parts other than the last must be at least 5 MB
+        if end < upload.size and length % settings.SHARE_UPLOAD_PART_SIZE:
+            raise UploadError(
+                f"Chunks must be a multiple of {settings.SHARE_UPLOAD_PART_SIZE} bytes."
+            )
+        parts = {part["PartNumber"]: part for part in upload.parts}
+        parts.update((part["PartNumber"], part) for part in _write_parts(storage, upload, stream, length))
+        upload.parts = [parts[number] for number in sorted(parts)]
+    else:
+        _write_spool(upload, stream, length)
+
+    upload.offset = end
+    upload.save(update_fields=["offset", "parts", "updated_at"])
+    if upload.offset == upload.size:
+        complete_upload(upload)
+
+
+def complete_upload(upload: Upload) -> TransferFile:
+    """
+    Turn a fully received upload into a TransferFile.
+    """
+    storage = _storage()
+    if upload.multipart_id:
+        storage.connection.meta.client.complete_multipart_upload(
+            Bucket=storage.bucket_name,
+            Key=object_key(storage, upload.name),
+            UploadId=upload.multipart_id,
+            MultipartUpload={"Parts": upload.parts},
+        )
+        name = upload.name
+    elif is_s3(storage):
+        # empty file: S3 has no multipart upload without parts
+        name = storage.save(upload.name, ContentFile(b""))
+    else:
+        with _SpoolFile(open(spool_path(upload.pk), "rb")) as spooled:
+            name = storage.save(upload.name, spooled)
+
+    upload.completed_at = timezone.now()
+    upload.save(update_fields=["completed_at", "updated_at"])
+    return TransferFile.objects.create(
+        transfer_id=upload.transfer_id,
+        file=name,
+        original_name=upload.original_name,
+        size=upload.size,
+    )
+
+
+def discard_upload(upload_id, name: str, multipart_id: str) -> None:
+    """
+    Throw away the data of an upload that will not be completed.
+    """
+    storage = _storage()
+    if multipart_id:
+        try:
+            storage.connection.meta.client.abort_multipart_upload(
+                Bucket=storage.bucket_name, Key=object_key(storage, name), UploadId=multipart_id
+            )
+        except storage.connection.meta.client.exceptions.NoSuchUpload:
+            pass
+    elif not is_s3(storage):
+        try:
+            os.remove(spool_path(upload_id))
+        except FileNotFoundError:
+            pass
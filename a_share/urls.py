@@ -6,11 +6,15 @@ app_name = "share"
 
 urlpatterns = [
     path("share/new/", views.transfer_create, name="create"),
+    path("share/<uuid:token>/uploads/", views.transfer_upload_create, name="uploads"),
+    path("share/uploads/<uuid:upload_id>/", views.transfer_upload, name="upload"),
+    path("share/<uuid:token>/send/", views.transfer_finalize, name="finalize"),
     path("share/<uuid:token>/", views.transfer_enter_code, name="enter-code"),
     path("share/<uuid:token>/resend/", views.transfer_resend_code, name="resend-code"),
     path("share/access/", views.transfer_email_code, name="email-code"),
     path("share/access/resend/", views.transfer_email_resend_code, name="email-resend-code"),
     path("share/<uuid:token>/download/<int:file_id>/", views.transfer_download, name="download-file"),
+    path("share/<uuid:token>/download/all/", views.transfer_download_all, name="download-all"),
     path("share/<uuid:token>/finish/", views.transfer_finish, name="finish"),
 ]
 
@@ -1,16 +1,36 @@
+import base64
+import os
 import secrets
 from datetime import timedelta
 
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.core.mail import send_mail
-from django.http import FileResponse, Http404, HttpResponseForbidden
+from django.db import transaction
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseNotAllowed,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.http import content_disposition_header
+from django.utils.text import slugify
+from django.views.decorators.http import require_POST
 
-from .forms import CodeOnlyForm, EmailCodeForm, TransferCreateForm
-from .models import Transfer, TransferFile
+from a_mail.outbox import queue_email
+
+from .downloads import download_response, zip_stream
+from .forms import CodeOnlyForm, EmailCodeForm, TransferCreateForm, TransferDetailsForm
+from .models import Transfer, TransferFile, Upload
+from .uploads import UploadError, UploadGone, start_upload, write_chunk
+
+
+TUS_VERSION = "1.0.0"
 
 
 def _generate_code() -> str:
@@ -35,45 +55,91 @@ def _send_code_email(transfer: Transfer) -> None:
         "",
         "This code will expire soon. The transfer itself will be deleted after 5 days if not downloaded.",
     ]
-    send_mail(
+    queue_email(
         subject,
         "\n".join(message_lines),
-        settings.DEFAULT_FROM_EMAIL,
         [transfer.recipient_email],
-        fail_silently=False,
+        idempotency_key=f"share-code:{transfer.pk}:{transfer.code}:{transfer.code_expires_at.timestamp():.0f}",
+    )
+
+
+def _mark_downloaded(transfer: Transfer) -> None:
+    """
+    Record the first download and notify sender and recipient. Only the
+    request that flips downloaded_at queues the emails, so resumed and
+    parallel range requests cost a single UPDATE at most.
+    """
+    now = timezone.now()
+    first_download = transfer.downloaded_at is None and Transfer.objects.filter(
+        pk=transfer.pk, downloaded_at__isnull=True
+    ).update(downloaded_at=now)
+    if not first_download:
+        return
+
+    transfer.downloaded_at = now
+    subject = "Your shared files have been downloaded"
+    body = (
+        f"Your file transfer to {transfer.recipient_email} has been accessed and at least one file was downloaded.\n\n"
+        f"Title: {transfer.title or 'No title'}\n"
+        f"Downloaded at: {transfer.downloaded_at:%Y-%m-%d %H:%M} (UTC)\n"
+    )
+    queue_email(
+        subject,
+        body,
+        [transfer.owner.email or settings.DEFAULT_FROM_EMAIL],
+        idempotency_key=f"share-downloaded:{transfer.pk}:owner",
+    )
+    # Best-effort notification to recipient
+    queue_email(
+        "You downloaded shared files from HerbiesPlace",
+        "This is a confirmation that you have accessed the files shared with you.",
+        [transfer.recipient_email],
+        idempotency_key=f"share-downloaded:{transfer.pk}:recipient",
+    )
+
+
+def _create_transfer(owner, form, **fields) -> Transfer:
+    now = timezone.now()
+    return Transfer.objects.create(
+        owner=owner,
+        recipient_email=form.cleaned_data["recipient_email"],
+        title=form.cleaned_data.get("title", ""),
+        message=form.cleaned_data.get("message", ""),
+        code=_generate_code(),
+        code_expires_at=now + timedelta(minutes=15),
+        expires_at=now + timedelta(days=5),
+        **fields,
+    )
+
+
+def _files_sent_message(request, file_count: int) -> None:
+    messages.success(
+        request,
+        f"{file_count} file{'s' if file_count != 1 else ''} uploaded successfully. "
+        "The recipient has been emailed a link and security code.",
     )
 
 
 @login_required
 def transfer_create(request):
+    if request.method == "POST" and request.POST.get("upload") == "chunked":
+        return _create_draft(request)
+
     if request.method == "POST":
         form = TransferCreateForm(request.POST, request.FILES)
         if form.is_valid():
             files = form.cleaned_data["files"]
-            now = timezone.now()
-            transfer = Transfer.objects.create(
-                owner=request.user,
-                recipient_email=form.cleaned_data["recipient_email"],
-                title=form.cleaned_data.get("title", ""),
-                message=form.cleaned_data.get("message", ""),
-                code=_generate_code(),
-                code_expires_at=now + timedelta(minutes=15),
-                expires_at=now + timedelta(days=5),
-            )
+            transfer = _create_transfer(request.user, form)
             for f in files:
                 TransferFile.objects.create(
                     transfer=transfer,
                     file=f,
                     original_name=getattr(f, "name", "file"),
+                    size=f.size,
                 )
 
             _send_code_email(transfer)
-            file_count = len(files)
-            messages.success(
-                request,
-                f"{file_count} file{'s' if file_count != 1 else ''} uploaded successfully. "
-                "The recipient has been emailed a link and security code.",
-            )
+            _files_sent_message(request, len(files))
             return redirect("portfolio-mine")
     else:
         form = TransferCreateForm()
@@ -81,8 +147,142 @@ def transfer_create(request):
     return render(request, "a_share/transfer_create.html", {"form": form})
 
 
+def _create_draft(request):
+    """
+    First step of a chunked upload: store the transfer details as a draft
+    and tell the client where to send the files.
+    """
+    form = TransferDetailsForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+
+    transfer = _create_transfer(request.user, form, is_draft=True)
+    return JsonResponse(
+        {
+            "uploads": reverse("share:uploads", args=[transfer.token]),
+            "finalize": reverse("share:finalize", args=[transfer.token]),
+            "chunk_size": settings.SHARE_UPLOAD_CHUNK_SIZE,
+        },
+        status=201,
+    )
+
+
+def _tus_response(status=204, content="", headers=None):
+    response = HttpResponse(content, status=status, content_type="text/plain")
+    response["Tus-Resumable"] = TUS_VERSION
+    response["Cache-Control"] = "no-store"
+    for name, value in (headers or {}).items():
+        response[name] = str(value)
+    return response
+
+
+def _parse_metadata(header: str) -> dict:
+    # tus Upload-Metadata: "key base64(value),key base64(value)"
+    metadata = {}
+    for pair in header.split(","):
+        key, _, value = pair.strip().partition(" ")
+        if key:
+            metadata[key] = base64.b64decode(value).decode() if value else ""
+    return metadata
+
+
+@login_required
+@require_POST
+def transfer_upload_create(request, token):
+    """
+    Declare one file of a draft transfer (tus "creation"). Expects the
+    Upload-Length header and the filename in Upload-Metadata.
+    """
+    transfer = get_object_or_404(Transfer, token=token, owner=request.user, is_draft=True)
+    try:
+        size = int(request.headers.get("Upload-Length", ""))
+        filename = _parse_metadata(request.headers.get("Upload-Metadata", "")).get("filename", "")
+        upload = start_upload(transfer, os.path.basename(filename), size)
+    except UploadError as exc:
+        return _tus_response(400, str(exc))
+    except ValueError:
+        return _tus_response(400, "Invalid Upload-Length or Upload-Metadata.")
+
+    return _tus_response(
+        201,
+        headers={
+            "Location": reverse("share:upload", args=[upload.pk]),
+            "Upload-Offset": upload.offset,
+        },
+    )
+
+
+@login_required
+def transfer_upload(request, upload_id):
+    """
+    HEAD reports how much of the file has arrived, PATCH appends the chunk
+    that starts at Upload-Offset, DELETE abandons the upload.
+    """
+    upload = get_object_or_404(
+        Upload, pk=upload_id, transfer__owner=request.user, transfer__is_draft=True
+    )
+    if request.method in ("HEAD", "GET"):
+        return _tus_response(200, headers={"Upload-Offset": upload.offset, "Upload-Length": upload.size})
+    if request.method == "DELETE":
+        upload.delete()
+        return _tus_response(204)
+    if request.method != "PATCH":
+        return HttpResponseNotAllowed(["HEAD", "GET", "PATCH", "DELETE"])
+
+    if request.content_type != "application/offset+octet-stream":
+        return _tus_response(415, "Chunks must be sent as application/offset+octet-stream.")
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+        length = int(request.META.get("CONTENT_LENGTH") or "")
+    except ValueError:
+        return _tus_response(400, "Invalid Upload-Offset or Content-Length.")
+
+    # The row lock keeps two requests from writing the same upload at once
+    with transaction.atomic():
+        upload = Upload.objects.select_for_update().get(pk=upload.pk)
+        if upload.is_complete or offset != upload.offset:
+            return _tus_response(409, headers={"Upload-Offset": upload.offset})
+        try:
+            write_chunk(upload, request, length)
+        except UploadGone as exc:
+            upload.delete()
+            return _tus_response(410, str(exc))
+        except UploadError as exc:
+            return _tus_response(400, str(exc))
+
+    return _tus_response(headers={"Upload-Offset": upload.offset})
+
+
+@login_required
+@require_POST
+def transfer_finalize(request, token):
+    """
+    Send out a draft transfer once all of its files have been uploaded.
+    """
+    with transaction.atomic():
+        transfer = get_object_or_404(
+            Transfer.objects.select_for_update(), token=token, owner=request.user
+        )
+        if transfer.is_draft:
+            file_count = transfer.files.count()
+            if not file_count or transfer.uploads.filter(completed_at__isnull=True).exists():
+                return JsonResponse({"error": "Not all files have finished uploading."}, status=409)
+
+            transfer.uploads.all().delete()
+            now = timezone.now()
+            transfer.is_draft = False
+            transfer.code = _generate_code()
+            transfer.code_expires_at = now + timedelta(minutes=15)
+            transfer.expires_at = now + timedelta(days=5)
+            transfer.save(update_fields=["is_draft", "code", "code_expires_at", "expires_at"])
+            _send_code_email(transfer)
+            _files_sent_message(request, file_count)
+
+    return JsonResponse({"redirect": reverse("portfolio-mine")})
+
+
 def transfer_enter_code(request, token):
-    transfer = get_object_or_404(Transfer, token=token)
+    transfer = get_object_or_404(Transfer.objects.ready(), token=token)
 
     if transfer.is_expired:
         raise Http404("This transfer has expired.")
@@ -114,7 +314,8 @@ def transfer_email_code(request):
             code = form.cleaned_data["code"]
             now = timezone.now()
             transfer = (
-                Transfer.objects.filter(
+                Transfer.objects.ready()
+                .filter(
                     recipient_email=email,
                     code=code,
                     expires_at__gt=now,
@@ -148,7 +349,8 @@ def transfer_email_resend_code(request):
 
     now = timezone.now()
     transfer = (
-        Transfer.objects.filter(
+        Transfer.objects.ready()
+        .filter(
             recipient_email=email,
             expires_at__gt=now,
         )
@@ -172,7 +374,7 @@ def transfer_resend_code(request, token):
     Regenerate and resend a fresh 6‑digit code to the original recipient.
     Anyone with the link can trigger this, but it only affects that transfer.
     """
-    transfer = get_object_or_404(Transfer, token=token)
+    transfer = get_object_or_404(Transfer.objects.ready(), token=token)
     if transfer.is_expired:
         raise Http404("This transfer has expired.")
 
@@ -189,7 +391,7 @@ def transfer_resend_code(request, token):
 
 
 def transfer_download(request, token, file_id: int):
-    transfer = get_object_or_404(Transfer, token=token)
+    transfer = get_object_or_404(Transfer.objects.ready(), token=token)
     if transfer.is_expired:
         raise Http404("This transfer has expired.")
 
@@ -208,37 +410,30 @@ def transfer_download(request, token, file_id: int):
 
     file_obj = get_object_or_404(TransferFile, pk=file_id, transfer=transfer)
 
-    is_first_download = transfer.downloaded_at is None
-    if is_first_download:
-        transfer.downloaded_at = timezone.now()
-        transfer.save(update_fields=["downloaded_at"])
-
-        # Notify sender and recipient once files have been downloaded
-        subject = "Your shared files have been downloaded"
-        body = (
-            f"Your file transfer to {transfer.recipient_email} has been accessed and at least one file was downloaded.\n\n"
-            f"Title: {transfer.title or 'No title'}\n"
-            f"Downloaded at: {transfer.downloaded_at:%Y-%m-%d %H:%M} (UTC)\n"
-        )
-        send_mail(
-            subject,
-            body,
-            settings.DEFAULT_FROM_EMAIL,
-            [transfer.owner.email or settings.DEFAULT_FROM_EMAIL],
-            fail_silently=True,
-        )
-        # Best-effort notification to recipient
-        send_mail(
-            "You downloaded shared files from HerbiesPlace",
-            "This is a confirmation that you have accessed the files shared with you.",
-            settings.DEFAULT_FROM_EMAIL,
-            [transfer.recipient_email],
-            fail_silently=True,
-        )
+    _mark_downloaded(transfer)
+    return download_response(request, file_obj.file, file_obj.original_name)
+
+
+def transfer_download_all(request, token):
+    """
+    Stream every file of the transfer as one ZIP archive.
+    """
+    transfer = get_object_or_404(Transfer.objects.ready(), token=token)
+    if transfer.is_expired:
+        raise Http404("This transfer has expired.")
+
+    files = list(transfer.files.all())
+    if not files:
+        raise Http404("No files available.")
 
-    return FileResponse(
-        file_obj.file.open("rb"), as_attachment=True, filename=file_obj.original_name
+    _mark_downloaded(transfer)
+    filename = f"{slugify(transfer.title) or 'herbiesplace-files'}.zip"
+    response = StreamingHttpResponse(
+        zip_stream([(f.original_name, f.file, f.uploaded_at) for f in files]),
+        content_type="application/zip",
     )
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    return response
 
 
 def transfer_finish(request, token):
@@ -246,14 +441,12 @@ def transfer_finish(request, token):
     Recipient can actively confirm they are done; we delete files immediately
     instead of waiting for the expiry date.
     """
-    transfer = get_object_or_404(Transfer, token=token)
+    transfer = get_object_or_404(Transfer.objects.ready(), token=token)
     if transfer.is_expired:
         raise Http404("This transfer has already expired.")
 
     if request.method == "POST":
-        # Delete files and transfer
-        for tf in transfer.files.all():
-            tf.file.delete(save=False)
+        # Deleting the transfer queues removal of its files
         transfer.delete()
 
         messages.success(request, "The files have been deleted from the platform.")
@@ -1,8 +1,13 @@
 from django.db import models
 
+from a_core.imaging import ResponsiveImageMixin
+
+
+class ShowcaseImage(ResponsiveImageMixin, models.Model):
+    rendition_widths = {"thumb": 320, "medium": 640, "large": 1280}
 
-class ShowcaseImage(models.Model):
     image = models.ImageField(upload_to="showcase/")
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -0,0 +1,22 @@
+import os
+
+from a_core.imaging import resize_image
+from a_tasks.queue import task
+
+from .models import ShowcaseImage
+
+
+@task
+def process_showcase_image(image_id: int, name: str):
+    """
+    Replace an uploaded original with the 1920px JPEG and build its renditions.
+    """
+    obj = ShowcaseImage.objects.filter(pk=image_id).first()
+    if obj is None or obj.image.name != name:
+        return
+
+    base_name, _ext = os.path.splitext(os.path.basename(name))
+    with obj.image.open("rb") as fh, resize_image(fh, 1920, "shortest") as processed:
+        obj.image.save(f"{base_name}_1920.jpg", processed, save=False)
+        obj.save(update_fields=["image"])
+        obj.build_renditions(source=processed)
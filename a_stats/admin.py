@@ -0,0 +1,15 @@
+from django.contrib import admin
+
+from .models import DailyStat, SiteStat
+
+
+@admin.register(SiteStat)
+class SiteStatAdmin(admin.ModelAdmin):
+    list_display = ("key", "value", "updated_at")
+
+
+@admin.register(DailyStat)
+class DailyStatAdmin(admin.ModelAdmin):
+    list_display = ("day", "key", "value")
+    list_filter = ("key",)
+    date_hierarchy = "day"
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class AStatsConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "a_stats"
+
+    def ready(self):
+        import a_stats.signals
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from a_stats.stats import fill_file_sizes, reconcile
+
+
+class Command(BaseCommand):
+    help = "Recount the dashboard statistics from the tables and correct counters that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Only recount daily figures of the last N days (totals are always recounted).",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Report drift without correcting it.")
+        parser.add_argument(
+            "--file-sizes",
+            action="store_true",
+            help="First read missing transfer file sizes from storage.",
+        )
+
+    def handle(self, *args, **options):
+        if options["file_sizes"] and not options["dry_run"]:
+            filled = fill_file_sizes()
+            self.stdout.write(f"Read the size of {filled} transfer file(s) from storage.")
+
+        corrections = reconcile(days=options["days"], dry_run=options["dry_run"])
+        for key, day, old, new in corrections:
+            self.stdout.write(f"{key} {day or 'total'}: {old} -> {new}")
+        verb = "Found" if options["dry_run"] else "Corrected"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(corrections)} counter(s)."))
@@ -0,0 +1,36 @@
+from django.db import models
+
+
+class SiteStat(models.Model):
+    """
+    A running site-wide total (users, photos, bytes stored, ...), kept up
+    to date by a_stats.signals and corrected by reconcile_stats.
+    """
+
+    key = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["key"]
+
+    def __str__(self) -> str:
+        return f"{self.key} = {self.value}"
+
+
+class DailyStat(models.Model):
+    """
+    How much of something happened on one day (signups, uploads, ...).
+    Deleting things later does not change the day they happened on.
+    """
+
+    day = models.DateField()
+    key = models.CharField(max_length=50)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ["day", "key"]
+        unique_together = ("key", "day")
+
+    def __str__(self) -> str:
+        return f"{self.day} {self.key} = {self.value}"
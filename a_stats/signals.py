@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from .models import SiteStat
+from .stats import TRACKED, reconcile, track
+
+
+def stat_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        track([instance])
+
+
+def stat_deleted(sender, instance, **kwargs):
+    track([instance], sign=-1)
+
+
+for model, _, _ in TRACKED.values():
+    post_save.connect(stat_created, sender=model, dispatch_uid=f"a_stats_created_{model._meta.label}")
+    post_delete.connect(stat_deleted, sender=model, dispatch_uid=f"a_stats_deleted_{model._meta.label}")
+
+
+@receiver(post_migrate)
+def count_existing(sender, using="default", **kwargs):
+    # Start the counters from the existing rows on first install
+    if sender.name == "a_stats" and not SiteStat.objects.using(using).exists():
+        reconcile()
@@ -0,0 +1,212 @@
+"""
+Site statistics for the staff dashboard.
+
+Every tracked model has a running total in SiteStat and a per-day count in
+DailyStat (the things created that day that still exist), both bumped by
+one UPDATE whenever an instance is created or deleted (see a_stats.signals;
+create_photos, whose bulk_create skips signals, calls track() itself). The
+dashboard reads a handful of rows instead of counting whole tables.
+Deletes that take many rows at once (a user with all their photos and
+comments, a batch of expired transfers) run inside batched(), so their
+changes are recorded once per key and day rather than once per row.
+
+Counters can drift if rows change behind the ORM's back (raw SQL, queryset
+.update(), a crash between statements); reconcile() recounts from the
+tables and corrects them. It runs after every migrate while the counters
+are still empty, and from cron through the reconcile_stats command.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from a_portfolio.models import Category, Comment, Photo
+from a_share.models import Transfer, TransferFile
+
+from .models import DailyStat, SiteStat
+
+
+USERS = "users"
+PHOTOS = "photos"
+CATEGORIES = "categories"
+COMMENTS = "comments"
+TRANSFERS = "transfers"
+TRANSFER_BYTES = "transfer_bytes"
+
+# key -> (model, date field, field summed instead of counting rows)
+TRACKED = {
+    USERS: (User, "date_joined", None),
+    PHOTOS: (Photo, "created_at", None),
+    CATEGORIES: (Category, "created_at", None),
+    COMMENTS: (Comment, "created_at", None),
+    TRANSFERS: (Transfer, "created_at", None),
+    TRANSFER_BYTES: (TransferFile, "uploaded_at", "size"),
+}
+
+
+_pending = ContextVar("stats_pending", default=None)
+
+
+def _bump(model, delta, **lookup) -> None:
+    rows = model.objects.filter(**lookup)
+    if rows.update(value=F("value") + delta):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(value=delta, **lookup)
+    except IntegrityError:
+        # created by a concurrent request in the meantime
+        rows.update(value=F("value") + delta)
+
+
+def record(key: str, delta: int, day) -> None:
+    """Add `delta` to the total of `key` and to its count for `day`."""
+    if not delta:
+        return
+    _bump(SiteStat, delta, key=key)
+    _bump(DailyStat, delta, key=key, day=day)
+
+
+@contextmanager
+def batched():
+    """
+    Collect what is tracked inside this block and record it when the block
+    exits, one record() per key and day. Use it inside the transaction of
+    the deletes; nothing is recorded if the block raises.
+    """
+    if _pending.get() is not None:
+        yield  # the outer block records
+        return
+    pending = defaultdict(int)
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+    for (key, day), delta in pending.items():
+        record(key, delta, day)
+
+
+def track(instances, sign: int = 1) -> None:
+    """
+    Count `instances` (all of one tracked model) as created, or as deleted
+    with sign=-1. Inside batched() the changes are only collected.
+    """
+    instances = list(instances)
+    if not instances:
+        return
+    for key, (model, date_field, amount_field) in TRACKED.items():
+        if not isinstance(instances[0], model):
+            continue
+        per_day = defaultdict(int)
+        for instance in instances:
+            amount = getattr(instance, amount_field) if amount_field else 1
+            per_day[timezone.localdate(getattr(instance, date_field))] += sign * amount
+        pending = _pending.get()
+        for day, delta in per_day.items():
+            if pending is None:
+                record(key, delta, day)
+            else:
+                pending[key, day] += delta
+
+
+def totals() -> dict:
+    """{key: total} for every tracked key, 0 where nothing was recorded."""
+    values = dict.fromkeys(TRACKED, 0)
+    values.update(SiteStat.objects.filter(key__in=TRACKED).values_list("key", "value"))
+    return values
+
+
+def daily_series(days: int = 14) -> list:
+    """
+    One {"day": date, key: count, ...} dict per day for the last `days`
+    days, newest first, with 0 for days without a row.
+    """
+    today = timezone.localdate()
+    series = {today - timedelta(days=n): dict.fromkeys(TRACKED, 0) for n in range(days)}
+    rows = DailyStat.objects.filter(day__gt=today - timedelta(days=days), key__in=TRACKED)
+    for day, key, value in rows.values_list("day", "key", "value"):
+        if day in series:
+            series[day][key] = value
+    return [{"day": day, **values} for day, values in sorted(series.items(), reverse=True)]
+
+
+def _counted(model, amount_field):
+    return Sum(amount_field) if amount_field else Count("pk")
+
+
+def reconcile(days=None, dry_run: bool = False) -> list:
+    """
+    Recount every total, and the daily counts of the last `days` days (all
+    of them if None), from the tables. Counters that were off are corrected
+    unless `dry_run`. Returns the corrections as (key, day or None, old,
+    new) tuples.
+    """
+    since = timezone.localdate() - timedelta(days=days - 1) if days else None
+    corrections = []
+
+    for key, (model, date_field, amount_field) in TRACKED.items():
+        total = model.objects.aggregate(n=_counted(model, amount_field))["n"] or 0
+        current = SiteStat.objects.filter(key=key).values_list("value", flat=True).first()
+        if current != total:
+            corrections.append((key, None, current or 0, total))
+
+        rows = model.objects.all()
+        stored = DailyStat.objects.filter(key=key)
+        if since:
+            rows = rows.filter(**{f"{date_field}__date__gte": since})
+            stored = stored.filter(day__gte=since)
+        counted = dict(
+            rows.annotate(stat_day=TruncDate(date_field))
+            .order_by()
+            .values("stat_day")
+            .annotate(n=_counted(model, amount_field))
+            .values_list("stat_day", "n")
+        )
+        stored = dict(stored.values_list("day", "value"))
+        for day in sorted(counted.keys() | stored.keys()):
+            old, new = stored.get(day, 0), counted.get(day) or 0
+            if old != new:
+                corrections.append((key, day, old, new))
+
+    if not dry_run:
+        with transaction.atomic():
+            for key, day, old, new in corrections:
+                if day is None:
+                    SiteStat.objects.update_or_create(key=key, defaults={"value": new})
+                elif new:
+                    DailyStat.objects.update_or_create(key=key, day=day, defaults={"value": new})
+                else:
+                    DailyStat.objects.filter(key=key, day=day).delete()
+    return corrections
+
+
+def fill_file_sizes(batch_size: int = 500) -> int:
+    """
+    Read the size of transfer files stored before sizes were recorded from
+    storage. Returns the number of files updated; reconcile() afterwards to
+    bring the byte counters in line.
+    """
+    storage = TransferFile._meta.get_field("file").storage
+    updated = last_pk = 0
+    while True:
+        files = list(
+            TransferFile.objects.filter(size=0, pk__gt=last_pk).order_by("pk").only("pk", "file")[:batch_size]
+        )
+        if not files:
+            return updated
+        for transfer_file in files:
+            try:
+                size = storage.size(transfer_file.file.name)
+            except (FileNotFoundError, OSError):
+                continue
+            if size:
+                TransferFile.objects.filter(pk=transfer_file.pk).update(size=size)
+                updated += 1
+        last_pk = files[-1].pk
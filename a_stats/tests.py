@@ -0,0 +1,113 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from a_portfolio.models import Comment, Photo
+from a_portfolio.uploads import create_photos
+from a_share.models import Transfer, TransferFile
+
+from . import stats
+from .models import DailyStat, SiteStat
+
+
+class SiteStatsTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.today = timezone.localdate()
+
+    def _transfer(self, *sizes):
+        transfer = Transfer.objects.create(
+            owner=self.owner,
+            recipient_email="r@example.com",
+            code="123456",
+            code_expires_at=timezone.now(),
+            expires_at=timezone.now() + timedelta(days=7),
+        )
+        for n, size in enumerate(sizes):
+            TransferFile.objects.create(transfer=transfer, file=f"share/{n}.bin", original_name="f", size=size)
+        return transfer
+
+    def test_counters_follow_creates_and_deletes(self):
+        photo = Photo.objects.create(owner=self.owner, title="One", image="portfolio/1.jpg")
+        Comment.objects.create(photo=photo, user=self.owner, content="Nice")
+        create_photos(self.owner, ["portfolio/2.jpg", "portfolio/3.jpg"])
+        self._transfer(100, 50)
+
+        totals = stats.totals()
+        self.assertEqual(
+            [totals[key] for key in (stats.USERS, stats.PHOTOS, stats.COMMENTS, stats.TRANSFERS)], [1, 3, 1, 1]
+        )
+        self.assertEqual(totals[stats.TRANSFER_BYTES], 150)
+        self.assertEqual(stats.daily_series(1)[0][stats.PHOTOS], 3)
+
+        # the photo takes its comment with it
+        photo.delete()
+        totals = stats.totals()
+        self.assertEqual((totals[stats.PHOTOS], totals[stats.COMMENTS]), (2, 0))
+        self.assertEqual(stats.reconcile(), [])
+
+    def test_cascade_deletes_are_recorded_once_per_key_and_day(self):
+        photos = create_photos(self.owner, [f"portfolio/{n}.jpg" for n in range(3)])
+        for photo in photos:
+            Comment.objects.create(photo=photo, user=self.owner, content="Nice")
+        self._transfer(100, 50)
+
+        with mock.patch.object(stats, "record", wraps=stats.record) as record:
+            with stats.batched():
+                self.owner.delete()
+        recorded = {call.args[0]: call.args[1:] for call in record.call_args_list}
+        self.assertEqual(record.call_count, len(recorded))
+        self.assertEqual(
+            recorded,
+            {
+                stats.USERS: (-1, self.today),
+                stats.PHOTOS: (-3, self.today),
+                stats.COMMENTS: (-3, self.today),
+                stats.TRANSFERS: (-1, self.today),
+                stats.TRANSFER_BYTES: (-150, self.today),
+            },
+        )
+        self.assertEqual(set(stats.totals().values()), {0})
+        self.assertEqual(stats.reconcile(), [])
+
+    def test_daily_series_covers_every_day(self):
+        series = stats.daily_series(3)
+        self.assertEqual([day["day"] for day in series], [self.today - timedelta(days=n) for n in range(3)])
+        self.assertEqual(series[0][stats.USERS], 1)
+        self.assertEqual(series[2][stats.USERS], 0)
+
+    def test_reconcile_corrects_drift(self):
+        Photo.objects.create(owner=self.owner, title="One", image="portfolio/1.jpg")
+        SiteStat.objects.filter(key=stats.PHOTOS).update(value=7)
+        DailyStat.objects.create(key=stats.COMMENTS, day=self.today - timedelta(days=3), value=2)
+
+        out = StringIO()
+        call_command("reconcile_stats", "--dry-run", stdout=out)
+        self.assertIn("Found 2 counter(s)", out.getvalue())
+        self.assertEqual(stats.totals()[stats.PHOTOS], 7)
+
+        self.assertEqual(
+            sorted(stats.reconcile(), key=str),
+            [(stats.COMMENTS, self.today - timedelta(days=3), 2, 0), (stats.PHOTOS, None, 7, 1)],
+        )
+        self.assertEqual(stats.totals()[stats.PHOTOS], 1)
+        self.assertFalse(DailyStat.objects.filter(key=stats.COMMENTS).exists())
+        self.assertEqual(stats.reconcile(), [])
+
+    def test_dashboard_reads_the_counters(self):
+        self.owner.is_staff = True
+        self.owner.save()
+        self._transfer(2048)
+        self.client.force_login(self.owner)
+        with self.assertNumQueries(2):
+            stats.totals(), stats.daily_series()
+        resp = self.client.get(reverse("admin-dashboard"))
+        self.assertEqual(resp.context["total_users"], 1)
+        self.assertEqual(resp.context["total_transfer_bytes"], 2048)
+        self.assertContains(resp, "2.0\xa0KB stored")
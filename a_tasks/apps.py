@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class ATasksConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'a_tasks'
+
+    def ready(self):
+        # Register the @task functions of every installed app
+        autodiscover_modules("tasks")
+        import a_tasks.signals
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from a_tasks.models import StorageTombstone
+from a_tasks.tombstones import drain
+
+
+class Command(BaseCommand):
+    help = "Remove the stored files of deleted or replaced rows (storage tombstones)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Handle at most this many tombstones in this run.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Files per round (default: STORAGE_DRAIN_BATCH).",
+        )
+
+    def handle(self, *args, **options):
+        removed, failed = drain(limit=options["limit"], batch_size=options["batch_size"])
+        self.stdout.write(f"Removed {removed} file(s); {failed} failed and will be retried.")
+
+        waiting = StorageTombstone.objects.aggregate(oldest=Min("created_at"))["oldest"]
+        if waiting:
+            age = (timezone.now() - waiting).total_seconds()
+            self.stdout.write(
+                f"{StorageTombstone.objects.count()} tombstone(s) left, oldest {age:.0f}s old."
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS("No tombstones left."))
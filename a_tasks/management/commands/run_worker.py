@@ -0,0 +1,107 @@
+import os
+import signal
+import socket
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+
+from a_tasks.queue import claim_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Run background job workers until stopped (SIGINT/SIGTERM)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Number of jobs processed at the same time, one thread each.",
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit as soon as no job is due instead of waiting for new ones.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.TASKS_POLL_INTERVAL,
+            help="Seconds to sleep when the queue is empty.",
+        )
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        self.processed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+        concurrency = max(1, options["concurrency"])
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+        previous_handlers = self._install_signal_handlers()
+        try:
+            if concurrency == 1:
+                # Run in the main thread; this also keeps --burst usable in tests,
+                # where other threads cannot see the test transaction.
+                self._work(f"{prefix}:0", options)
+            else:
+                threads = [
+                    threading.Thread(target=self._thread_main, args=(f"{prefix}:{i}", options), daemon=True)
+                    for i in range(concurrency)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Worker stopped: {self.processed} jobs done, {self.failed} failed.")
+        )
+
+    def _install_signal_handlers(self):
+        def request_stop(signum, frame):
+            self.stdout.write("Finishing current jobs, then stopping...")
+            self.stop.set()
+
+        return {
+            signum: signal.signal(signum, request_stop)
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+
+    def _thread_main(self, worker_id, options):
+        try:
+            self._work(worker_id, options, threaded=True)
+        finally:
+            connection.close()
+
+    def _work(self, worker_id, options, threaded=False):
+        while not self.stop.is_set():
+            if threaded:
+                close_old_connections()
+            try:
+                jobs = claim_jobs(worker_id)
+            except DatabaseError as exc:
+                # e.g. "database is locked" when SQLite workers collide
+                self.stderr.write(f"{worker_id}: could not claim jobs: {exc}")
+                self.stop.wait(options["poll_interval"])
+                continue
+
+            if not jobs:
+                if options["burst"]:
+                    return
+                self.stop.wait(options["poll_interval"])
+                continue
+
+            for job in jobs:
+                ok = run_job(job)
+                with self._lock:
+                    if ok:
+                        self.processed += 1
+                    else:
+                        self.failed += 1
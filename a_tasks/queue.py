@@ -0,0 +1,142 @@
+"""
+A small database-backed job queue.
+
+Functions decorated with @task can be called directly or queued with
+``func.enqueue(*args, **kwargs)``. Arguments must be JSON serializable, so
+pass primary keys and storage names rather than model instances or files.
+
+Workers (``manage.py run_worker``) claim due jobs by taking a lease on them.
+On PostgreSQL the candidate rows are locked with FOR UPDATE SKIP LOCKED so
+concurrent workers never wait on each other; SQLite has no row locks and
+relies on a guarded UPDATE that only the first worker can win. A job whose
+worker died becomes claimable again once its lease runs out.
+"""
+from datetime import timedelta
+import logging
+import random
+import traceback
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class Task:
+    def __init__(self, func, name: str, max_attempts: int):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, *args, run_at=None, **kwargs) -> Job:
+        """
+        Queue a call of this task. Inside a transaction the job only becomes
+        visible to workers once the transaction commits.
+        """
+        return Job.objects.create(
+            task=self.name,
+            args=list(args),
+            kwargs=kwargs,
+            run_at=run_at or timezone.now(),
+            max_attempts=self.max_attempts,
+        )
+
+
+def task(func=None, *, name=None, max_attempts=None):
+    """
+    Register `func` as a task, as ``@task`` or ``@task(max_attempts=3)``.
+    """
+
+    def register(func):
+        task_name = name or f"{func.__module__}.{func.__name__}"
+        registered = Task(func, task_name, max_attempts or settings.TASKS_MAX_ATTEMPTS)
+        _registry[task_name] = registered
+        return registered
+
+    if func is not None:
+        return register(func)
+    return register
+
+
+def get_task(name: str) -> Task:
+    try:
+        return _registry[name]
+    except KeyError:
+        raise LookupError(f"No task registered as {name!r}") from None
+
+
+def retry_delay(attempt: int) -> timedelta:
+    """
+    Exponential backoff with jitter: roughly base, 2*base, 4*base, ...
+    capped at TASKS_RETRY_MAX_DELAY seconds.
+    """
+    delay = min(settings.TASKS_RETRY_BASE_DELAY * 2 ** (attempt - 1), settings.TASKS_RETRY_MAX_DELAY)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def claim_jobs(worker_id: str, limit: int = 1) -> list:
+    """
+    Lease up to `limit` due jobs to `worker_id` and return them.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(
+        Q(status=Job.STATUS_QUEUED, run_at__lte=now)
+        | Q(status=Job.STATUS_RUNNING, locked_until__lt=now)
+    ).order_by("run_at", "id")
+
+    claimed = []
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        candidates = list(due.values_list("pk", "status", "locked_until")[:limit])
+        for pk, status, locked_until in candidates:
+            # Only matches if nobody claimed the row since we read it
+            won = Job.objects.filter(pk=pk, status=status, locked_until=locked_until).update(
+                status=Job.STATUS_RUNNING,
+                locked_by=worker_id,
+                locked_until=now + timedelta(seconds=settings.TASKS_LEASE_SECONDS),
+                attempts=F("attempts") + 1,
+            )
+            if won:
+                claimed.append(pk)
+
+    return list(Job.objects.filter(pk__in=claimed))
+
+
+def run_job(job: Job) -> bool:
+    """
+    Run a claimed job. Successful jobs are deleted; failures are retried
+    with backoff until max_attempts is reached. Returns True on success.
+    """
+    mine = Job.objects.filter(pk=job.pk, locked_by=job.locked_by)
+    try:
+        get_task(job.task).func(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error("Job %s (%s) failed permanently:\n%s", job.pk, job.task, error)
+            mine.update(status=Job.STATUS_FAILED, locked_until=None, last_error=error)
+        else:
+            logger.warning("Job %s (%s) failed, will retry:\n%s", job.pk, job.task, error)
+            mine.update(
+                status=Job.STATUS_QUEUED,
+                run_at=timezone.now() + retry_delay(job.attempts),
+                locked_by="",
+                locked_until=None,
+                last_error=error,
+            )
+        return False
+
+    mine.delete()
+    return True
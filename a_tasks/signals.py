@@ -0,0 +1,42 @@
+from django.db.models.fields.files import FieldFile
+from django.db.models.signals import post_delete, post_init, post_save
+
+from .tombstones import bury, file_fields
+
+
+def _stored_name(value, saved=False):
+    # Loaded rows hold plain names. A file assigned to a new instance only
+    # has its final name once the row is saved. Deferred fields hold nothing.
+    if isinstance(value, str):
+        return value
+    if saved and isinstance(value, FieldFile):
+        return value.name
+    return None
+
+
+# Like django_cleanup: remember the stored names as loaded, so a save that
+# swaps a file can bury the old one without asking the database
+def remember_files(sender, instance, **kwargs):
+    fields = file_fields(sender)
+    if fields:
+        instance._stored_files = {
+            field.attname: _stored_name(instance.__dict__.get(field.attname)) for field in fields
+        }
+
+
+def bury_replaced_files(sender, instance, raw=False, **kwargs):
+    stored = getattr(instance, "_stored_files", None)
+    if stored is None or raw:
+        return
+    current = {attname: _stored_name(instance.__dict__.get(attname), saved=True) for attname in stored}
+    bury(old for attname, old in stored.items() if old and old != current[attname])
+    instance._stored_files = current
+
+
+def bury_deleted_files(sender, instance, **kwargs):
+    bury(getattr(instance, field.attname).name for field in file_fields(sender))
+
+
+post_init.connect(remember_files, dispatch_uid="a_tasks_remember_files")
+post_save.connect(bury_replaced_files, dispatch_uid="a_tasks_bury_replaced_files")
+post_delete.connect(bury_deleted_files, dispatch_uid="a_tasks_bury_deleted_files")
@@ -0,0 +1,26 @@
+from django.core.files.storage import default_storage
+
+from a_core.storage_backends import delete_many
+
+from .queue import task
+
+
+@task
+def delete_files(names: list):
+    """
+    Remove files from the default storage. Missing files are not an error.
+    """
+    failed = delete_many(default_storage, names)
+    if failed:
+        raise OSError(f"Could not delete {len(failed)} of {len(names)} files: {failed[:10]}")
+
+
+@task(max_attempts=1)
+def drain_storage():
+    """
+    Remove the files of due storage tombstones. Failed files are retried by
+    the tombstones themselves, so the job is never retried.
+    """
+    from .tombstones import drain
+
+    drain()
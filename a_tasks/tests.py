@@ -0,0 +1,150 @@
+from datetime import timedelta
+from io import StringIO
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from a_portfolio.models import Photo
+
+from .models import Job, StorageTombstone
+from .queue import claim_jobs, run_job, task
+from .tombstones import batched, drain
+
+
+calls = []
+
+
+@task
+def record_call(value):
+    calls.append(value)
+
+
+@task(max_attempts=2)
+def always_fails():
+    raise RuntimeError("boom")
+
+
+def run_worker():
+    call_command("run_worker", "--burst", stdout=StringIO(), stderr=StringIO())
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_worker_runs_due_jobs_and_deletes_them(self):
+        record_call.enqueue("now")
+        record_call.enqueue("later", run_at=timezone.now() + timedelta(hours=1))
+
+        run_worker()
+
+        self.assertEqual(calls, ["now"])
+        self.assertEqual(list(Job.objects.values_list("kwargs", "args")), [({}, ["later"])])
+
+    def test_failed_job_is_retried_with_backoff_then_marked_failed(self):
+        job = always_fails.enqueue()
+
+        with self.assertLogs("a_tasks.queue", "WARNING"):
+            run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn("RuntimeError: boom", job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs("a_tasks.queue", "ERROR"):
+            run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 2))
+
+    def test_claimed_job_is_leased_until_it_expires(self):
+        job = record_call.enqueue("x")
+        self.assertEqual([j.pk for j in claim_jobs("worker-a")], [job.pk])
+        self.assertEqual(claim_jobs("worker-b"), [])
+
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = claim_jobs("worker-b")
+        self.assertEqual([(j.locked_by, j.attempts) for j in reclaimed], [("worker-b", 2)])
+
+        # the worker that lost its lease can no longer settle the job
+        stale = Job(pk=job.pk, task=job.task, args=["x"], kwargs={}, locked_by="worker-a")
+        run_job(stale)
+        self.assertTrue(Job.objects.filter(pk=job.pk, locked_by="worker-b").exists())
+
+
+class StorageTombstoneTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.owner = User.objects.create_user(username="owner", password="pass")
+
+    def _photo(self, name):
+        stored = default_storage.save(name, ContentFile(b"jpeg"))
+        return Photo.objects.create(owner=self.owner, title=name, image=stored)
+
+    def _buried(self):
+        return sorted(StorageTombstone.objects.values_list("name", flat=True))
+
+    def test_deleting_rows_buries_their_files_until_drained(self):
+        photos = [self._photo(f"portfolio/{n}.jpg") for n in range(3)]
+        with mock.patch.object(default_storage, "delete") as delete:
+            self.owner.delete()
+        delete.assert_not_called()
+        self.assertEqual(self._buried(), sorted(photo.image.name for photo in photos))
+        self.assertEqual(Job.objects.filter(task="a_tasks.tasks.drain_storage").count(), 1)
+
+        out = StringIO()
+        call_command("drain_storage", "--batch-size", "2", stdout=out)
+        self.assertIn("Removed 3 file(s)", out.getvalue())
+        self.assertFalse(StorageTombstone.objects.exists())
+        self.assertFalse(any(default_storage.exists(photo.image.name) for photo in photos))
+
+    def test_batched_deletes_bury_with_one_insert(self):
+        photos = [self._photo(f"portfolio/{n}.jpg") for n in range(3)]
+        with CaptureQueriesContext(connection) as ctx, transaction.atomic(), batched():
+            self.owner.delete()
+        queries = [q["sql"] for q in ctx.captured_queries]
+        self.assertEqual(sum('INTO "a_tasks_storagetombstone"' in sql for sql in queries), 1)
+        self.assertEqual(sum('FROM "a_tasks_job"' in sql for sql in queries), 1)
+        self.assertEqual(self._buried(), sorted(photo.image.name for photo in photos))
+
+    def test_rolled_back_deletes_keep_their_files(self):
+        photo = self._photo("portfolio/kept.jpg")
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            photo.delete()
+            raise RuntimeError("abort")
+        self.assertEqual(self._buried(), [])
+        self.assertTrue(default_storage.exists("portfolio/kept.jpg"))
+
+    def test_replaced_files_are_buried(self):
+        photo = self._photo("portfolio/old.jpg")
+        photo = Photo.objects.get(pk=photo.pk)
+        photo.image = default_storage.save("portfolio/new.jpg", ContentFile(b"jpeg"))
+        photo.save()
+        photo.title = "renamed"
+        photo.save()
+        self.assertEqual(self._buried(), ["portfolio/old.jpg"])
+
+    def test_failed_deletes_are_retried_later(self):
+        self._photo("portfolio/stuck.jpg").delete()
+        with mock.patch("a_tasks.tombstones.delete_many", side_effect=ConnectionError("down")):
+            self.assertEqual(drain(), (0, 1))
+        tombstone = StorageTombstone.objects.get()
+        self.assertEqual(tombstone.attempts, 1)
+        self.assertIn("down", tombstone.last_error)
+        self.assertEqual(drain(), (0, 0))  # not due yet
+
+        StorageTombstone.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(drain(), (1, 0))
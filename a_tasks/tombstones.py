@@ -0,0 +1,156 @@
+"""
+Deferred removal of stored files.
+
+Deleting a row with a FileField (or saving it with a different file) does
+not touch storage in the request. Instead a StorageTombstone with the
+file's name is inserted in the same transaction as the row change, so a
+rollback takes the tombstone with it and no file of a surviving row is
+ever removed. This replaces django_cleanup, which deleted each file
+synchronously after commit, one storage round trip per file: deleting a
+user with thousands of photos timed out.
+
+Tombstones are drained by a drain_storage job, queued whenever files are
+buried, and by the drain_storage command from cron: names go to
+delete_many in batches (S3 DeleteObjects calls of up to 1000 keys), and
+names that fail are retried with the job queue's backoff. Removing a
+missing file is not an error, so two drains overlapping is harmless.
+
+Deletes that take many rows at once (a user with all their photos, a
+bulk delete) run inside batched(), so their files are buried with one
+insert and one schedule_drain() rather than per row. Code that removes
+the files itself in bulk wraps its deletes in storage_handled_by_caller().
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import FileField
+from django.utils import timezone
+
+from a_core.storage_backends import delete_many
+
+from .models import Job, StorageTombstone
+from .queue import retry_delay
+
+
+DRAIN_TASK = "a_tasks.tasks.drain_storage"
+
+_storage_handled_by_caller = ContextVar("storage_handled_by_caller", default=False)
+_pending = ContextVar("tombstones_pending", default=None)
+_file_fields = {}
+
+
+@contextmanager
+def batched():
+    """
+    Collect the names buried inside this block and bury them all when the
+    block exits. Use it inside the transaction of the deletes; nothing is
+    buried if the block raises.
+    """
+    if _pending.get() is not None:
+        yield  # the outer block buries
+        return
+    pending = []
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+    bury(pending)
+
+
+@contextmanager
+def storage_handled_by_caller():
+    """
+    Bury no files of rows deleted inside this block, for callers that
+    remove the storage objects themselves in bulk (see cleanup_transfers).
+    """
+    token = _storage_handled_by_caller.set(True)
+    try:
+        yield
+    finally:
+        _storage_handled_by_caller.reset(token)
+
+
+def caller_handles_storage() -> bool:
+    """True inside storage_handled_by_caller()."""
+    return _storage_handled_by_caller.get()
+
+
+def file_fields(model) -> list:
+    """The FileFields (and ImageFields) whose files are buried with the row."""
+    if model not in _file_fields:
+        _file_fields[model] = [
+            field for field in model._meta.concrete_fields if isinstance(field, FileField)
+        ]
+    return _file_fields[model]
+
+
+def bury(names) -> int:
+    """
+    Schedule the removal of the stored files `names` once the surrounding
+    transaction commits. Returns the number of names buried. Inside
+    batched() the names are only collected.
+    """
+    names = [name for name in names if name]
+    if not names or caller_handles_storage():
+        return 0
+    pending = _pending.get()
+    if pending is not None:
+        pending.extend(names)
+        return len(names)
+    StorageTombstone.objects.bulk_create(StorageTombstone(name=name) for name in names)
+    schedule_drain()
+    return len(names)
+
+
+def schedule_drain() -> None:
+    """Queue a drain_storage job unless one is already waiting."""
+    from .tasks import drain_storage
+
+    if not Job.objects.filter(task=DRAIN_TASK, status=Job.STATUS_QUEUED).exists():
+        drain_storage.enqueue()
+
+
+def drain(limit=None, batch_size=None) -> tuple:
+    """
+    Remove the files of due tombstones, batch_size (default
+    STORAGE_DRAIN_BATCH) at a time, up to `limit` tombstones. Returns
+    (removed, failed); failed tombstones are tried again later.
+    """
+    batch_size = batch_size or settings.STORAGE_DRAIN_BATCH
+    removed = failed = 0
+    last_pk = 0
+    while limit is None or removed + failed < limit:
+        size = batch_size if limit is None else min(batch_size, limit - removed - failed)
+        batch = list(
+            StorageTombstone.objects.filter(next_attempt_at__lte=timezone.now(), pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", "name", "attempts")[:size]
+        )
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+
+        names = [name for _, name, _ in batch]
+        try:
+            not_deleted, error = set(delete_many(default_storage, names)), "Storage refused the delete"
+        except Exception as exc:
+            # storage unreachable: the whole batch waits for the next try
+            not_deleted, error = set(names), repr(exc)
+
+        done = [pk for pk, name, _ in batch if name not in not_deleted]
+        StorageTombstone.objects.filter(pk__in=done).delete()
+        removed += len(done)
+        with transaction.atomic():
+            for pk, name, attempts in batch:
+                if name in not_deleted:
+                    StorageTombstone.objects.filter(pk=pk).update(
+                        attempts=attempts + 1,
+                        next_attempt_at=timezone.now() + retry_delay(attempts + 1),
+                        last_error=error,
+                    )
+                    failed += 1
+    return removed, failed
@@ -0,0 +1,30 @@
+"""
+Paging, counts and filter choices for the staff list pages.
+
+Lists are keyset-paginated on their sort column plus the primary key
+(a_portfolio.pagination.keyset_page), like the galleries, so a deep page
+costs the same as the first one. Counts come from the maintained a_stats
+totals when a list is unfiltered, and are capped at ADMIN_LIST_COUNT_LIMIT
+otherwise ("1000+"), so no page counts a whole table.
+
+Filters whose choices grow with the site (owners, commenters, photos) are
+typeaheads (admin_filter_options) instead of dropdowns listing every
+candidate; the category filter uses the cached a_portfolio.facets.
+"""
+from django.conf import settings
+
+from a_stats import stats
+
+
+def list_count(queryset, total_key=None):
+    """
+    Return (count, capped) for a staff list. Unfiltered lists with a
+    `total_key` read the a_stats counter; anything else is counted up to
+    ADMIN_LIST_COUNT_LIMIT, and `capped` says the real count is higher.
+    """
+    if total_key and not queryset.query.where:
+        return stats.totals()[total_key], False
+    limit = settings.ADMIN_LIST_COUNT_LIMIT
+    count = queryset.order_by()[: limit + 1].count()
+    return min(count, limit), count > limit
+
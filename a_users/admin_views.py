@@ -1,36 +1,74 @@
 from django.contrib.auth.decorators import user_passes_test
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.contrib.sessions.models import Session
-from django.db.models import Q, Count
+from django.db import transaction
+from django.db.models import Q, Count, Exists, OuterRef
+from django.http import Http404, HttpResponseBadRequest, HttpResponseForbidden
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
 from django.contrib import messages
 
 from .models import Profile, DobChangeRequest, AuditLog
+from .admin_lists import list_count
 from .forms import ProfileForm
+from .presence import active_users
+from .search import paginate_users, search_users
+from .tasks import process_avatar
 from a_portfolio.models import Photo, Category, Comment
+from a_portfolio.comments import delete_comment
+from a_portfolio.facets import photo_categories
 from a_portfolio.forms import PhotoForm, CategoryForm
+from a_portfolio.pagination import InvalidCursor, keyset_page
+from a_portfolio.search import search_photos
+from a_portfolio.tasks import process_photo
+from a_stats import stats
+from a_tasks import tombstones
 
 
 def staff_required(user):
     return user.is_authenticated and user.is_staff
 
 
+def _list_page(request, queryset, field, total_key=None, descending=True):
+    """
+    One page of a staff list: the rows plus the count and paging links for
+    a_users/admin/pager.html. Raises InvalidCursor for a bad ?cursor=.
+    """
+    count, count_capped = list_count(queryset, total_key)
+    rows, next_cursor = keyset_page(
+        queryset, field, request.GET.get("cursor"), settings.ADMIN_LIST_PAGE_SIZE, descending
+    )
+    return rows, _pager(request, count, count_capped, "cursor", next_cursor)
+
+
+def _pager(request, count, count_capped, param, next_value):
+    query = request.GET.copy()
+    query.pop(param, None)
+    first_page_url = f"{request.path}?{query.urlencode()}" if param in request.GET else None
+    next_page_url = None
+    if next_value:
+        query[param] = next_value
+        next_page_url = f"{request.path}?{query.urlencode()}"
+    return {
+        "count": count,
+        "count_capped": count_capped,
+        "next_page_url": next_page_url,
+        "first_page_url": first_page_url,
+    }
+
+
 @user_passes_test(staff_required)
 def admin_dashboard(request):
     """Main admin dashboard with statistics"""
-    total_users = User.objects.count()
-    total_photos = Photo.objects.count()
-    total_categories = Category.objects.count()
-    total_comments = Comment.objects.count()
+    # Maintained counters (a_stats) instead of counting the tables
+    totals = stats.totals()
     
-    # Active users (logged in within last 15 minutes)
-    active_sessions = Session.objects.filter(expire_date__gte=timezone.now())
-    active_user_ids = [int(session.get_decoded().get("_auth_user_id")) for session in active_sessions if session.get_decoded().get("_auth_user_id")]
-    active_users = User.objects.filter(id__in=active_user_ids).distinct()
-    
-    # Role statistics
-    role_stats = Profile.objects.values("role").annotate(count=Count("id"))
+    # Active users: seen within the last ?minutes= (default ACTIVE_USER_MINUTES)
+    try:
+        minutes = max(1, int(request.GET.get("minutes", settings.ACTIVE_USER_MINUTES)))
+    except ValueError:
+        minutes = settings.ACTIVE_USER_MINUTES
+    active = active_users(minutes)
     
     # Recent photos
     recent_photos = Photo.objects.select_related("owner", "owner__profile", "category").order_by("-created_at")[:10]
@@ -42,13 +80,16 @@ def admin_dashboard(request):
         request,
         "a_users/admin/dashboard.html",
         {
-            "total_users": total_users,
-            "total_photos": total_photos,
-            "total_categories": total_categories,
-            "total_comments": total_comments,
-            "active_users": active_users,
-            "active_count": active_users.count(),
-            "role_stats": role_stats,
+            "total_users": totals[stats.USERS],
+            "total_photos": totals[stats.PHOTOS],
+            "total_categories": totals[stats.CATEGORIES],
+            "total_comments": totals[stats.COMMENTS],
+            "total_transfers": totals[stats.TRANSFERS],
+            "total_transfer_bytes": totals[stats.TRANSFER_BYTES],
+            "daily_stats": stats.daily_series(settings.DASHBOARD_STATS_DAYS),
+            "active_users": [profile.user for profile in active.select_related("user")[:30]],
+            "active_count": active.count(),
+            "active_minutes": minutes,
             "recent_photos": recent_photos,
             "recent_users": recent_users,
         },
@@ -61,25 +102,29 @@ def admin_users(request):
     search = request.GET.get("search", "")
     role_filter = request.GET.get("role", "")
     
-    users = User.objects.select_related("profile").all()
-    
-    if search:
-        users = users.filter(
-            Q(username__icontains=search)
-            | Q(email__icontains=search)
-            | Q(profile__displayname__icontains=search)
-        )
+    users = User.objects.select_related("profile")
     
     if role_filter:
         users = users.filter(profile__role=role_filter)
     
-    users = users.order_by("-date_joined")
+    if search:
+        # best matches first instead of newest, paged by number like the other user searches
+        users = search_users(search, users)
+        count, count_capped = list_count(users)
+        users, next_page = paginate_users(users, request.GET.get("page"), settings.ADMIN_LIST_PAGE_SIZE)
+        pager = _pager(request, count, count_capped, "page", next_page)
+    else:
+        try:
+            users, pager = _list_page(request, users, "date_joined", stats.USERS)
+        except InvalidCursor:
+            return HttpResponseBadRequest("Invalid page cursor.")
     
     return render(
         request,
         "a_users/admin/users.html",
         {
             "users": users,
+            "pager": pager,
             "search": search,
             "role_filter": role_filter,
             "role_choices": Profile.ROLE_CHOICES,
@@ -98,6 +143,8 @@ def admin_user_edit(request, user_id):
         if form.is_valid():
             old_role = profile.role
             form.save()
+            if "image" in form.changed_data and profile.image:
+                process_avatar.enqueue(profile.pk, profile.image.name)
             if old_role != profile.role:
                 AuditLog.objects.create(
                     user=user,
@@ -126,7 +173,9 @@ def admin_user_delete(request, user_id):
     
     if request.method == "POST":
         username = user.username
-        user.delete()
+        # the user's photos, comments and transfers go with them
+        with transaction.atomic(), stats.batched(), tombstones.batched():
+            user.delete()
         messages.success(request, f"User {username} deleted successfully.")
         return redirect("admin-users")
     
@@ -157,23 +206,23 @@ def admin_photos(request):
     if visibility_filter:
         photos = photos.filter(visibility=visibility_filter)
     
-    photos = photos.order_by("-created_at")
-    
-    # Get unique owners and categories for filters
-    owners = User.objects.filter(photos__isnull=False).distinct().order_by("username")
-    categories = Category.objects.filter(photos__isnull=False).distinct().order_by("name")
+    try:
+        photos, pager = _list_page(request, photos, "created_at", stats.PHOTOS)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid page cursor.")
     
     return render(
         request,
         "a_users/admin/photos.html",
         {
             "photos": photos,
+            "pager": pager,
             "search": search,
             "owner_filter": owner_filter,
             "category_filter": category_filter,
             "visibility_filter": visibility_filter,
-            "owners": owners,
-            "categories": categories,
+            # owners are picked with a typeahead (admin_filter_options)
+            "categories": photo_categories(),
             "visibility_choices": Photo.VISIBILITY_CHOICES,
         },
     )
@@ -189,6 +238,8 @@ def admin_photo_edit(request, photo_id):
         if form.is_valid():
             old_visibility = photo.visibility
             form.save()
+            if "image" in form.changed_data:
+                process_photo.enqueue(photo.pk, photo.image.name)
             new_visibility = form.instance.visibility
             if old_visibility != new_visibility:
                 AuditLog.objects.create(
@@ -288,7 +339,8 @@ def admin_photos_bulk_delete(request):
         return HttpResponseForbidden("Invalid request.")
     ids = request.POST.getlist("photo_ids")
     if ids:
-        Photo.objects.filter(pk__in=ids).delete()
+        with transaction.atomic(), stats.batched(), tombstones.batched():
+            Photo.objects.filter(pk__in=ids).delete()
         messages.success(request, "Selected photos deleted.")
     return redirect("admin-photos")
 
@@ -306,27 +358,27 @@ def admin_comments(request):
         comments = comments.filter(content__icontains=search)
     
     if photo_filter:
-        comments = comments.filter(photo__id=photo_filter)
+        # the typeahead fills in photo ids; anything else matches nothing
+        comments = comments.filter(photo__id=photo_filter) if photo_filter.isdigit() else comments.none()
     
     if user_filter:
         comments = comments.filter(user__username=user_filter)
     
-    comments = comments.order_by("-created_at")
-    
-    # Get unique photos and users for filters
-    photos_with_comments = Photo.objects.filter(comments__isnull=False).distinct().order_by("title")
-    users_with_comments = User.objects.filter(photo_comments__isnull=False).distinct().order_by("username")
+    try:
+        comments, pager = _list_page(request, comments, "created_at", stats.COMMENTS)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid page cursor.")
     
+    # photos and users are picked with typeaheads (admin_filter_options)
     return render(
         request,
         "a_users/admin/comments.html",
         {
             "comments": comments,
+            "pager": pager,
             "search": search,
             "photo_filter": photo_filter,
             "user_filter": user_filter,
-            "photos": photos_with_comments,
-            "users": users_with_comments,
         },
     )
 
@@ -338,7 +390,8 @@ def admin_comment_delete(request, comment_id):
     photo = comment.photo
     
     if request.method == "POST":
-        comment.delete()
+        with transaction.atomic():
+            delete_comment(comment)
         messages.success(request, "Comment deleted successfully.")
         return redirect("admin-comments")
     
@@ -351,7 +404,7 @@ def admin_categories(request):
     search = request.GET.get("search", "")
     adult_filter = request.GET.get("adult_only", "")
     
-    categories = Category.objects.annotate(photo_count=Count("photos")).all()
+    categories = Category.objects.all()
     
     if search:
         categories = categories.filter(name__icontains=search)
@@ -361,13 +414,20 @@ def admin_categories(request):
     elif adult_filter == "no":
         categories = categories.filter(is_adult_only=False)
     
-    categories = categories.order_by("name")
+    try:
+        # photos are counted for the categories on the page only
+        categories, pager = _list_page(
+            request, categories.annotate(photo_count=Count("photos")), "name", stats.CATEGORIES, descending=False
+        )
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid page cursor.")
     
     return render(
         request,
         "a_users/admin/categories.html",
         {
             "categories": categories,
+            "pager": pager,
             "search": search,
             "adult_filter": adult_filter,
         },
@@ -408,3 +468,30 @@ def admin_category_delete(request, category_id):
     
     return render(request, "a_users/admin/category_delete.html", {"category": category})
 
+
+
+@user_passes_test(staff_required)
+def admin_filter_options(request, facet):
+    """
+    Choices for a staff list filter while typing (HTMX): the best few
+    matches for the filter's value, as <option>s for its datalist.
+    """
+    param = {"owners": "owner", "commenters": "user", "photos": "photo"}.get(facet)
+    if param is None:
+        raise Http404
+    q = request.GET.get(param, "").strip()
+    limit = settings.USER_SEARCH_TYPEAHEAD_LIMIT
+    
+    options = []
+    if q and facet == "photos":
+        commented = Photo.objects.filter(Exists(Comment.objects.filter(photo=OuterRef("pk"))))
+        photos, _ = search_photos(commented, q, page_size=limit)
+        options = [(photo.pk, photo.title) for photo in photos]
+    elif q:
+        if facet == "owners":
+            candidates = User.objects.filter(Exists(Photo.objects.filter(owner=OuterRef("pk"))))
+        else:
+            candidates = User.objects.filter(Exists(Comment.objects.filter(user=OuterRef("pk"))))
+        options = [(user.username, user.profile.name) for user in search_users(q, candidates)[:limit]]
+    
+    return render(request, "a_users/admin/filter_options.html", {"options": options})
@@ -0,0 +1,86 @@
+"""
+Counters behind the header badges: unread messages and pending friend
+requests per user, pending DOB change requests for staff.
+
+They are kept in the shared cache until something they count changes;
+the writes that do (sending or reading messages, friend requests and DOB
+requests changing) drop the affected entries once their transaction has
+committed. The header reads them through HeaderBadges, which only looks
+anything up when a template actually shows a badge, so HTMX partials and
+pages without the header cost nothing.
+"""
+from functools import cached_property
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import DobChangeRequest, FriendRequest, Participant
+
+
+STAFF_KEY = "badges:staff"
+
+
+def _user_key(user_id) -> str:
+    return f"badges:user:{user_id}"
+
+
+def user_counts(user_id) -> dict:
+    """{"messages": unread messages, "friend_requests": pending requests to the user}."""
+    key = _user_key(user_id)
+    counts = cache.get(key)
+    if counts is None:
+        counts = {
+            "messages": Participant.objects.filter(user_id=user_id).aggregate(n=Sum("unread_count"))["n"] or 0,
+            "friend_requests": FriendRequest.objects.filter(
+                to_user_id=user_id, status=FriendRequest.STATUS_PENDING
+            ).count(),
+        }
+        cache.set(key, counts, settings.BADGE_CACHE_TIMEOUT)
+    return counts
+
+
+def staff_counts() -> dict:
+    """{"dob_requests": pending DOB change requests}, shared by all staff."""
+    counts = cache.get(STAFF_KEY)
+    if counts is None:
+        counts = {"dob_requests": DobChangeRequest.objects.filter(status=DobChangeRequest.STATUS_PENDING).count()}
+        cache.set(STAFF_KEY, counts, settings.BADGE_CACHE_TIMEOUT)
+    return counts
+
+
+def invalidate_users(*user_ids) -> None:
+    keys = [_user_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_staff() -> None:
+    transaction.on_commit(lambda: cache.delete(STAFF_KEY))
+
+
+class HeaderBadges:
+    """The header's counters for `user`, looked up on first use."""
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def _user_counts(self):
+        return user_counts(self.user.pk)
+
+    @property
+    def messages(self) -> int:
+        return self._user_counts["messages"]
+
+    @property
+    def friend_requests(self) -> int:
+        return self._user_counts["friend_requests"]
+
+    @property
+    def alerts(self) -> int:
+        return self.messages + self.friend_requests
+
+    @cached_property
+    def dob_requests(self) -> int:
+        return staff_counts()["dob_requests"] if self.user.is_staff else 0
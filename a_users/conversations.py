@@ -0,0 +1,189 @@
+"""
+Conversations between two users.
+
+Every message belongs to a Conversation, and each of the two users has a
+Participant row with their unread count and the time the conversation last
+moved. Sending and reading a message update those rows in the same
+transaction as the message itself, so the inbox is one indexed query over
+Participant instead of a walk over the whole message history.
+
+Threads are read backwards a page at a time (thread_page), and an open
+thread follows new messages and read receipts through thread_updates(),
+which a_users.views.message_stream polls for its event stream.
+
+Messages from before conversations existed are attached by
+backfill_conversations(), which runs after every migrate and does nothing
+once every message has its conversation.
+"""
+from django.db import transaction
+from django.db.models import F, Max, Q
+
+from a_portfolio.pagination import keyset_page
+
+from .badges import invalidate_users
+from .models import Conversation, Message, Participant
+
+
+def conversation_key(user_id, other_id) -> str:
+    low, high = sorted((user_id, other_id))
+    return f"{low}:{high}"
+
+
+def get_conversation(user_id, other_id) -> Conversation:
+    """
+    The conversation between two users, created (with both participants)
+    on first use. Both are created in one transaction, so a conversation
+    never exists without its participants.
+    """
+    with transaction.atomic():
+        conversation, created = Conversation.objects.get_or_create(key=conversation_key(user_id, other_id))
+        if created:
+            Participant.objects.bulk_create(
+                [
+                    Participant(conversation=conversation, user_id=user_id, other_user_id=other_id),
+                    Participant(conversation=conversation, user_id=other_id, other_user_id=user_id),
+                ]
+            )
+    return conversation
+
+
+def send_message(sender, recipient, content: str) -> Message:
+    """
+    Store a message and move the conversation: new last message and
+    activity time, one more unread message for the recipient.
+    """
+    with transaction.atomic():
+        conversation = get_conversation(sender.pk, recipient.pk)
+        message = Message.objects.create(
+            conversation=conversation, sender=sender, recipient=recipient, content=content
+        )
+        Conversation.objects.filter(pk=conversation.pk).update(
+            last_message=message, last_activity_at=message.created_at
+        )
+        Participant.objects.filter(conversation=conversation).update(last_activity_at=message.created_at)
+        Participant.objects.filter(conversation=conversation, user=recipient).update(
+            unread_count=F("unread_count") + 1
+        )
+        invalidate_users(recipient.pk)
+    return message
+
+
+def mark_read(user, conversation) -> int:
+    """
+    Mark the messages `user` received in `conversation` as read. Returns
+    how many were unread.
+    """
+    with transaction.atomic():
+        read = Message.objects.filter(conversation=conversation, recipient=user, is_read=False).update(
+            is_read=True
+        )
+        if read:
+            # Subtract rather than reset, so a message arriving meanwhile stays unread
+            Participant.objects.filter(conversation=conversation, user=user).update(
+                unread_count=F("unread_count") - read
+            )
+            invalidate_users(user.pk)
+    return read
+
+
+def inbox_page(user, cursor=None, page_size: int = 30):
+    """
+    Return (participants, next_cursor) for one page of `user`'s
+    conversations, most recent first, with the other user and the last
+    message loaded. Keyset-paginated like the photo galleries.
+    """
+    participants = Participant.objects.filter(user=user, last_activity_at__isnull=False).select_related(
+        "other_user__profile", "conversation__last_message"
+    )
+    return keyset_page(participants, "last_activity_at", cursor, page_size)
+
+
+def thread_page(conversation, before=None, page_size: int = 50):
+    """
+    Return (messages, older_cursor): the newest `page_size` messages of
+    `conversation` older than the cursor `before`, oldest first, and the
+    cursor for the page before them (None at the start of the thread).
+    """
+    # paged newest first, so the first page is the end of the thread
+    messages = conversation.messages.select_related("sender__profile")
+    page, older_cursor = keyset_page(messages, "created_at", before, page_size)
+    page.reverse()
+    return page, older_cursor
+
+
+def read_upto(user, conversation) -> int:
+    """The id of the newest message `user` sent in `conversation` that was read (0 if none)."""
+    return (
+        conversation.messages.filter(sender=user, is_read=True).aggregate(last=Max("id"))["last"] or 0
+    )
+
+
+def thread_updates(user, conversation, after_id: int, state):
+    """
+    What changed in an open thread since the last call: the messages after
+    `after_id`, and the new read receipt if the other user read anything.
+    `state` is what the previous call returned (None at first); the check
+    itself is a single lookup of the other participant.
+
+    Returns (messages, read_id or None, state). Messages delivered to
+    `user` here are marked read.
+    """
+    last_message_id, other_unread = (
+        Participant.objects.filter(conversation=conversation)
+        .exclude(user=user)
+        .values_list("conversation__last_message_id", "unread_count")
+        .get()
+    )
+    messages = []
+    if last_message_id and last_message_id > after_id:
+        messages = list(
+            conversation.messages.filter(id__gt=after_id).select_related("sender__profile").order_by("id")
+        )
+        if any(message.recipient_id == user.pk for message in messages):
+            mark_read(user, conversation)
+
+    read_id = None
+    if state is not None and other_unread < state:
+        read_id = read_upto(user, conversation)
+    return messages, read_id, other_unread
+
+
+def recount_conversation(conversation) -> None:
+    """
+    Recompute the last message, activity time and unread counts of a
+    conversation from its messages.
+    """
+    last = conversation.messages.order_by("-created_at", "-id").first()
+    Conversation.objects.filter(pk=conversation.pk).update(
+        last_message=last, last_activity_at=last.created_at if last else None
+    )
+    for participant in conversation.participants.all():
+        participant.unread_count = conversation.messages.filter(
+            recipient_id=participant.user_id, is_read=False
+        ).count()
+        participant.last_activity_at = last.created_at if last else None
+        participant.save(update_fields=["unread_count", "last_activity_at"])
+        invalidate_users(participant.user_id)
+
+
+def backfill_conversations() -> int:
+    """
+    Attach messages without a conversation to one and recount the
+    conversations they went into. Returns the number of messages attached.
+    """
+    pairs = {
+        tuple(sorted(pair))
+        for pair in Message.objects.filter(conversation__isnull=True)
+        .values_list("sender_id", "recipient_id")
+        .distinct()
+    }
+    attached = 0
+    for user_id, other_id in pairs:
+        with transaction.atomic():
+            conversation = get_conversation(user_id, other_id)
+            attached += Message.objects.filter(
+                Q(sender_id=user_id, recipient_id=other_id) | Q(sender_id=other_id, recipient_id=user_id),
+                conversation__isnull=True,
+            ).update(conversation=conversation)
+            recount_conversation(conversation)
+    return attached
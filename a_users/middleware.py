@@ -0,0 +1,16 @@
+from .presence import flush_if_due, seen
+
+
+class LastSeenMiddleware:
+    """Record when authenticated users were last active; see a_users.presence."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.user.is_authenticated:
+            seen(request.user.pk)
+        else:
+            flush_if_due()
+        return response
@@ -2,8 +2,9 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.conf import settings
 from datetime import date
+from a_core.imaging import ResponsiveImageMixin
 
-class Profile(models.Model):
+class Profile(ResponsiveImageMixin, models.Model):
     ROLE_PHOTOGRAPHER = "photographer"
     ROLE_MODEL = "model"
     ROLE_MUA = "mua"
@@ -15,8 +16,12 @@ class Profile(models.Model):
         (ROLE_VISITOR, "Visitor"),
     ]
 
+    # Avatars are stored as 320px squares and mostly shown at 32-64 CSS px
+    rendition_widths = {"thumb": 96, "medium": 160}
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='avatars/', null=True, blank=True)
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
     displayname = models.CharField(max_length=20, null=True, blank=True)
     info = models.TextField(null=True, blank=True)
     date_of_birth = models.DateField(null=True, blank=True, help_text="Required for age verification")
@@ -40,6 +45,11 @@ class Profile(models.Model):
         default=ROLE_VISITOR,
         help_text="Staff can set: photographer, model, mua, or visitor.",
     )
+    # Username, display name and email, lowercased and accent-folded for
+    # user search; maintained by a_users.search
+    search_name = models.CharField(max_length=400, blank=True, default="", editable=False)
+    # Last request of the user, to within LAST_SEEN_INTERVAL (a_users.presence)
+    last_seen_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
     
     def __str__(self):
         return str(self.user)
@@ -53,7 +63,13 @@ class Profile(models.Model):
     @property
     def avatar(self):
         if self.image:
-            return self.image.url
+            return self.image_url
+        return f'{settings.STATIC_URL}images/avatar.svg'
+
+    @property
+    def avatar_thumb(self):
+        if self.image:
+            return self.thumb_url
         return f'{settings.STATIC_URL}images/avatar.svg'
 
     @property
@@ -79,6 +95,23 @@ class Profile(models.Model):
         return self.is_adult and self.show_adult_content and not self.dob_change_pending
 
 
+class UserSearchTerm(models.Model):
+    """
+    One word of a user's search_name. Searching for a prefix is a range scan
+    over the term index, on any database.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="search_terms")
+    term = models.CharField(max_length=100)
+
+    class Meta:
+        unique_together = ("user", "term")
+        indexes = [models.Index(fields=["term", "user"])]
+
+    def __str__(self):
+        return self.term
+
+
 class DobChangeRequest(models.Model):
     STATUS_PENDING = "pending"
     STATUS_APPROVED = "approved"
@@ -154,7 +187,50 @@ class FriendRequest(models.Model):
         return f"{self.from_user.username} -> {self.to_user.username} ({self.status})"
 
 
+class Conversation(models.Model):
+    """
+    The messages between two users. Keeps a pointer to the newest message so
+    the inbox never has to look at the messages themselves.
+    """
+
+    # "<lower user id>:<higher user id>"; one conversation per pair
+    key = models.CharField(max_length=50, unique=True)
+    last_message = models.ForeignKey(
+        "Message", on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.key
+
+
+class Participant(models.Model):
+    """
+    One user's side of a conversation: who the other person is, how many
+    messages they have not read yet, and when the conversation last moved
+    (copied from the conversation so the inbox is a single index scan).
+    """
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="participants")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="conversation_memberships")
+    other_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    unread_count = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ("conversation", "user")
+        indexes = [models.Index(fields=["user", "-last_activity_at", "-id"])]
+
+    def __str__(self):
+        return f"{self.user} in {self.conversation}"
+
+
 class Message(models.Model):
+    # Filled in by a_users.conversations; older rows by its backfill
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, null=True, blank=True, related_name="messages"
+    )
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name="messages_sent")
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="messages_received")
     content = models.TextField()
@@ -163,6 +239,7 @@ class Message(models.Model):
 
     class Meta:
         ordering = ["created_at"]
+        indexes = [models.Index(fields=["conversation", "created_at"])]
 
     def __str__(self):
         return f"{self.sender.username} -> {self.recipient.username}: {self.content[:30]}"
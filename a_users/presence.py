@@ -0,0 +1,71 @@
+"""
+Last-seen tracking for the staff dashboard.
+
+LastSeenMiddleware calls seen() on every authenticated request. The shared
+cache remembers for LAST_SEEN_INTERVAL seconds that a user was seen, so
+each user is recorded at most once per interval across all processes; the
+rest of their requests cost one cache lookup. Recorded users wait, with
+the time they were seen, in a per-process buffer that is written to
+Profile.last_seen_at with a single UPDATE once per interval, so the
+database sees one write per process per interval however busy the site is.
+
+The buffer is flushed by whichever request, signed in or not, comes after
+the interval has passed (flush_if_due), and each user gets the time they
+were actually seen rather than the time of the flush. A process that exits
+loses at most one interval of sightings.
+"""
+from datetime import timedelta
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from .models import Profile
+
+
+_lock = threading.Lock()
+_pending = {}  # user id -> when they were seen
+_last_flush = time.monotonic()
+
+
+def seen(user_id) -> None:
+    """Note that `user_id` made a request now."""
+    if cache.add(f"last-seen:{user_id}", 1, settings.LAST_SEEN_INTERVAL):
+        with _lock:
+            _pending[user_id] = timezone.now()
+    flush_if_due()
+
+
+def flush_if_due() -> None:
+    """Flush the buffer if the last flush was an interval ago or more."""
+    if time.monotonic() - _last_flush >= settings.LAST_SEEN_INTERVAL:
+        flush()
+
+
+def flush() -> int:
+    """
+    Write the buffered sightings to the database. Returns the number of
+    users updated.
+    """
+    global _last_flush
+    with _lock:
+        sightings = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not sightings:
+        return 0
+    return Profile.objects.filter(user_id__in=list(sightings)).update(
+        last_seen_at=Case(
+            *(When(user_id=user_id, then=Value(at)) for user_id, at in sightings.items()),
+            output_field=DateTimeField(),
+        )
+    )
+
+
+def active_users(minutes: int):
+    """Profiles seen in the last `minutes`, most recent first."""
+    since = timezone.now() - timedelta(minutes=minutes)
+    return Profile.objects.filter(last_seen_at__gte=since).order_by("-last_seen_at")
@@ -0,0 +1,160 @@
+"""
+User directory search, shared by the friends page, the staff user list,
+the site search and the search box typeahead.
+
+Every profile keeps a normalized copy of the user's username, display name
+and email in Profile.search_name (lowercased, accents removed), so "jose"
+finds "José". How it is searched depends on the database:
+
+- PostgreSQL: substring matching on search_name through a pg_trgm GIN
+  index, ranked by trigram similarity.
+- Elsewhere: each query word has to be the start of one of the user's
+  words, found with a range scan over the UserSearchTerm index. Exact and
+  prefix username matches rank first.
+
+Signals on User and Profile keep both current; ensure_user_search_index()
+creates the trigram index and fills in profiles that were never indexed
+after every migrate.
+"""
+import re
+import unicodedata
+
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import Case, Exists, F, FloatField, Func, IntegerField, OuterRef, Value, When
+
+from .models import Profile, UserSearchTerm
+
+
+PROFILE_TABLE = Profile._meta.db_table
+TRGM_INDEX = f"{PROFILE_TABLE}_search_trgm"
+
+# Query words beyond this are ignored; every word has to match
+MAX_TERMS = 5
+TERM_LENGTH = UserSearchTerm._meta.get_field("term").max_length
+# Sorts after every character, so [term, term + TERM_END) holds all its extensions
+TERM_END = "\U0010ffff"
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text) -> str:
+    """Lowercase `text` and strip accents: "José" becomes "jose"."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def _terms(username, displayname, email):
+    """
+    The words a user can be found by, split the same way as queries
+    (query_terms), so "anne-marie" and "anne.marie@example.com" are found
+    word by word.
+    """
+    terms = {username}
+    for value in (username, displayname, email):
+        terms.update(_WORD.findall(value))
+    return {term[:TERM_LENGTH] for term in terms if term}
+
+
+def index_users(user_ids, force: bool = False) -> None:
+    """
+    Recompute search_name and the search terms of the given users, where
+    they changed (or all of them with `force`).
+    """
+    rows = Profile.objects.filter(user_id__in=list(user_ids)).values_list(
+        "pk", "user_id", "user__username", "displayname", "user__email", "search_name"
+    )
+    for profile_id, user_id, username, displayname, email, current in rows:
+        username, displayname, email = normalize(username), normalize(displayname), normalize(email)
+        search_name = " ".join(filter(None, (username, displayname, email)))
+        if search_name == current and not force:
+            continue
+        Profile.objects.filter(pk=profile_id).update(search_name=search_name)
+        UserSearchTerm.objects.filter(user_id=user_id).delete()
+        UserSearchTerm.objects.bulk_create(
+            UserSearchTerm(user_id=user_id, term=term) for term in _terms(username, displayname, email)
+        )
+
+
+def ensure_user_search_index(using="default") -> int:
+    """
+    Create the trigram index on PostgreSQL and index profiles that have no
+    search_name yet, or whose terms still hold whole email addresses (the
+    email used to be indexed unsplit). Returns the number of users indexed.
+    """
+    conn = connections[using]
+    if conn.vendor == "postgresql":
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {TRGM_INDEX} ON {PROFILE_TABLE} "
+                "USING gin (search_name gin_trgm_ops)"
+            )
+
+    missing = list(Profile.objects.using(using).filter(search_name="").values_list("user_id", flat=True))
+    for start in range(0, len(missing), 500):
+        index_users(missing[start:start + 500])
+    unsplit = list(
+        UserSearchTerm.objects.using(using).filter(term__contains="@").values_list("user_id", flat=True).distinct()
+    )
+    for start in range(0, len(unsplit), 500):
+        index_users(unsplit[start:start + 500], force=True)
+    return len(missing) + len(unsplit)
+
+
+def query_terms(q: str) -> list:
+    """
+    The normalized words of a search query, at most MAX_TERMS, split the
+    way user names are split when they are indexed (_terms).
+    """
+    return [term[:TERM_LENGTH] for term in _WORD.findall(normalize(q))[:MAX_TERMS]]
+
+
+def search_users(q: str, queryset=None):
+    """
+    Users in `queryset` (default: everyone) matching every word of `q`,
+    best matches first, with their profiles. Empty for an empty query.
+    """
+    queryset = (queryset if queryset is not None else User.objects.all()).select_related("profile")
+    terms = query_terms(q)
+    if not terms:
+        return queryset.none()
+
+    if connections[queryset.db].vendor == "postgresql":
+        for term in terms:
+            queryset = queryset.filter(profile__search_name__contains=term)
+        rank = Func(
+            F("profile__search_name"), Value(" ".join(terms)), function="similarity", output_field=FloatField()
+        )
+    else:
+        for term in terms:
+            queryset = queryset.filter(
+                Exists(
+                    UserSearchTerm.objects.filter(
+                        user=OuterRef("pk"), term__gte=term, term__lt=term + TERM_END
+                    )
+                )
+            )
+        rank = Case(
+            When(username=terms[0], then=Value(2)),
+            When(username__startswith=terms[0], then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    return queryset.annotate(rank=rank).order_by("-rank", "username")
+
+
+def paginate_users(queryset, page=1, page_size: int = 20):
+    """
+    Return (users, next_page) for page number `page` of ranked results;
+    next_page is None on the last page. No COUNT query is needed.
+    """
+    try:
+        page = max(1, int(page))
+    except (TypeError, ValueError):
+        page = 1
+    start = (page - 1) * page_size
+    users = list(queryset[start:start + page_size + 1])
+    if len(users) <= page_size:
+        return users, None
+    return users[:page_size], page + 1
@@ -1,8 +1,13 @@
 from django.dispatch import receiver
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
 from allauth.account.models import EmailAddress
 from django.contrib.auth.models import User
-from .models import Profile
+from a_core.imaging import rendition_names
+from a_tasks.tombstones import bury
+from .badges import invalidate_staff, invalidate_users
+from .conversations import backfill_conversations
+from .models import DobChangeRequest, FriendRequest, Profile
+from .search import ensure_user_search_index, index_users
 
 @receiver(post_save, sender=User)       
 def user_postsave(sender, instance, created, **kwargs):
@@ -29,9 +34,42 @@ def user_postsave(sender, instance, created, **kwargs):
                 primary = True,
                 verified = False
             )
+        # username or email may have changed; new users are indexed with their profile
+        index_users([user.pk])
         
         
 @receiver(pre_save, sender=User)
 def user_presave(sender, instance, **kwargs):
     if instance.username:
-        instance.username = instance.username.lower()
\ No newline at end of file
+        instance.username = instance.username.lower()
+
+
+@receiver(post_save, sender=Profile)
+def profile_postsave(sender, instance, **kwargs):
+    index_users([instance.user_id])
+
+
+@receiver(post_save, sender=FriendRequest)
+@receiver(post_delete, sender=FriendRequest)
+def friendrequest_changed(sender, instance, **kwargs):
+    invalidate_users(instance.to_user_id)
+
+
+@receiver(post_save, sender=DobChangeRequest)
+@receiver(post_delete, sender=DobChangeRequest)
+def dobchangerequest_changed(sender, instance, **kwargs):
+    invalidate_staff()
+
+
+@receiver(post_migrate)
+def prepare_user_tables(sender, using, **kwargs):
+    if sender.name == "a_users":
+        ensure_user_search_index(using)
+        # messages from before conversations existed
+        backfill_conversations()
+
+
+@receiver(post_delete, sender=Profile)
+def profile_postdelete(sender, instance, **kwargs):
+    # a_tasks buries the avatar itself; derivatives are not FileFields
+    bury(rendition_names(instance.renditions))
@@ -0,0 +1,23 @@
+import os
+
+from a_core.imaging import resize_image
+from a_tasks.queue import task
+
+from .models import Profile
+
+
+@task
+def process_avatar(profile_id: int, name: str):
+    """
+    Replace an uploaded avatar with the 320px square crop and build its
+    renditions. The original is buried (a_tasks.tombstones) once the row is saved.
+    """
+    profile = Profile.objects.filter(pk=profile_id).first()
+    if profile is None or profile.image.name != name:
+        return
+
+    base_name, _ext = os.path.splitext(os.path.basename(name))
+    with profile.image.open("rb") as fh, resize_image(fh, 320, "square") as processed:
+        profile.image.save(f"{base_name}_320.jpg", processed, save=False)
+        profile.save(update_fields=["image"])
+        profile.build_renditions(source=processed)
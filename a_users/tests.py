@@ -1,3 +1,398 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from a_portfolio.models import Category, Comment, Photo
+
+from . import presence
+from .conversations import backfill_conversations, mark_read, send_message
+from .models import Conversation, DobChangeRequest, FriendRequest, Message, Participant, Profile, UserSearchTerm
+from .search import ensure_user_search_index, search_users
+
+
+def _user(username, displayname=None, email="", role=Profile.ROLE_PHOTOGRAPHER):
+    user = User.objects.create_user(username=username, email=email, password="pass")
+    user.profile.displayname = displayname
+    user.profile.role = role
+    user.profile.save()
+    return user
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        self.jose = _user("jose", "José García", "jg@example.com")
+        self.josephine = _user("josephine", "Jo Baker", "baker@example.com")
+        self.other = _user("zoe", "Zoë", "zoe@example.com")
+
+    def test_accents_and_case_are_folded(self):
+        self.assertEqual(list(search_users("GARCIA")), [self.jose])
+        self.assertEqual(list(search_users("zoe")), [self.other])
+
+    def test_exact_username_ranks_first(self):
+        self.assertEqual(list(search_users("jose")), [self.jose, self.josephine])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(list(search_users("jo baker")), [self.josephine])
+        self.assertEqual(list(search_users("jo zoe")), [])
+
+    def test_index_follows_user_and_profile_changes(self):
+        self.other.email = "zed@elsewhere.org"
+        self.other.save()
+        self.assertEqual(list(search_users("zed@elsewhere.org")), [self.other])
+        self.assertNotIn(self.other, search_users("zoe@example.com"))
+
+        self.other.profile.displayname = "Zora"
+        self.other.profile.save()
+        self.assertEqual(list(search_users("zora")), [self.other])
+        self.assertEqual(list(search_users("zoë")), [self.other])  # still the username
+
+    def test_query_is_split_like_the_index(self):
+        anne = _user("annemarie", "Anne-Marie Dupont")
+        self.assertEqual(list(search_users("anne-marie")), [anne])
+        self.assertEqual(list(search_users("dupont, anne")), [anne])
+
+    def test_unsplit_emails_are_reindexed_after_migrate(self):
+        UserSearchTerm.objects.filter(user=self.other).exclude(term="zoe").delete()
+        UserSearchTerm.objects.create(user=self.other, term="zoe@example.com")
+        self.assertEqual(ensure_user_search_index(), 1)
+        self.assertEqual(list(search_users("zoe@example.com")), [self.other])
+        self.assertFalse(UserSearchTerm.objects.filter(term__contains="@").exists())
+
+    def test_user_deletion_drops_terms(self):
+        self.other.delete()
+        self.assertFalse(UserSearchTerm.objects.filter(user_id=self.other.pk).exists())
+
+    @override_settings(USER_SEARCH_PAGE_SIZE=1)
+    def test_friends_search_pages_and_excludes_friends_and_visitors(self):
+        _user("joan", role=Profile.ROLE_VISITOR)
+        friend = _user("joanna")
+        me = _user("me")
+        me.profile.friends.add(friend.profile)
+
+        client = Client()
+        client.login(username="me", password="pass")
+        seen = []
+        resp = client.get(reverse("friends"), {"q": "jo"})
+        while True:
+            seen.extend(resp.context["search_results"])
+            if not resp.context["next_page_url"]:
+                break
+            resp = client.get(resp.context["next_page_url"])
+        self.assertEqual(seen, [self.jose, self.josephine])
+
+    def test_typeahead_returns_suggestions(self):
+        resp = Client().get(reverse("user-typeahead"), {"q": "josep"})
+        self.assertTemplateUsed(resp, "a_users/partials/user_suggestions.html")
+        self.assertEqual(list(resp.context["users"]), [self.josephine])
+
+
+class ConversationTests(TestCase):
+    def setUp(self):
+        self.alice = _user("alice")
+        self.bob = _user("bob")
+        self.carol = _user("carol")
+        for other in (self.bob, self.carol):
+            self.alice.profile.friends.add(other.profile)
+        self.client = Client()
+        self.client.login(username="alice", password="pass")
+
+    def _participant(self, user, other):
+        return Participant.objects.get(user=user, other_user=other)
+
+    def test_sending_and_reading_update_the_counters(self):
+        send_message(self.bob, self.alice, "one")
+        send_message(self.bob, self.alice, "two")
+        last = send_message(self.alice, self.bob, "three")
+
+        mine = self._participant(self.alice, self.bob)
+        self.assertEqual(mine.unread_count, 2)
+        self.assertEqual(self._participant(self.bob, self.alice).unread_count, 1)
+        self.assertEqual(mine.conversation.last_message, last)
+
+        self.client.get(reverse("message-thread", args=["bob"]))
+        self.assertEqual(self._participant(self.alice, self.bob).unread_count, 0)
+        self.assertEqual(self._participant(self.bob, self.alice).unread_count, 1)
+
+    @override_settings(MESSAGES_INBOX_PAGE_SIZE=1)
+    def test_inbox_lists_most_recent_conversation_first(self):
+        send_message(self.bob, self.alice, "hi")
+        send_message(self.carol, self.alice, "hello")
+
+        seen = []
+        resp = self.client.get(reverse("messages"))
+        while True:
+            seen.extend(thread.other_user for thread in resp.context["threads"])
+            if not resp.context["next_page_url"]:
+                break
+            resp = self.client.get(resp.context["next_page_url"])
+        self.assertEqual(seen, [self.carol, self.bob])
+
+    def test_backfill_builds_conversations_from_old_messages(self):
+        Message.objects.create(sender=self.bob, recipient=self.alice, content="old", is_read=True)
+        newest = Message.objects.create(sender=self.bob, recipient=self.alice, content="older unread")
+        Message.objects.create(sender=self.carol, recipient=self.alice, content="hi")
+        Message.objects.filter(pk=newest.pk).update(created_at=newest.created_at.replace(year=2100))
+
+        self.assertEqual(backfill_conversations(), 3)
+        self.assertEqual(backfill_conversations(), 0)
+        self.assertEqual(Conversation.objects.count(), 2)
+        mine = self._participant(self.alice, self.bob)
+        self.assertEqual(mine.unread_count, 1)
+        self.assertEqual(mine.conversation.last_message, newest)
+
+
+@override_settings(MESSAGES_STREAM_TIMEOUT=0, MESSAGES_STREAM_POLL_INTERVAL=0)
+class MessageThreadTests(TestCase):
+    def setUp(self):
+        self.alice = _user("alice")
+        self.bob = _user("bob")
+        self.alice.profile.friends.add(self.bob.profile)
+        self.client.force_login(self.alice)
+
+    @override_settings(MESSAGES_THREAD_PAGE_SIZE=2)
+    def test_older_pages_walk_back_through_the_thread(self):
+        sent = [send_message(self.bob, self.alice, f"message {i}") for i in range(5)]
+        resp = self.client.get(reverse("message-thread", args=["bob"]))
+        pages = [resp.context["messages_thread"]]
+        while resp.context["older_page_url"]:
+            resp = self.client.get(resp.context["older_page_url"], HTTP_HX_REQUEST="true")
+            self.assertTemplateUsed(resp, "a_users/partials/thread_page.html")
+            pages.insert(0, resp.context["messages_thread"])
+        self.assertEqual([m for page in pages for m in page], sent)
+
+    def test_htmx_send_returns_the_new_message(self):
+        resp = self.client.post(
+            reverse("message-thread", args=["bob"]), {"content": "hello"}, HTTP_HX_REQUEST="true"
+        )
+        self.assertTemplateUsed(resp, "a_users/partials/message.html")
+        self.assertContains(resp, "hello")
+        self.assertEqual(self.bob.messages_received.get().content, "hello")
+
+    def test_strangers_cannot_open_the_stream(self):
+        _user("mallory")
+        resp = self.client.get(reverse("message-stream", args=["mallory"]))
+        self.assertEqual(resp.status_code, 403)
+
+    def test_stream_with_yourself_is_rejected(self):
+        resp = self.client.get(reverse("message-stream", args=["alice"]))
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(Conversation.objects.exists())
+
+    async def _stream(self, user, username, last_event_id):
+        await self.async_client.aforce_login(user)
+        resp = await self.async_client.get(
+            reverse("message-stream", args=[username]), headers={"Last-Event-ID": str(last_event_id)}
+        )
+        self.assertEqual(resp["Content-Type"], "text/event-stream")
+        return resp.streaming_content
+
+    async def test_stream_delivers_new_messages(self):
+        earlier = await sync_to_async(send_message)(self.alice, self.bob, "seen already")
+        incoming = await sync_to_async(send_message)(self.bob, self.alice, "are you there?")
+
+        stream = await self._stream(self.alice, "bob", earlier.pk)
+        events = b"".join([chunk async for chunk in stream]).decode()
+        self.assertIn(f"id: {incoming.pk}\nevent: message\n", events)
+        self.assertIn("are you there?", events)
+        self.assertNotIn("seen already", events)
+        # delivered while the thread is open, so it counts as read
+        unread = Participant.objects.filter(user=self.alice).values_list("unread_count", flat=True)
+        self.assertEqual(await unread.aget(), 0)
+
+    @override_settings(MESSAGES_STREAM_TIMEOUT=5)
+    async def test_stream_sends_read_receipts(self):
+        sent = await sync_to_async(send_message)(self.bob, self.alice, "are you there?")
+        conversation = await Conversation.objects.aget()
+
+        stream = await self._stream(self.bob, "alice", sent.pk)
+        chunks = [await anext(stream)]  # the stream has taken stock of the unread count
+        await sync_to_async(mark_read)(self.alice, conversation)
+        async for chunk in stream:
+            chunks.append(chunk)
+            if b"event: read" in chunk:
+                break
+        self.assertIn(f"event: read\ndata: {sent.pk}\n", b"".join(chunks).decode())
+
+
+class HeaderBadgeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = _user("alice")
+        self.bob = _user("bob")
+        self.alice.profile.friends.add(self.bob.profile)
+        self.client.force_login(self.alice)
+
+    def _badges(self):
+        return self.client.get(reverse("profile")).context["badges"]
+
+    def _badge_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("profile"))
+        return [q["sql"] for q in queries if "a_users_participant" in q["sql"] or "friendrequest" in q["sql"]]
+
+    def test_counts_are_cached_until_they_change(self):
+        self.assertEqual(self._badges().alerts, 0)
+        self.assertEqual(self._badge_queries(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            send_message(self.bob, self.alice, "hi")
+        self.assertEqual(self._badges().messages, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FriendRequest.objects.create(from_user=_user("carol"), to_user=self.alice)
+        badges = self._badges()
+        self.assertEqual((badges.messages, badges.friend_requests, badges.alerts), (1, 1, 2))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse("message-thread", args=["bob"]))
+        self.assertEqual(self._badges().messages, 0)
+
+    def test_staff_see_pending_dob_requests(self):
+        self.alice.is_staff = True
+        self.alice.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            DobChangeRequest.objects.create(user=self.bob, requested_dob="2000-01-01")
+        self.assertEqual(self._badges().dob_requests, 1)
+
+    def test_htmx_partials_count_nothing(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("user-typeahead"), {"q": "bob"})
+        self.assertFalse([q for q in queries if "a_users_participant" in q["sql"]])
+
+
+class LastSeenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        presence.flush()
+        self.alice = _user("alice")
+        self.client.force_login(self.alice)
+
+    def _profile_updates(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        return [q for q in queries if q["sql"].startswith("UPDATE") and "last_seen_at" in q["sql"]]
+
+    def test_requests_are_recorded_once_per_interval_in_one_update(self):
+        self.assertEqual(self._profile_updates(reverse("profile")), [])
+        self.assertEqual(self._profile_updates(reverse("friends")), [])
+        self.assertEqual(list(presence._pending), [self.alice.pk])
+
+        self.assertEqual(presence.flush(), 1)
+        self.alice.profile.refresh_from_db()
+        self.assertIsNotNone(self.alice.profile.last_seen_at)
+
+        # seen in this interval already
+        self.client.get(reverse("profile"))
+        self.assertEqual(presence._pending, {})
+
+    def test_any_request_flushes_each_users_own_sighting(self):
+        bob = _user("bob")
+        earlier = timezone.now() - timedelta(seconds=30)
+        with mock.patch("a_users.presence.timezone.now", return_value=earlier):
+            presence.seen(self.alice.pk)
+        presence.seen(bob.pk)
+
+        # an interval later, an anonymous visitor's request writes the buffer
+        with mock.patch.object(presence, "_last_flush", presence._last_flush - settings.LAST_SEEN_INTERVAL):
+            self.client.logout()
+            self.client.get(reverse("home"))
+        self.assertEqual(presence._pending, {})
+        self.assertEqual(Profile.objects.get(user=self.alice).last_seen_at, earlier)
+        self.assertGreater(Profile.objects.get(user=bob).last_seen_at, earlier)
+
+    def test_dashboard_counts_users_seen_in_the_window(self):
+        staff = _user("staff")
+        staff.is_staff = True
+        staff.save()
+        self.client.force_login(staff)
+        self.client.get(reverse("profile"))
+        presence.flush()
+        Profile.objects.filter(user=self.alice).update(last_seen_at="2000-01-01T00:00:00Z")
+
+        resp = self.client.get(reverse("admin-dashboard"))
+        self.assertEqual(resp.context["active_count"], 1)
+        self.assertEqual(resp.context["active_users"], [staff])
+
+
+@override_settings(ADMIN_LIST_PAGE_SIZE=2)
+class AdminListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = _user("staff")
+        self.staff.is_staff = True
+        self.staff.save()
+        self.owner = _user("owner")
+        self.client.force_login(self.staff)
+
+    def _photo(self, title, category=None):
+        return Photo.objects.create(owner=self.owner, title=title, image=f"portfolio/{title}.jpg", category=category)
+
+    def test_photos_are_paged_newest_first(self):
+        photos = [self._photo(f"p{i}") for i in range(5)]
+        resp = self.client.get(reverse("admin-photos"))
+        self.assertEqual((resp.context["pager"]["count"], resp.context["pager"]["count_capped"]), (5, False))
+        seen = list(resp.context["photos"])
+        while resp.context["pager"]["next_page_url"]:
+            resp = self.client.get(resp.context["pager"]["next_page_url"])
+            self.assertIsNotNone(resp.context["pager"]["first_page_url"])
+            seen.extend(resp.context["photos"])
+        self.assertEqual(seen, photos[::-1])
+        self.assertEqual(self.client.get(reverse("admin-photos"), {"cursor": "nonsense"}).status_code, 400)
+
+    def test_user_search_is_paged_by_number(self):
+        for name in ("ann", "anna", "annabel"):
+            _user(name)
+        resp = self.client.get(reverse("admin-users"), {"search": "ann"})
+        seen = list(resp.context["users"])
+        resp = self.client.get(resp.context["pager"]["next_page_url"])
+        seen.extend(resp.context["users"])
+        self.assertEqual([user.username for user in seen], ["ann", "anna", "annabel"])
+        self.assertIsNone(resp.context["pager"]["next_page_url"])
+        self.assertEqual(self.client.get(reverse("admin-categories")).status_code, 200)
+
+    @override_settings(ADMIN_LIST_COUNT_LIMIT=2)
+    def test_filtered_counts_are_capped(self):
+        for i in range(3):
+            self._photo(f"sunset {i}")
+        pager = self.client.get(reverse("admin-photos"), {"search": "sunset"}).context["pager"]
+        self.assertEqual((pager["count"], pager["count_capped"]), (2, True))
+
+    def test_category_filter_is_cached_until_photos_move(self):
+        beach = Category.objects.create(name="Beach")
+        city = Category.objects.create(name="City")
+        photo = self._photo("waves", beach)
+        self.assertEqual(self.client.get(reverse("admin-photos")).context["categories"], [("beach", "Beach")])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("admin-photos"))
+        self.assertFalse([q for q in queries if "a_portfolio_category" in q["sql"] and "EXISTS" in q["sql"]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.category = city
+            photo.save()
+        self.assertEqual(self.client.get(reverse("admin-photos")).context["categories"], [("city", "City")])
+
+    def test_filter_typeaheads_only_offer_candidates(self):
+        photo = self._photo("harbour")
+        Comment.objects.create(photo=photo, user=_user("commenter"), content="Nice")
+        _user("bystander")
+
+        resp = self.client.get(reverse("admin-filter-options", args=["owners"]), {"owner": "o"})
+        self.assertEqual([value for value, _ in resp.context["options"]], ["owner"])
+        resp = self.client.get(reverse("admin-filter-options", args=["commenters"]), {"user": "c"})
+        self.assertEqual([value for value, _ in resp.context["options"]], ["commenter"])
+        resp = self.client.get(reverse("admin-filter-options", args=["photos"]), {"photo": "harb"})
+        self.assertEqual(resp.context["options"], [(photo.pk, "harbour")])
+        self.assertEqual(self.client.get(reverse("admin-filter-options", args=["nope"])).status_code, 404)
+
+        resp = self.client.get(reverse("admin-comments"), {"photo": photo.pk})
+        self.assertEqual(len(resp.context["comments"]), 1)
@@ -12,12 +12,14 @@ urlpatterns = [
     path('emailverify/', profile_emailverify, name="profile-emailverify"),
     path('delete/', profile_delete_view, name="profile-delete"),
     path('friends/', friends_view, name="friends"),
+    path('search/', user_typeahead, name="user-typeahead"),
     path('friends/request/<int:user_id>/', friend_request_send, name="friend-request-send"),
     path('friends/request/<int:request_id>/accept/', friend_request_accept, name="friend-request-accept"),
     path('friends/request/<int:request_id>/decline/', friend_request_decline, name="friend-request-decline"),
     path('friends/<str:username>/', friend_detail, name="friend-detail"),
     path('messages/', messages_view, name="messages"),
     path('messages/<str:username>/', message_thread, name="message-thread"),
+    path('messages/<str:username>/stream/', message_stream, name="message-stream"),
     # Admin routes
     path('admin/', admin_views.admin_dashboard, name="admin-dashboard"),
     path('admin/users/', admin_views.admin_users, name="admin-users"),
@@ -32,6 +34,7 @@ urlpatterns = [
     path('admin/categories/', admin_views.admin_categories, name="admin-categories"),
     path('admin/categories/<int:category_id>/edit/', admin_views.admin_category_edit, name="admin-category-edit"),
     path('admin/categories/<int:category_id>/delete/', admin_views.admin_category_delete, name="admin-category-delete"),
+    path('admin/filters/<str:facet>/', admin_views.admin_filter_options, name="admin-filter-options"),
     path('admin/dob-requests/', admin_views.admin_dob_requests, name="admin-dob-requests"),
     path('admin/dob-requests/<int:req_id>/<str:decision>/', admin_views.admin_dob_request_resolve, name="admin-dob-request-resolve"),
 ]
\ No newline at end of file
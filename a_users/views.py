@@ -1,52 +1,37 @@
+import asyncio
+from urllib.parse import urlencode
+import time
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.urls import reverse
 from allauth.account.utils import send_email_confirmation
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import logout
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.db.models import Q
-from django.core.files.base import ContentFile
-from io import BytesIO
-import os
-from PIL import Image
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from .forms import *
-from .models import FriendRequest, Message, DobChangeRequest, AuditLog
+from .conversations import (
+    get_conversation,
+    inbox_page,
+    mark_read,
+    send_message,
+    thread_page,
+    thread_updates,
+)
+from .models import FriendRequest, DobChangeRequest, AuditLog
+from .search import paginate_users, search_users
+from .tasks import process_avatar
 from a_portfolio.models import Photo
-
-def _resize_avatar(file_obj, size: int = 320) -> ContentFile:
-    """
-    Resize an image to a square of `size` x `size` pixels.
-    Crops to center square first, then resizes. Returns a ContentFile ready to be saved.
-    """
-    img = Image.open(file_obj)
-    img = img.convert("RGB")
-
-    width, height = img.size
-    
-    # Crop to square (center crop)
-    if width > height:
-        # Landscape: crop width
-        left = (width - height) // 2
-        right = left + height
-        img = img.crop((left, 0, right, height))
-    elif height > width:
-        # Portrait: crop height
-        top = (height - width) // 2
-        bottom = top + width
-        img = img.crop((0, top, width, bottom))
-    # If already square, no crop needed
-    
-    # Resize to target size
-    if img.size[0] != size:
-        img = img.resize((size, size), Image.LANCZOS)
-    
-    # Save to buffer
-    buffer = BytesIO()
-    img.save(buffer, format="JPEG", quality=90)
-    buffer.seek(0)
-    return ContentFile(buffer.read())
-
+from a_portfolio.pagination import InvalidCursor
+from a_stats import stats
+from a_tasks import tombstones
 
 def profile_view(request, username=None):
     if username:
@@ -69,17 +54,11 @@ def profile_edit_view(request):
             profile = form.save(commit=False)
             old_role = profile.role
             
-            # Resize avatar image if uploaded
-            if 'image' in request.FILES:
-                image_file = request.FILES['image']
-                processed = _resize_avatar(image_file, size=320)
-                base_name, _ext = os.path.splitext(image_file.name)
-                filename = f"{base_name}_320.jpg"
-                # Save the resized image directly to the profile
-                profile.image.save(filename, processed, save=False)
-            
-            # Save the profile with all changes (including the resized image if uploaded)
+            # Save the profile with all changes; an uploaded avatar is stored
+            # as-is and cropped/resized by a background job
             profile.save()
+            if 'image' in request.FILES:
+                process_avatar.enqueue(profile.pk, profile.image.name)
             # Save many-to-many fields if any (form.save_m2m() is only needed if commit=False and there are M2M fields)
             
             # Audit role change
@@ -143,20 +122,26 @@ def friends_view(request):
 
     # Search users (exclude self and existing friends)
     search_results = []
+    next_page_url = None
     if q:
-        search_results = (
-            User.objects.filter(
-                Q(username__icontains=q)
-                | Q(profile__displayname__icontains=q)
-                | Q(email__icontains=q)
-            )
-            .exclude(id=request.user.id)
+        candidates = (
+            User.objects.exclude(id=request.user.id)
             .exclude(profile__role=Profile.ROLE_VISITOR)
-            .exclude(id__in=friends.values_list("user_id", flat=True))
-            .distinct()
-            .select_related("profile")
-            .order_by("username")
+            .exclude(
+                Exists(
+                    Profile.friends.through.objects.filter(
+                        from_profile=profile, to_profile__user=OuterRef("pk")
+                    )
+                )
+            )
+        )
+        search_results, next_page = paginate_users(
+            search_users(q, candidates), request.GET.get("page"), settings.USER_SEARCH_PAGE_SIZE
         )
+        if next_page:
+            query = request.GET.copy()
+            query["page"] = next_page
+            next_page_url = f"{request.path}?{query.urlencode()}"
 
     # Friend requests
     incoming = (
@@ -179,10 +164,21 @@ def friends_view(request):
             "outgoing": outgoing,
             "search_query": q,
             "search_results": search_results,
+            "next_page_url": next_page_url,
         },
     )
 
 
+def user_typeahead(request):
+    """
+    Suggestions for a user search box while typing (HTMX): the best few
+    matches for `q`, same ranking as the search pages.
+    """
+    q = request.GET.get("q", "").strip()
+    users = search_users(q)[: settings.USER_SEARCH_TYPEAHEAD_LIMIT] if q else []
+    return render(request, "a_users/partials/user_suggestions.html", {"users": users, "query": q})
+
+
 @login_required
 def friend_detail(request, username):
     target_user = get_object_or_404(User.objects.select_related("profile"), username=username)
@@ -194,17 +190,13 @@ def friend_detail(request, username):
         return HttpResponseForbidden("You are not connected with this user.")
 
     # Photos of target user filtered by visibility relative to the requester
-    photos = Photo.objects.filter(owner=target_user)
-    viewer_profile = getattr(request.user, "profile", None)
-    photos = photos.filter(
-        Q(visibility=Photo.VISIBILITY_PUBLIC)
-        | Q(visibility=Photo.VISIBILITY_AUTH)
-        | Q(
-            visibility=Photo.VISIBILITY_FRIENDS,
-            allowed_friends__in=[viewer_profile] if viewer_profile else [],
-        )
-        | Q(owner=request.user)
-    ).distinct().select_related("category", "owner", "owner__profile").order_by("-captured_on", "-created_at")
+    photos = (
+        Photo.objects.visible_to(request.user)
+        .with_viewer_state(request.user)
+        .filter(owner=target_user)
+        .select_related("category", "owner", "owner__profile")
+        .order_by("-captured_on", "-created_at")
+    )
 
     return render(
         request,
@@ -216,39 +208,128 @@ def friend_detail(request, username):
     )
 
 
+def _thread_target(user, username):
+    """
+    The user at the other end of `user`'s thread with `username`. Raises
+    Http404 for unknown users and PermissionDenied unless they are friends.
+    """
+    target_user = get_object_or_404(User.objects.select_related("profile"), username=username)
+    if target_user != user and not user.profile.friends.filter(user=target_user).exists():
+        raise PermissionDenied("You are not connected with this user.")
+    return target_user
+
+
 @login_required
 def message_thread(request, username):
-    target_user = get_object_or_404(User.objects.select_related("profile"), username=username)
+    """
+    The newest page of a conversation, or (HTMX with ?before=) the page of
+    older messages before it. New messages arrive through message_stream;
+    a message sent with HTMX comes back as its own fragment.
+    """
+    target_user = _thread_target(request.user, username)
     if target_user == request.user:
         return redirect("messages")
 
-    # Must be friends
-    if not request.user.profile.friends.filter(user=target_user).exists():
-        return HttpResponseForbidden("You are not connected with this user.")
-
     if request.method == "POST":
         content = request.POST.get("content", "").strip()
-        if content:
-            Message.objects.create(sender=request.user, recipient=target_user, content=content)
+        if not request.htmx:
+            if content:
+                send_message(request.user, target_user, content)
             return redirect("message-thread", username=target_user.username)
-
-    messages_thread = Message.objects.filter(
-        Q(sender=request.user, recipient=target_user) | Q(sender=target_user, recipient=request.user)
-    ).select_related("sender__profile", "recipient__profile").order_by("created_at")
+        if not content:
+            return HttpResponseBadRequest("Empty message.")
+        message = send_message(request.user, target_user, content)
+        return render(request, "a_users/partials/message.html", {"msg": message})
+
+    conversation = get_conversation(request.user.pk, target_user.pk)
+    before = request.GET.get("before")
+    try:
+        messages_thread, older_cursor = thread_page(
+            conversation, before, page_size=settings.MESSAGES_THREAD_PAGE_SIZE
+        )
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid page cursor.")
+
+    older_page_url = None
+    if older_cursor:
+        older_page_url = f"{request.path}?{urlencode({'before': older_cursor})}"
+    context = {
+        "target_user": target_user,
+        "messages_thread": messages_thread,
+        "older_page_url": older_page_url,
+    }
+    if request.htmx and before:
+        return render(request, "a_users/partials/thread_page.html", context)
 
     # Mark received messages as read
-    Message.objects.filter(sender=target_user, recipient=request.user, is_read=False).update(is_read=True)
-
+    mark_read(request.user, conversation)
+    last_id = messages_thread[-1].pk if messages_thread else 0
     return render(
         request,
         "a_users/message_thread.html",
         {
-            "target_user": target_user,
-            "messages_thread": messages_thread,
+            **context,
+            "stream_url": f"{reverse('message-stream', args=[target_user.username])}?after={last_id}",
         },
     )
 
 
+def _sse(event, data, event_id=None) -> str:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in str(data).splitlines() or [""])
+    return "\n".join(lines) + "\n\n"
+
+
+@login_required
+async def message_stream(request, username):
+    """
+    Server-Sent Events for an open thread: "message" events carry the HTML
+    of new messages, "read" events the id of the newest message of ours the
+    other user has read. The stream ends after MESSAGES_STREAM_TIMEOUT
+    seconds; EventSource reconnects and resumes from the Last-Event-ID it
+    was given, so a worker is never held for good.
+
+    This view needs the ASGI entry point (a_core.asgi); under WSGI the
+    response would only be sent once it ends.
+    """
+    user = await request.auser()
+    target_user = await sync_to_async(_thread_target)(user, username)
+    if target_user == user:
+        return HttpResponseBadRequest("There is no conversation with yourself.")
+    conversation = await sync_to_async(get_conversation)(user.pk, target_user.pk)
+    try:
+        after_id = int(request.headers.get("Last-Event-ID") or request.GET.get("after") or 0)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid message id.")
+
+    def render_message(message):
+        return render_to_string("a_users/partials/message.html", {"msg": message, "user": user})
+
+    async def events():
+        nonlocal after_id
+        deadline = time.monotonic() + settings.MESSAGES_STREAM_TIMEOUT
+        updates = sync_to_async(thread_updates)
+        new, read_id, state = await updates(user, conversation, after_id, None)
+        yield f"retry: {settings.MESSAGES_STREAM_RETRY_MS}\n\n"
+        while True:
+            for message in new:
+                after_id = message.pk
+                yield _sse("message", await sync_to_async(render_message)(message), message.pk)
+            if read_id:
+                yield _sse("read", read_id)
+            if time.monotonic() >= deadline:
+                return
+            await asyncio.sleep(settings.MESSAGES_STREAM_POLL_INTERVAL)
+            new, read_id, state = await updates(user, conversation, after_id, state)
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # nginx would otherwise buffer the events
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 @login_required
 def friend_request_send(request, user_id):
     target = get_object_or_404(User, id=user_id)
@@ -301,37 +382,25 @@ def friend_request_decline(request, request_id):
 @login_required
 def messages_view(request):
     """
-    Inbox-style view: show conversations (distinct users) with last message and unread counts.
+    Inbox-style view: conversations, most recent first, with their last
+    message and unread count. See a_users.conversations.
     """
-    # Get conversations where the user is sender or recipient
-    conversations = (
-        Message.objects.filter(Q(sender=request.user) | Q(recipient=request.user))
-        .select_related("sender__profile", "recipient__profile")
-        .order_by("-created_at")
-    )
-
-    threads = {}
-    for msg in conversations:
-        other = msg.recipient if msg.sender == request.user else msg.sender
-        if other.id not in threads:
-            threads[other.id] = {
-                "user": other,
-                "last_message": msg,
-                "unread_count": 0,
-            }
-        # Count unread from other -> current user
-        if msg.recipient == request.user and not msg.is_read:
-            threads[other.id]["unread_count"] += 1
-
-    # Sort threads by last message time descending
-    thread_list = sorted(
-        threads.values(), key=lambda t: t["last_message"].created_at, reverse=True
-    )
+    cursor = request.GET.get("cursor")
+    try:
+        threads, next_cursor = inbox_page(request.user, cursor, page_size=settings.MESSAGES_INBOX_PAGE_SIZE)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid page cursor.")
+
+    next_page_url = None
+    if next_cursor:
+        query = request.GET.copy()
+        query["cursor"] = next_cursor
+        next_page_url = f"{request.path}?{query.urlencode()}"
 
     return render(
         request,
         "a_users/messages.html",
-        {"threads": thread_list},
+        {"threads": threads, "next_page_url": next_page_url},
     )
 
 
@@ -379,7 +448,9 @@ def profile_delete_view(request):
     user = request.user
     if request.method == "POST":
         logout(request)
-        user.delete()
+        # the user's photos, comments and transfers go with them
+        with transaction.atomic(), stats.batched(), tombstones.batched():
+            user.delete()
         messages.success(request, 'Account deleted, what a pity')
         return redirect('home')
     